@@ -21,15 +21,29 @@ class PlaceholderProperties(PropertyGroup):
     #This will let the plugin track what objects belong to what character
     character_name: StringProperty(default='')
 
-    #this lets the plugin time various actions
-    total_timer : FloatProperty(default=0)
-    timer : FloatProperty(default=0)
-    
     bake_mult: IntProperty(
         min=1, max = 6,
         default=1,
         description=t('bake_mult_tt'))
 
+    memory_budget : IntProperty(
+    description=t('memory_budget_tt'),
+    min = 0,
+    default = bpy.context.preferences.addons[__package__].preferences.memory_budget)
+
+    bake_workers : IntProperty(
+    description=t('bake_workers_tt'),
+    min = 1, max = 16,
+    default = bpy.context.preferences.addons[__package__].preferences.bake_workers)
+
+    adaptive_bake : BoolProperty(
+    description=t('adaptive_bake_tt'),
+    default = bpy.context.preferences.addons[__package__].preferences.adaptive_bake)
+
+    aov_bake : BoolProperty(
+    description=t('aov_bake_tt'),
+    default = bpy.context.preferences.addons[__package__].preferences.aov_bake)
+
     sfw_mode : BoolProperty(
     description=t('sfw_mode_tt'),
     default = bpy.context.preferences.addons[__package__].preferences.sfw_mode)
@@ -37,6 +51,10 @@ class PlaceholderProperties(PropertyGroup):
     fix_seams : BoolProperty(
     description=t('seams_tt'),
     default = bpy.context.preferences.addons[__package__].preferences.fix_seams)
+
+    clamp_shapekeys : BoolProperty(
+    description=t('clamp_shapekeys_tt'),
+    default = bpy.context.preferences.addons[__package__].preferences.clamp_shapekeys)
     
     use_single_outline : BoolProperty(
     description= t('outline_tt'),
@@ -105,6 +123,11 @@ class PlaceholderProperties(PropertyGroup):
     description=t('use_atlas_tt'),
     default = bpy.context.preferences.addons[__package__].preferences.use_atlas)
 
+    atlas_page_size : IntProperty(
+    description=t('atlas_page_size_tt'),
+    min = 1024, max = 16384,
+    default = bpy.context.preferences.addons[__package__].preferences.atlas_page_size)
+
     animation_library_scale : BoolProperty(
     description=t('animation_library_scale_tt'),
     default = True)
@@ -246,6 +269,11 @@ class IMPORTING_PT_panel(bpy.types.Panel):
         split.prop(context.scene.kkbp, "use_single_outline", toggle=True, text = t('outline'))
         split.prop(context.scene.kkbp, "sfw_mode", toggle=True, text = t('sfw_mode'))
         row.enabled = scene.plugin_state not in ['imported', 'prepped']
+
+        row = col.row(align=True)
+        split = row.split(align = True, factor=splitfac)
+        split.prop(context.scene.kkbp, "clamp_shapekeys", toggle=True, text = t('clamp_shapekeys'))
+        row.enabled = scene.plugin_state not in ['imported', 'prepped']
         
         col = box.column(align=True)
         row = col.row(align=True)
@@ -262,6 +290,16 @@ class IMPORTING_PT_panel(bpy.types.Panel):
         split.prop(context.scene.kkbp, 'old_bake_bool', toggle=True, text = t('old_bake'))
         split.prop(context.scene.kkbp, "bake_mult", text = t('bake_mult'))
         row.enabled = scene.plugin_state in ['imported', 'prepped']
+        row = col.row(align=True)
+        split = row.split(align=True, factor=splitfac)
+        split.prop(context.scene.kkbp, "bake_workers", text = t('bake_workers'))
+        split.prop(context.scene.kkbp, "memory_budget", text = t('memory_budget'))
+        row.enabled = scene.plugin_state in ['imported', 'prepped']
+        row = col.row(align=True)
+        split = row.split(align=True, factor=splitfac)
+        split.prop(context.scene.kkbp, "adaptive_bake", toggle=True, text = t('adaptive_bake'))
+        split.prop(context.scene.kkbp, "aov_bake", toggle=True, text = t('aov_bake'))
+        row.enabled = scene.plugin_state in ['imported', 'prepped']
         row = col.row(align = True)
         split = row.split(align=True, factor=splitfac)
         if globs.pil_exist == 'no':
@@ -276,6 +314,10 @@ class IMPORTING_PT_panel(bpy.types.Panel):
             split.operator('kkbp.resetmaterials', text = t('reset_mats'), icon='RECOVER_LAST')
 
         row.enabled = scene.plugin_state in ['imported', 'prepped']
+        if globs.pil_exist == 'yup':
+            row = col.row(align = True)
+            row.prop(context.scene.kkbp, "atlas_page_size", text = t('atlas_page_size'))
+            row.enabled = scene.plugin_state in ['imported', 'prepped'] and scene.use_atlas
 
 class EXPORTING_PT_panel(bpy.types.Panel):
     bl_parent_id = "IMPORTING_PT_panel"
@@ -1,4 +1,5 @@
-import bpy, json, datetime, traceback
+import bpy, json, traceback, time, contextlib, tracemalloc
+import numpy as np
 from pathlib import Path
 
 def toggle_console():
@@ -199,18 +200,507 @@ def get_outfit_materials() -> list[bpy.types.Material]:
     materials = [m for m in bpy.data.materials if m.get('outfit') and m.get('name') == bpy.context.scene.kkbp.character_name]
     return materials
 
+#the timers use perf_counter so they don't wrap around every hour like the wall clock minutes and seconds did
+_timer = {'total': time.perf_counter(), 'step': time.perf_counter(), 'cpu': time.process_time(), 'ops': 0}
+
 def initialize_timer():
-    bpy.context.scene.kkbp.total_timer = datetime.datetime.now().minute * 60 + datetime.datetime.now().second + datetime.datetime.now().microsecond / 1e6
-    bpy.context.scene.kkbp.timer = datetime.datetime.now().minute * 60 + datetime.datetime.now().second + datetime.datetime.now().microsecond / 1e6
+    _timer['total'] = time.perf_counter()
+    reset_timer()
 
 def reset_timer():
-    bpy.context.scene.kkbp.timer = datetime.datetime.now().minute * 60 + datetime.datetime.now().second + datetime.datetime.now().microsecond / 1e6
+    _timer['step'] = time.perf_counter()
+    _timer['cpu'] = time.process_time()
+    _timer['ops'] = _profiler.ops_calls
+
+def get_total_time() -> float:
+    '''Returns the seconds since initialize_timer was last called'''
+    return time.perf_counter() - _timer['total']
 
 def print_timer(operation_name:str):
-    '''Prints the time between now and the last operation that was timed'''
-    kklog('{} operation took {} seconds'.format(operation_name, abs(round(((datetime.datetime.now().minute * 60 + datetime.datetime.now().second + datetime.datetime.now().microsecond / 1e6) - bpy.context.scene.kkbp.timer), 3))))
+    '''Prints the time between now and the last operation that was timed. Also records it as a sub-step of the current profiler span'''
+    kklog('{} operation took {} seconds'.format(operation_name, round(time.perf_counter() - _timer['step'], 3)))
+    _profiler.add_step(operation_name, _timer['step'], _timer['cpu'], _timer['ops'])
     reset_timer()
 
+def get_memory_usage() -> tuple[int, int]:
+    '''Returns the current and peak resident memory of the Blender process in bytes. Either can be 0 if it can't be read on this platform'''
+    #linux has both values in /proc
+    try:
+        with open('/proc/self/status') as status:
+            values = {line.split(':')[0]: int(line.split()[1]) * 1024 for line in status if line.startswith(('VmRSS', 'VmHWM'))}
+        return values.get('VmRSS', 0), values.get('VmHWM', 0)
+    except (OSError, ValueError, IndexError):
+        pass
+    #windows
+    try:
+        import ctypes
+        from ctypes import wintypes
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD),
+                        ('PeakWorkingSetSize', ctypes.c_size_t), ('WorkingSetSize', ctypes.c_size_t),
+                        ('QuotaPeakPagedPoolUsage', ctypes.c_size_t), ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                        ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t), ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                        ('PagefileUsage', ctypes.c_size_t), ('PeakPagefileUsage', ctypes.c_size_t)]
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        ctypes.windll.kernel32.GetCurrentProcess.restype = wintypes.HANDLE
+        if ctypes.windll.psapi.GetProcessMemoryInfo(ctypes.windll.kernel32.GetCurrentProcess(), ctypes.byref(counters), counters.cb):
+            return counters.WorkingSetSize, counters.PeakWorkingSetSize
+    except Exception:
+        pass
+    #mac only has the peak
+    try:
+        import resource
+        return 0, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    except ImportError:
+        return 0, 0
+
+class ProfileSpan(object):
+    '''One timed section of the profiler. Spans nest as operator > stage > sub-step'''
+    def __init__(self, name: str, category: str, parent = None, start: float = None, cpu: float = None, ops: int = 0):
+        self.name = name
+        self.category = category
+        self.parent = parent
+        self.children = []
+        self.start = time.perf_counter() if start is None else start
+        self.cpu_start = time.process_time() if cpu is None else cpu
+        self.ops_start = ops
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.ops = 0
+        self.peak_rss = 0
+
+    def close(self, ops: int):
+        self.wall = time.perf_counter() - self.start
+        self.cpu = time.process_time() - self.cpu_start
+        self.ops = ops - self.ops_start
+        self.peak_rss = get_memory_usage()[1]
+
+class Profiler(object):
+    '''Records nested spans with their wall time, cpu time, peak memory and number of bpy.ops calls.
+    When the outermost span closes, a chrome trace json is saved (open it in chrome://tracing or ui.perfetto.dev)
+    and a summary table is written to the KKBP Log'''
+    def __init__(self):
+        self.stack = []
+        self.ops_calls = 0
+        self._restore_ops = None
+
+    def open(self, name: str, category: str):
+        if not self.stack:
+            self._count_ops()
+        span = ProfileSpan(name, category, self.stack[-1] if self.stack else None, ops = self.ops_calls)
+        if span.parent:
+            span.parent.children.append(span)
+        self.stack.append(span)
+
+    def close(self):
+        span = self.stack.pop()
+        span.close(self.ops_calls)
+        if not self.stack:
+            self._stop_counting_ops()
+            self.report(span)
+
+    def add_step(self, name: str, start: float, cpu: float, ops: int):
+        '''Adds an already finished sub-step to the current span. Does nothing if nothing is being profiled'''
+        if not self.stack:
+            return
+        parent = self.stack[-1]
+        #the step timer may have been started before this span was opened
+        step = ProfileSpan(name, 'step', parent, max(start, parent.start), max(cpu, parent.cpu_start), max(ops, parent.ops_start))
+        step.close(self.ops_calls)
+        parent.children.append(step)
+
+    def _count_ops(self):
+        '''Wraps the bpy.ops call so every operator call made while profiling is counted'''
+        try:
+            from bpy.ops import _BPyOpsSubModOp as op_class
+        except ImportError:
+            return
+        original_call = op_class.__call__
+        profiler = self
+        def counted_call(op, *args, **kwargs):
+            profiler.ops_calls += 1
+            return original_call(op, *args, **kwargs)
+        op_class.__call__ = counted_call
+        self._restore_ops = lambda: setattr(op_class, '__call__', original_call)
+
+    def _stop_counting_ops(self):
+        if self._restore_ops:
+            self._restore_ops()
+            self._restore_ops = None
+
+    def report(self, root: ProfileSpan):
+        events = []
+        lines = []
+        def walk(span: ProfileSpan, depth: int):
+            events.append({
+                'name': span.name,
+                'cat': span.category,
+                'ph': 'X',
+                'ts': round((span.start - root.start) * 1e6),
+                'dur': round(span.wall * 1e6),
+                'pid': 1,
+                'tid': 1,
+                'args': {'cpu_ms': round(span.cpu * 1000, 3), 'peak_rss_mb': round(span.peak_rss / 1048576, 1), 'bpy_ops_calls': span.ops},
+                })
+            label = ('  ' * depth + span.name)[:56]
+            lines.append('{:<56} {:>10.3f} {:>10.3f} {:>10.1f} {:>8}'.format(label, span.wall, span.cpu, span.peak_rss / 1048576, span.ops))
+            for child in span.children:
+                walk(child, depth + 1)
+        walk(root, 0)
+
+        trace_folder = Path(bpy.context.scene.kkbp.import_dir) if bpy.context.scene.kkbp.import_dir else get_cache_dir()
+        trace_path = trace_folder / 'kkbp_profile_{}.json'.format(root.name.replace(' ', '_'))
+        try:
+            with open(trace_path, 'w') as trace_file:
+                json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, trace_file)
+        except OSError:
+            trace_path = None
+
+        kklog('\nProfile for {}{}'.format(root.name, ' (chrome trace saved to {})'.format(trace_path) if trace_path else ''))
+        kklog('{:<56} {:>10} {:>10} {:>10} {:>8}'.format('span', 'wall s', 'cpu s', 'peak MB', 'bpy.ops'))
+        for line in lines:
+            kklog(line)
+
+_profiler = Profiler()
+
+class profile(contextlib.ContextDecorator):
+    '''Profiles a block of code as a nested span. Works as a context manager or as a decorator
+        with c.profile('bake light'):
+        @c.profile('modify_mesh', 'operator')'''
+    def __init__(self, name: str, category: str = 'stage'):
+        self.name = name
+        self.category = category
+
+    def __enter__(self):
+        _profiler.open(self.name, self.category)
+        return self
+
+    def __exit__(self, *exc):
+        _profiler.close()
+        return False
+
+class MemoryBudgetExceeded(Exception):
+    '''Raised by the MemoryProbe when the Blender process uses more memory than the budget set on the panel'''
+    pass
+
+class MemoryProbe(object):
+    '''Samples the memory used by the Blender process during the bake and atlas passes.
+    Each sample records the resident memory, the peak python allocation from tracemalloc, and the number of images and meshes
+    along with the approximate memory taken by the image pixels. A summary table is written to the KKBP Log when finished'''
+    def __init__(self):
+        self.samples = []
+        self.exceeded = ''
+        self.started_tracing = False
+
+    def start(self, trace_python: bool = None):
+        '''Clears the samples. tracemalloc slows down every python allocation, so the python peak is only traced
+        when trace_python is True, or when it is left as None and a memory budget is set'''
+        self.samples = []
+        self.exceeded = ''
+        if trace_python is None:
+            trace_python = bpy.context.scene.kkbp.memory_budget > 0
+        if trace_python and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.started_tracing = True
+
+    def sample(self, label: str, check_budget: bool = True):
+        '''Records the memory usage at this point. Raises MemoryBudgetExceeded if the memory budget is set and the process is above it'''
+        rss, peak = get_memory_usage()
+        python_peak = tracemalloc.get_traced_memory()[1] if tracemalloc.is_tracing() else 0
+        if tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+        #linux lets the peak be reset, so the next sample only shows the peak for that pass
+        try:
+            with open('/proc/self/clear_refs', 'w') as clear_refs:
+                clear_refs.write('5')
+        except OSError:
+            pass
+        image_bytes = 0
+        for image in bpy.data.images:
+            if image.has_data:
+                image_bytes += image.size[0] * image.size[1] * image.channels * (4 if image.is_float else 1)
+        self.samples.append((label, rss, peak, python_peak, len(bpy.data.images), image_bytes, len(bpy.data.meshes)))
+
+        budget = bpy.context.scene.kkbp.memory_budget * 1048576
+        used = rss or peak
+        if check_budget and budget and used > budget:
+            self.exceeded = 'Stopped after "{}" because Blender is using {} MB of memory, which is over the memory budget of {} MB. Lower the finalize multiplier, close other programs, or raise the memory budget.'.format(
+                label, round(used / 1048576), bpy.context.scene.kkbp.memory_budget)
+            raise MemoryBudgetExceeded(self.exceeded)
+
+    def finish(self):
+        if self.started_tracing:
+            tracemalloc.stop()
+            self.started_tracing = False
+        if not self.samples:
+            return
+        kklog('\nMemory usage')
+        kklog('{:<48} {:>9} {:>9} {:>9} {:>7} {:>10} {:>7}'.format('pass', 'rss MB', 'peak MB', 'py MB', 'images', 'pixels MB', 'meshes'))
+        for label, rss, peak, python_peak, images, image_bytes, meshes in self.samples:
+            kklog('{:<48} {:>9.1f} {:>9.1f} {:>9.1f} {:>7} {:>10.1f} {:>7}'.format(label[:48], rss / 1048576, peak / 1048576, python_peak / 1048576, images, image_bytes / 1048576, meshes))
+
+memory_probe = MemoryProbe()
+
+def get_cache_dir() -> Path:
+    '''Returns the folder used to store data that can be reused between imports of different characters'''
+    return Path(bpy.utils.user_resource('CONFIG', path='kkbp', create=True))
+
+def load_cache_file(filename: str) -> dict:
+    '''Returns the contents of a json file in the cache folder, or an empty dict if it doesn't exist or can't be read'''
+    cache_file = get_cache_dir() / filename
+    try:
+        with open(cache_file) as json_file:
+            return json.load(json_file)
+    except:
+        return {}
+
+def save_cache_file(filename: str, data: dict):
+    '''Saves data to a json file in the cache folder'''
+    cache_file = get_cache_dir() / filename
+    try:
+        with open(cache_file, 'w') as json_file:
+            json.dump(data, json_file)
+    except:
+        kklog(f'Could not save cache file {cache_file}', 'warn')
+
+class WeightMatrix:
+    '''Every vertex group weight of a mesh object, read in a single pass and stored as CSR style numpy arrays.
+    The groups of vertex i are groups[offsets[i]:offsets[i+1]], with the matching weights in weights[offsets[i]:offsets[i+1]].
+    vertices holds the vertex index of every entry so the arrays can also be filtered by group.
+    The matrix is a snapshot, so build a new one after weights or vertex groups are changed'''
+    def __init__(self, object: bpy.types.Object):
+        self.object = object
+        self.group_names = [group.name for group in object.vertex_groups]
+        self.group_index = {name: index for index, name in enumerate(self.group_names)}
+        counts = []
+        groups = []
+        weights = []
+        for vertex in object.data.vertices:
+            vertex_groups = vertex.groups
+            counts.append(len(vertex_groups))
+            for group in vertex_groups:
+                groups.append(group.group)
+                weights.append(group.weight)
+        counts = np.array(counts, dtype=np.int64)
+        self.offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=self.offsets[1:])
+        self.vertices = np.repeat(np.arange(len(counts), dtype=np.int64), counts)
+        self.groups = np.array(groups, dtype=np.int64)
+        self.weights = np.array(weights, dtype=np.float32)
+        self._max_weights = None
+
+    def max_weights(self) -> np.ndarray:
+        '''Returns the highest weight of every vertex group, in vertex group index order. Groups with no vertices are 0'''
+        if self._max_weights is None:
+            self._max_weights = np.zeros(len(self.group_names), dtype=np.float32)
+            np.maximum.at(self._max_weights, self.groups, self.weights)
+        return self._max_weights
+
+    def max_weight(self, group_name: str) -> float:
+        '''Returns the highest weight in a vertex group, or 0 if the group doesn't exist'''
+        index = self.group_index.get(group_name)
+        return 0.0 if index is None else float(self.max_weights()[index])
+
+    def used_groups(self, threshold = 0.0) -> dict[str, bool]:
+        '''Returns a dictionary in the form {vertex_group1: True, vertex_group2: False} where True means at least one weight is above the threshold'''
+        used = self.max_weights() > threshold
+        return {name: bool(used[index]) for index, name in enumerate(self.group_names)}
+
+    def has_members(self, group_name: str) -> bool:
+        '''Returns True if any vertex is assigned to the vertex group, even with a weight of 0'''
+        index = self.group_index.get(group_name)
+        return index is not None and bool((self.groups == index).any())
+
+    def group_vertices(self, group_name: str, threshold: float = None) -> np.ndarray:
+        '''Returns the indexes of the vertices assigned to a vertex group. If a threshold is given, only weights above it are counted'''
+        index = self.group_index.get(group_name)
+        if index is None:
+            return np.zeros(0, dtype=np.int64)
+        mask = self.groups == index
+        if threshold is not None:
+            mask &= self.weights > threshold
+        return self.vertices[mask]
+
+    def zero_weight_entries(self, threshold = 0.0) -> tuple[np.ndarray, np.ndarray]:
+        '''Returns the (vertex indexes, group indexes) of every assignment with a weight at or below the threshold'''
+        mask = self.weights <= threshold
+        return self.vertices[mask], self.groups[mask]
+
+    def bounding_box(self, group_name: str, world_space = True) -> tuple[np.ndarray, np.ndarray]:
+        '''Returns the (min, max) corners of the vertices assigned to a vertex group, or None if the group has no vertices'''
+        members = self.group_vertices(group_name)
+        if not len(members):
+            return None
+        coords = self.get_coordinates(world_space)[members]
+        return coords.min(axis=0), coords.max(axis=0)
+
+    def get_coordinates(self, world_space = True) -> np.ndarray:
+        '''Returns the coordinates of every vertex of the mesh as an (n, 3) array'''
+        mesh = self.object.data
+        coords = np.empty(len(mesh.vertices) * 3, dtype=np.float32)
+        mesh.vertices.foreach_get('co', coords)
+        coords = coords.reshape(-1, 3)
+        if world_space:
+            matrix = np.array(self.object.matrix_world, dtype=np.float32)
+            coords = coords @ matrix[:3, :3].T + matrix[:3, 3]
+        return coords
+
+#{object name: ((object pointer, vertex count, vertex group count), WeightMatrix)}
+_weight_matrices = {}
+
+def get_weight_matrix(object: bpy.types.Object) -> WeightMatrix:
+    '''Returns the WeightMatrix of a mesh object, reusing the last one built for it while its vertex and vertex group counts are unchanged.
+    Call clear_weight_matrix after changing weights or renaming vertex groups'''
+    key = (object.as_pointer(), len(object.data.vertices), len(object.vertex_groups))
+    cached = _weight_matrices.get(object.name)
+    if cached is None or cached[0] != key:
+        cached = _weight_matrices[object.name] = (key, WeightMatrix(object))
+    return cached[1]
+
+def clear_weight_matrix(object: bpy.types.Object = None):
+    '''Forgets the cached WeightMatrix of an object, or of every object if none is given'''
+    if object is None:
+        _weight_matrices.clear()
+    else:
+        _weight_matrices.pop(object.name, None)
+
+class DriverBuilder:
+    '''Collects driver specs and creates all of them at once in build().
+    Identical specs and drivers that already exist are skipped, and each build is logged.
+    Blender rebuilds the driver relations lazily on the next evaluation either way, so this doesn't make the drivers themselves faster'''
+    def __init__(self, name = 'drivers'):
+        self.name = name
+        #{(owner pointer, data path, index): spec}. Adding a different driver to the same property replaces the earlier spec
+        self.specs = {}
+        self.duplicates = 0
+
+    def add(self, owner: bpy.types.bpy_struct, data_path: str, index: int = None, driver_type = 'SCRIPTED', expression: str = None, variables: list[dict] = ()):
+        '''Queues a driver on owner.data_path. variables is a list of dicts in the form {'name': 'var', 'type': 'SINGLE_PROP', 'targets': [{...}]}
+        Each target dict is applied in order with setattr, so it can hold any DriverTarget property (put id_type before id).
+        A driver with the same expression and variables as one already queued for the property is skipped'''
+        key = (owner.as_pointer(), data_path, index)
+        spec = (owner, data_path, index, driver_type, expression, variables)
+        if key in self.specs and self.get_definition(self.specs[key]) == self.get_definition(spec):
+            self.duplicates += 1
+            return
+        self.specs[key] = spec
+
+    @staticmethod
+    def get_definition(spec: tuple) -> tuple:
+        '''Returns the type, expression and variables of a spec in a hashable form, so identical drivers can be found'''
+        _, _, _, driver_type, expression, variables = spec
+        return (driver_type, expression, tuple(
+            (variable['name'], variable['type'], tuple(tuple(target.items()) for target in variable.get('targets', [])))
+            for variable in variables))
+
+    @staticmethod
+    def find_matching_driver(owner: bpy.types.bpy_struct, data_path: str, index: int, driver_type: str, expression: str, variables: list[dict]) -> bpy.types.FCurve | None:
+        '''Returns the existing driver on owner.data_path if it already has this type, expression and variables'''
+        animation_data = owner.id_data.animation_data
+        if not animation_data:
+            return None
+        try:
+            path = owner.path_from_id(data_path)
+        except ValueError:
+            return None
+        fcurve = animation_data.drivers.find(path, index = index or 0)
+        if not fcurve:
+            return None
+        driver = fcurve.driver
+        if driver.type != driver_type or (expression and driver.expression != expression) or len(driver.variables) != len(variables):
+            return None
+        for variable, variable_spec in zip(driver.variables, variables):
+            if variable.name != variable_spec['name'] or variable.type != variable_spec['type']:
+                return None
+            for target, target_spec in zip(variable.targets, variable_spec.get('targets', [])):
+                if any(getattr(target, property) != value for property, value in target_spec.items()):
+                    return None
+        return fcurve
+
+    def build(self) -> list[bpy.types.FCurve]:
+        '''Creates every queued driver. Drivers that already exist with the same definition are left alone.
+        When more than one driver was queued, the build is logged'''
+        start = time.perf_counter()
+        fcurves = []
+        variable_count = 0
+        existing = 0
+        for owner, data_path, index, driver_type, expression, variables in self.specs.values():
+            fcurve = self.find_matching_driver(owner, data_path, index, driver_type, expression, variables)
+            if fcurve:
+                existing += 1
+                fcurves.append(fcurve)
+                continue
+            fcurve = owner.driver_add(data_path) if index is None else owner.driver_add(data_path, index)
+            driver = fcurve.driver
+            driver.type = driver_type
+            #driver_add returns the existing driver if the property was already driven
+            for variable in list(driver.variables):
+                driver.variables.remove(variable)
+            for variable_spec in variables:
+                variable = driver.variables.new()
+                variable.name = variable_spec['name']
+                variable.type = variable_spec['type']
+                for target, target_spec in zip(variable.targets, variable_spec.get('targets', [])):
+                    for property, value in target_spec.items():
+                        setattr(target, property, value)
+                variable_count += 1
+            if expression:
+                driver.expression = expression
+            fcurves.append(fcurve)
+        #a single driver is what the unbatched callers add, so don't log every one of them
+        if len(self.specs) > 1:
+            definitions = {self.get_definition(spec) for spec in self.specs.values()}
+            kklog('Created {} {} with {} variables in {} seconds. {} unique definitions, {} already existed, {} duplicate specs skipped'.format(
+                len(fcurves) - existing, self.name, variable_count, round(time.perf_counter() - start, 4), len(definitions), existing, self.duplicates))
+        self.specs.clear()
+        self.duplicates = 0
+        return fcurves
+
+    @staticmethod
+    def add_driver_directly(owner: bpy.types.bpy_struct, data_path: str, expression: str, variables: list[dict]) -> bpy.types.FCurve:
+        '''Adds a driver with plain driver_add and variable setup, the way the drivers were made before DriverBuilder'''
+        driver = owner.driver_add(data_path).driver
+        driver.type = 'SCRIPTED'
+        for variable_spec in variables:
+            variable = driver.variables.new()
+            variable.name = variable_spec['name']
+            variable.type = variable_spec['type']
+            for target, target_spec in zip(variable.targets, variable_spec.get('targets', [])):
+                for property, value in target_spec.items():
+                    setattr(target, property, value)
+        driver.expression = expression
+        return driver
+
+    @classmethod
+    def benchmark(cls, count = 200) -> dict[str, float]:
+        '''Times adding count drivers with plain driver_add calls against adding the same drivers with one build().
+        Both end with one view layer update, so the lazy relations rebuild is counted once for each.
+        Run it from the Blender python console with common.DriverBuilder.benchmark()'''
+        timings = {}
+        for mode in ['driver_add', 'DriverBuilder']:
+            object = bpy.data.objects.new('kkbp driver benchmark', None)
+            bpy.context.scene.collection.objects.link(object)
+            for number in range(count):
+                object['source{}'.format(number)] = 0.0
+                object['target{}'.format(number)] = 0.0
+            bpy.context.view_layer.update()
+            builder = cls('benchmark drivers')
+            start = time.perf_counter()
+            for number in range(count):
+                variables = [{'name': 'var', 'type': 'SINGLE_PROP', 'targets': [{'id_type': 'OBJECT', 'id': object, 'data_path': '["source{}"]'.format(number)}]}]
+                if mode == 'driver_add':
+                    cls.add_driver_directly(object, '["target{}"]'.format(number), 'var * 2', variables)
+                else:
+                    builder.add(object, '["target{}"]'.format(number), None, 'SCRIPTED', 'var * 2', variables)
+            builder.build()
+            bpy.context.view_layer.update()
+            timings[mode] = time.perf_counter() - start
+            bpy.data.objects.remove(object)
+        kklog('Driver benchmark for {} drivers: {} seconds with driver_add, {} seconds with DriverBuilder'.format(
+            count, round(timings['driver_add'], 4), round(timings['DriverBuilder'], 4)))
+        return timings
+
 def handle_error(error_causer:bpy.types.Operator, error:Exception):
     kklog('Unknown python error occurred. \n          Make sure the default model imports correctly before troubleshooting on this model!\n\n\n', type = 'error')
     kklog(traceback.format_exc())
@@ -13,14 +13,11 @@
 # - material combiner code taken from https://github.com/Grim-es/material-combiner-addon/
 
 
-import bpy, os, traceback, time, pathlib, subprocess
+import bpy, os, re, traceback, time, json, shutil, subprocess, tempfile, hashlib, math
+import numpy as np
 from .. import common as c
 from ..interface.dictionary_en import t
 
-def print_memory_usage(stri):
-    run = subprocess.run('wmic OS get FreePhysicalMemory', capture_output=True)
-    c.kklog((stri, '\n   mem usage ', 16000 - int(run.stdout.split(b'\r')[2].split(b'\n')[1])/1000))
-
 #setup and return a camera
 def setup_camera():
     #Delete all cameras in the scene
@@ -131,13 +128,269 @@ def sanitizeMaterialName(text: str) -> str:
             text = text.replace(ch,'')
     return text
 
-def bake_pass(folderpath: str, bake_type: str):
+def get_bake_filename(material: bpy.types.Material, bake_type: str) -> str:
+    '''Returns the name of the baked png for this material and pass, without the extension'''
+    matname = sanitizeMaterialName(material.name)
+    matname = matname[:-4] if matname[-4:] == '-ORG' else matname
+    return matname + ' ' + bake_type
+
+def get_bake_resolution(material: bpy.types.Material) -> tuple[int, int]:
+    '''Returns the size the material will be rendered at, based on the largest image in the textures group and the bake multiplier'''
+    #Go through each of the textures loaded into the textures group and get the highest resolution one
+    highest_resolution = [0, 0]
+    for image_node in material.node_tree.nodes['textures'].node_tree.nodes:
+        if image_node.type == 'TEX_IMAGE' and image_node.image:
+            image_size = image_node.image.size[0] * image_node.image.size[1]
+            largest_so_far = highest_resolution[0] * highest_resolution[1]
+            if image_size > largest_so_far:
+                highest_resolution = image_node.image.size
+    
+    resolution_multiplier = bpy.context.scene.kkbp.bake_mult
+    #Render an image using the highest dimensions
+    if highest_resolution:
+        return highest_resolution[0] * resolution_multiplier, highest_resolution[1] * resolution_multiplier
+    #if no images were found, render a 64px failsafe image anyway to catch 
+    # materials that are a solid color, don't rely on textures, or are completely transparent
+    return 64, 64
+
+def get_uv_footprints(bake_object: bpy.types.Object) -> dict[int, tuple[float, float, float, float]]:
+    '''Returns the (min u, min v, max u, max v) bounding box of each material index on the active UV layer, which is the layer the atlas remaps.
+    NaN UVs are ignored'''
+    mesh = bake_object.data
+    uv_layer = mesh.uv_layers.active
+    if not uv_layer or not len(mesh.polygons):
+        return {}
+    uvs = np.empty(len(uv_layer.data) * 2, dtype = np.float32)
+    uv_layer.data.foreach_get('uv', uvs)
+    uvs = uvs.reshape(-1, 2)
+    loop_totals = np.empty(len(mesh.polygons), dtype = np.int32)
+    mesh.polygons.foreach_get('loop_total', loop_totals)
+    material_indices = np.empty(len(mesh.polygons), dtype = np.int32)
+    mesh.polygons.foreach_get('material_index', material_indices)
+    loop_materials = np.repeat(material_indices, loop_totals)
+    footprints = {}
+    for material_index in np.unique(material_indices):
+        material_uvs = uvs[loop_materials == material_index]
+        if not np.isfinite(material_uvs).all(axis = 1).any():
+            continue
+        footprints[int(material_index)] = (*np.nanmin(material_uvs, axis = 0).tolist(), *np.nanmax(material_uvs, axis = 0).tolist())
+    return footprints
+
+def use_adaptive_bake() -> bool:
+    '''Cropped images only line up through the atlas, which moves the UVs onto them. The exported model without an atlas keeps the
+    original UVs, so the bakes are only cropped when an atlas is made'''
+    return bpy.context.scene.kkbp.adaptive_bake and bpy.context.scene.kkbp.use_atlas
+
+def get_bake_crop(footprint: tuple[float, float, float, float], resolution: tuple[int, int]) -> tuple[float, float, float, float]:
+    '''Returns the part of the UV square to render for a material that only covers a small area of it, snapped to whole pixels.
+    Returns None if the whole square should be rendered'''
+    if not footprint:
+        return None
+    min_u, min_v, max_u, max_v = footprint
+    if not all(math.isfinite(bound) for bound in footprint):
+        return None
+    #repeating UVs need the whole image
+    if min_u < 0 or min_v < 0 or max_u > 1 or max_v > 1:
+        return None
+    #keep a few pixels around the footprint so the edges don't get cut off by filtering
+    margin = 4
+    resolution_x, resolution_y = resolution
+    min_x = max(0, math.floor(min_u * resolution_x) - margin)
+    min_y = max(0, math.floor(min_v * resolution_y) - margin)
+    max_x = min(resolution_x, math.ceil(max_u * resolution_x) + margin)
+    max_y = min(resolution_y, math.ceil(max_v * resolution_y) + margin)
+    #not worth it if most of the image gets rendered anyway
+    if (max_x - min_x) * (max_y - min_y) > 0.75 * resolution_x * resolution_y:
+        return None
+    return min_x / resolution_x, min_y / resolution_y, max_x / resolution_x, max_y / resolution_y
+
+def set_bake_crop(textures_group: bpy.types.NodeTree, node_name: str, image: bpy.types.Image, crop: tuple[float, float, float, float]):
+    '''Points the image node at the part of the UV square that was rendered if the bake was cropped to the material's UV footprint.
+    The crop is also stored on the image so the atlas can place the smaller image'''
+    image_node = textures_group.nodes[node_name]
+    mapping = textures_group.nodes.get(node_name + ' crop')
+    if crop:
+        image['kkbp_uv_crop'] = list(crop)
+    elif image.get('kkbp_uv_crop'):
+        del image['kkbp_uv_crop']
+    if not crop and not mapping:
+        return
+    if not mapping:
+        mapping = textures_group.nodes.new('ShaderNodeMapping')
+        mapping.name = node_name + ' crop'
+        mapping.location = image_node.location.x - 200, image_node.location.y
+        if image_node.inputs['Vector'].is_linked:
+            source = image_node.inputs['Vector'].links[0].from_socket
+        else:
+            coordinates = textures_group.nodes.new('ShaderNodeTexCoord')
+            coordinates.location = mapping.location.x - 200, mapping.location.y
+            source = coordinates.outputs['UV']
+        textures_group.links.new(source, mapping.inputs['Vector'])
+        textures_group.links.new(mapping.outputs['Vector'], image_node.inputs['Vector'])
+    min_u, min_v, max_u, max_v = crop if crop else (0, 0, 1, 1)
+    mapping.inputs['Scale'].default_value = (1 / (max_u - min_u), 1 / (max_v - min_v), 1)
+    mapping.inputs['Location'].default_value = (-min_u / (max_u - min_u), -min_v / (max_v - min_v), 0)
+
+class BakeManifest(object):
+    '''Remembers a fingerprint of everything that goes into each baked png: the node values and links of the material,
+    the contents of its images, the UVs of the object, the bake resolution and the bake multiplier.
+    Materials with the same fingerprint as the last bake reuse the png that is already in the baked_files folder'''
+    filename = 'bake_manifest.json'
+    version = 2
+
+    def __init__(self, folderpath: str):
+        self.folderpath = folderpath
+        self.path = os.path.join(folderpath, self.filename)
+        try:
+            with open(self.path) as manifest_file:
+                data = json.load(manifest_file)
+            if data.get('version') != self.version:
+                data = {}
+        except (OSError, ValueError):
+            data = {}
+        #{filename: [fingerprint, png size, png modified time]}. The png has to be the exact file that was marked to be reused
+        self.bakes = data.get('bakes', {})
+        #image file hashes are kept by path, size and modified time so the files are only read again when they change
+        self.image_files = data.get('images', {})
+        self.fingerprints = {}
+        self.object_files = {}
+        self.image_hashes = {}
+        self.node_tree_hashes = {}
+        self.reused = set()
+
+    def add_object(self, bake_object: bpy.types.Object, bake_types: list[str]):
+        '''Fingerprints every bake of this object. This has to run before the bake setup changes any nodes'''
+        uv_layer = bake_object.data.uv_layers.active
+        uvs = np.empty(len(uv_layer.data) * 2 if uv_layer else 0, dtype = np.float32)
+        if uv_layer:
+            uv_layer.data.foreach_get('uv', uvs)
+        material_indices = np.empty(len(bake_object.data.polygons), dtype = np.int32)
+        bake_object.data.polygons.foreach_get('material_index', material_indices)
+        geometry = hashlib.sha1(uvs.tobytes() + material_indices.tobytes()).hexdigest()
+
+        settings = [
+            geometry, str(bpy.context.scene.kkbp.bake_mult), str(bpy.context.scene.kkbp.old_bake_bool),
+            str(use_adaptive_bake()), str(bpy.context.scene.kkbp.aov_bake), bpy.app.version_string,
+            ]
+        self.object_files[bake_object.name] = []
+        materials = {slot.material.name: slot.material for slot in bake_object.material_slots if slot.material and slot.material.get('bake')}
+        for material in [materials[name] for name in sorted(materials)]:
+            if not material.node_tree.nodes.get('textures'):
+                continue
+            for bake_type in bake_types:
+                filename = get_bake_filename(material, bake_type)
+                self.fingerprints[filename] = self.get_fingerprint(material, bake_type, settings + [str(get_bake_resolution(material))])
+                self.object_files[bake_object.name].append(filename)
+
+    def get_fingerprint(self, material: bpy.types.Material, bake_type: str, settings: list[str]) -> str:
+        '''Hashes the material name, its node tree and the bake settings for one bake'''
+        return hashlib.sha1('|'.join([material.name, bake_type, self._hash_node_tree(material.node_tree)] + settings).encode()).hexdigest()
+
+    def can_reuse(self, filename: str) -> bool:
+        '''Returns True if the png for this bake exists and nothing that goes into it has changed since it was baked'''
+        fingerprint = self.fingerprints.get(filename)
+        path = os.path.join(self.folderpath, filename + '.png')
+        if not fingerprint or not os.path.isfile(path):
+            return False
+        stat = os.stat(path)
+        if self.bakes.get(filename) == [fingerprint, stat.st_size, stat.st_mtime]:
+            self.reused.add(filename)
+            return True
+        return False
+
+    def is_object_current(self, object_name: str) -> bool:
+        files = self.object_files.get(object_name)
+        return bool(files) and all(self.can_reuse(filename) for filename in files)
+
+    def mark_baked(self, filename: str, written_after: float = None) -> bool:
+        '''Stamps the png for this bake with its fingerprint so the next finalize can reuse it.
+        If written_after is given, a png that was last written before that time is not from this bake and is left unmarked.
+        Returns True if the png was marked'''
+        path = os.path.join(self.folderpath, filename + '.png')
+        if filename not in self.fingerprints or not os.path.isfile(path):
+            return False
+        stat = os.stat(path)
+        if written_after is not None and stat.st_mtime < written_after:
+            return False
+        self.bakes[filename] = [self.fingerprints[filename], stat.st_size, stat.st_mtime]
+        return True
+
+    def save(self):
+        os.makedirs(self.folderpath, exist_ok = True)
+        with open(self.path, 'w') as manifest_file:
+            json.dump({'version': self.version, 'bakes': self.bakes, 'images': self.image_files}, manifest_file, indent = 1)
+
+    def _hash_node_tree(self, node_tree: bpy.types.NodeTree) -> str:
+        #every material's own tree is called "Shader Nodetree", so the trees are told apart by pointer instead of name
+        if node_tree.as_pointer() in self.node_tree_hashes:
+            return self.node_tree_hashes[node_tree.as_pointer()]
+        parts = []
+        for node in sorted(node_tree.nodes, key = lambda node: node.name):
+            parts.append(f'{node.name} {node.bl_idname} ' + ' '.join(str(getattr(node, setting, '')) for setting in ['blend_type', 'operation', 'data_type', 'interpolation', 'extension', 'mute']))
+            for socket in list(node.inputs) + list(node.outputs):
+                if not socket.is_linked and hasattr(socket, 'default_value'):
+                    value = socket.default_value
+                    parts.append(repr(tuple(value) if hasattr(value, '__len__') and not isinstance(value, str) else value))
+            if node.type == 'TEX_IMAGE' and node.image:
+                parts.append(self._hash_image(node.image))
+            elif node.type == 'GROUP' and node.node_tree:
+                parts.append(self._hash_node_tree(node.node_tree))
+        for link in node_tree.links:
+            parts.append(f'{link.from_node.name}:{link.from_socket.identifier}>{link.to_node.name}:{link.to_socket.identifier}')
+        digest = hashlib.sha1('\n'.join(parts).encode()).hexdigest()
+        self.node_tree_hashes[node_tree.as_pointer()] = digest
+        return digest
+
+    def _hash_image(self, image: bpy.types.Image) -> str:
+        if image.name in self.image_hashes:
+            return self.image_hashes[image.name]
+        if image.packed_file:
+            digest = hashlib.sha1(image.packed_file.data).hexdigest()
+        else:
+            path = bpy.path.abspath(image.filepath)
+            if os.path.isfile(path):
+                stat = os.stat(path)
+                cached = self.image_files.get(path)
+                if cached and cached[0] == stat.st_size and cached[1] == stat.st_mtime:
+                    digest = cached[2]
+                else:
+                    with open(path, 'rb') as image_file:
+                        digest = hashlib.sha1(image_file.read()).hexdigest()
+                    self.image_files[path] = [stat.st_size, stat.st_mtime, digest]
+            else:
+                digest = f'{image.name} {tuple(image.size)} {image.source}'
+        self.image_hashes[image.name] = digest
+        return digest
+
+def setup_material_render(object_to_bake: bpy.types.Object, current_material: bpy.types.Material, index: int, footprints: dict):
+    '''Sets the render size for this material and makes it the only visible material on the object and the filler plane'''
+    resolution = get_bake_resolution(current_material)
+    bpy.context.scene.render.resolution_x, bpy.context.scene.render.resolution_y = resolution
+    #render only the area of the UV square this material covers. The image keeps the same pixel density
+    crop = get_bake_crop(footprints.get(index), resolution)
+    bpy.context.scene.render.use_border = bpy.context.scene.render.use_crop_to_border = bool(crop)
+    if crop:
+        render = bpy.context.scene.render
+        render.border_min_x, render.border_min_y, render.border_max_x, render.border_max_y = crop
+
+    #set every material slot except the current material to be transparent
+    for matslot in object_to_bake.material_slots:
+        if matslot.material != current_material:
+            matslot.material = bpy.data.materials['KK Eyeline kage ' + c.get_name()]
+    
+    #set the filler plane to the current material
+    bpy.data.objects['fillerplane'].material_slots[0].material = current_material
+
+def bake_pass(folderpath: str, bake_type: str, material_names: set[str] = None, manifest: BakeManifest = None):
     '''Folds the body / clothes / hair down to a UV rectangle
     Places a filler plane right below it to fill in the rest of the image
     Bakes all materials on this object down to an image using the orthographic camera
+    If material_names is given, only those materials are baked. If a manifest is given, materials that haven't changed since the last bake are skipped
     '''
     #get the currently selected object as the active object
     object_to_bake = bpy.context.active_object
+    #only render the part of the UV square each material uses if adaptive resolution is on
+    footprints = get_uv_footprints(object_to_bake) if use_adaptive_bake() else {}
     #remember what order the materials are in for later
     original_material_order = []
     for matslot in object_to_bake.material_slots:
@@ -154,6 +407,11 @@ def bake_pass(folderpath: str, bake_type: str):
         if not current_material.get('bake'):
             c.kklog(f'Detected material that cannot be finalized. Skipping: {current_material.name}')
             continue
+        if material_names is not None and current_material.name not in material_names:
+            continue
+        #skip the render if this material hasn't changed since the last bake
+        if manifest and manifest.can_reuse(get_bake_filename(current_material, bake_type)):
+            continue
 
         nodes = current_material.node_tree.nodes
         links = current_material.node_tree.links
@@ -172,43 +430,17 @@ def bake_pass(folderpath: str, bake_type: str):
                 links.new(nodes['textures'].outputs[-1], nodes['out'].inputs[0])
         
         if nodes.get('textures'):
-            #Go through each of the textures loaded into the textures group and get the highest resolution one
-            highest_resolution = [0, 0]
-            for image_node in nodes['textures'].node_tree.nodes:
-                if image_node.type == 'TEX_IMAGE' and image_node.image:
-                    image_size = image_node.image.size[0] * image_node.image.size[1]
-                    largest_so_far = highest_resolution[0] * highest_resolution[1]
-                    if image_size > largest_so_far:
-                        highest_resolution = image_node.image.size
-            
-            resolution_multiplier = bpy.context.scene.kkbp.bake_mult
-            #Render an image using the highest dimensions
-            if highest_resolution:
-                bpy.context.scene.render.resolution_x=highest_resolution[0] * resolution_multiplier
-                bpy.context.scene.render.resolution_y=highest_resolution[1] * resolution_multiplier
-            else:
-                #if no images were found, render a 64px failsafe image anyway to catch 
-                # materials that are a solid color, don't rely on textures, or are completely transparent
-                bpy.context.scene.render.resolution_x=64
-                bpy.context.scene.render.resolution_y=64
-
-            #set every material slot except the current material to be transparent
-            for matslot in object_to_bake.material_slots:
-                if matslot.material != current_material:
-                    matslot.material = bpy.data.materials['KK Eyeline kage ' + c.get_name()]
-            
-            #set the filler plane to the current material
-            bpy.data.objects['fillerplane'].material_slots[0].material = current_material
+            setup_material_render(object_to_bake, current_material, index, footprints)
 
             #then render it
-            matname = sanitizeMaterialName(current_material.name)
-            matname = matname[:-4] if matname[-4:] == '-ORG' else matname
-            bpy.context.scene.render.filepath = folderpath + matname + ' ' + bake_type
+            bpy.context.scene.render.filepath = folderpath + get_bake_filename(current_material, bake_type)
             bpy.context.scene.render.image_settings.file_format='PNG'
             bpy.context.scene.render.image_settings.color_mode='RGBA'
             
             print('Rendering {} / {}'.format(index+1, len(object_to_bake.data.materials)))
             bpy.ops.render.render(write_still = True)
+            if manifest:
+                manifest.mark_baked(get_bake_filename(current_material, bake_type))
 
             #reset folderpath after render
             bpy.context.scene.render.filepath = folderpath
@@ -229,10 +461,205 @@ def bake_pass(folderpath: str, bake_type: str):
         for material_index in range(len(original_material_order)):
             object_to_bake.material_slots[material_index].material = bpy.data.materials[original_material_order[material_index]]
     
+    bpy.context.scene.render.use_border = bpy.context.scene.render.use_crop_to_border = False
+
     #reset the color output group link
     combine = bpy.data.node_groups['.Combine colors']
     combine.links.new(combine.nodes['input'].outputs[2], combine.nodes['mix'].inputs[0])
 
+def is_blended(material: bpy.types.Material) -> bool:
+    '''EEVEE only writes blended surfaces to the combined pass, so their shader AOVs come out empty'''
+    if hasattr(material, 'surface_render_method'):
+        return material.surface_render_method == 'BLENDED'
+    return material.blend_method == 'BLEND'
+
+def copy_node(tree: bpy.types.NodeTree, node: bpy.types.Node) -> bpy.types.Node:
+    '''Adds a node with the same settings and unlinked input values as node'''
+    copy = tree.nodes.new(node.bl_idname)
+    for property in node.bl_rna.properties:
+        if property.is_readonly or property.identifier in ['name', 'label', 'location', 'parent', 'select']:
+            continue
+        try:
+            setattr(copy, property.identifier, getattr(node, property.identifier))
+        except (AttributeError, TypeError, ValueError):
+            pass
+    for original_input, copy_input in zip(node.inputs, copy.inputs):
+        if hasattr(original_input, 'default_value'):
+            try:
+                copy_input.default_value = original_input.default_value
+            except (AttributeError, TypeError, ValueError):
+                pass
+    return copy
+
+def copy_combine_output(combine: bpy.types.NodeTree, factor: float) -> tuple[list[bpy.types.Node], bpy.types.NodeSocket]:
+    '''Copies the mix node of the combine group and every node between it and the group output, with the mix factor set to a constant.
+    Returns the new nodes and the copied socket that feeds the group output, so the light or dark color can be read
+    exactly as the group outputs it without changing the group for the other AOVs'''
+    mix = combine.nodes['mix']
+    group_outputs = [node for node in combine.nodes if node.type == 'GROUP_OUTPUT']
+    group_output = next((node for node in group_outputs if node.is_active_output), group_outputs[0])
+    output_link = group_output.inputs[0].links[0]
+
+    def walk(start: bpy.types.Node, downstream: bool) -> set[str]:
+        found = {start.name}
+        pending = [start]
+        while pending:
+            node = pending.pop()
+            for socket in (node.outputs if downstream else node.inputs):
+                for link in socket.links:
+                    next_node = link.to_node if downstream else link.from_node
+                    if next_node.name not in found:
+                        found.add(next_node.name)
+                        pending.append(next_node)
+        return found
+    chain = walk(mix, True) & walk(output_link.from_node, False)
+    chain.add(mix.name)
+
+    copies = {name: copy_node(combine, combine.nodes[name]) for name in chain}
+    for name in chain:
+        node = combine.nodes[name]
+        for input_index, socket in enumerate(node.inputs):
+            #the mix factor is the light / dark switch
+            if name == mix.name and input_index == 0:
+                continue
+            for link in socket.links:
+                from_socket = link.from_socket
+                if link.from_node.name in copies:
+                    output_index = next(index for index, output in enumerate(link.from_node.outputs) if output == link.from_socket)
+                    from_socket = copies[link.from_node.name].outputs[output_index]
+                combine.links.new(from_socket, copies[name].inputs[input_index])
+    copies[mix.name].inputs[0].default_value = factor
+
+    if output_link.from_node.name not in copies:
+        #the group output doesn't depend on the mix, so just read the mix
+        return list(copies.values()), copies[mix.name].outputs[0]
+    output_index = next(index for index, output in enumerate(output_link.from_node.outputs) if output == output_link.from_socket)
+    return list(copies.values()), copies[output_link.from_node.name].outputs[output_index]
+
+def find_file_output(folderpath: str, filename: str, written_after: float) -> str:
+    '''Returns the path of the png a compositor file output slot wrote for filename during this render, or None if there isn't one.
+    The file output node adds the frame number to the name, padded to however many digits the frame needs'''
+    pattern = re.compile(re.escape(filename) + r'\d+\.png')
+    paths = [os.path.join(folderpath, name) for name in os.listdir(folderpath) if pattern.fullmatch(name)]
+    paths = [path for path in paths if os.path.getmtime(path) >= written_after]
+    return max(paths, key = os.path.getmtime) if paths else None
+
+def bake_pass_aov(folderpath: str, bake_types: list[str], material_names: set[str] = None, manifest: BakeManifest = None) -> dict[str, set[str]]:
+    '''Bakes the light, dark and normal versions of every material on this object with one render per material.
+    The combine group output with the mix set to light and to dark and the normal passthrough are written to shader AOVs,
+    and file output nodes in the compositor save each one to its own png using the alpha of the normal render.
+    Blended materials are skipped because EEVEE doesn't write them to AOVs. bake_object_passes bakes those with bake_pass.
+    Returns {bake type: material names} for every pass that didn't produce a file, so they can be baked with bake_pass instead
+    '''
+    object_to_bake = bpy.context.active_object
+    scene = bpy.context.scene
+    footprints = get_uv_footprints(object_to_bake) if use_adaptive_bake() else {}
+    original_material_order = [matslot.name for matslot in object_to_bake.material_slots]
+    missing = {bake_type: set() for bake_type in bake_types}
+
+    #a factor of 1 on the mix node gives the light color and 0 gives the dark color, the same as bake_pass sets it
+    combine = bpy.data.node_groups['.Combine colors']
+    combine_nodes = []
+    for bake_type, factor in [('light', 1), ('dark', 0)]:
+        if bake_type not in bake_types:
+            continue
+        chain_nodes, color_socket = copy_combine_output(combine, factor)
+        aov_node = combine.nodes.new('ShaderNodeOutputAOV')
+        aov_node.aov_name = 'kkbp ' + bake_type
+        combine.links.new(color_socket, aov_node.inputs['Color'])
+        combine_nodes.extend(chain_nodes + [aov_node])
+
+    #register the AOVs on the view layer and save each one through the compositor
+    view_layer = bpy.context.view_layer
+    view_layer_aovs = []
+    for bake_type in bake_types:
+        view_layer_aov = view_layer.aovs.add()
+        view_layer_aov.name = 'kkbp ' + bake_type
+        view_layer_aov.type = 'COLOR'
+        view_layer_aovs.append(view_layer_aov)
+    original_use_nodes = scene.use_nodes
+    scene.use_nodes = True
+    scene.render.use_compositing = True
+    tree = scene.node_tree
+    render_layers = tree.nodes.new('CompositorNodeRLayers')
+    file_output = tree.nodes.new('CompositorNodeOutputFile')
+    file_output.base_path = folderpath
+    file_output.format.file_format = 'PNG'
+    file_output.format.color_mode = 'RGBA'
+    file_output.file_slots.clear()
+    compositor_nodes = [render_layers, file_output]
+    for bake_type in bake_types:
+        set_alpha = tree.nodes.new('CompositorNodeSetAlpha')
+        set_alpha.mode = 'REPLACE_ALPHA'
+        tree.links.new(render_layers.outputs['kkbp ' + bake_type], set_alpha.inputs['Image'])
+        tree.links.new(render_layers.outputs['Alpha'], set_alpha.inputs['Alpha'])
+        file_output.file_slots.new(bake_type)
+        tree.links.new(set_alpha.outputs['Image'], file_output.inputs[-1])
+        compositor_nodes.append(set_alpha)
+
+    for index, current_material in enumerate(object_to_bake.data.materials):
+        if not current_material.get('bake'):
+            c.kklog(f'Detected material that cannot be finalized. Skipping: {current_material.name}')
+            continue
+        if material_names is not None and current_material.name not in material_names:
+            continue
+        if is_blended(current_material):
+            continue
+        nodes = current_material.node_tree.nodes
+        if not nodes.get('textures'):
+            continue
+        filenames = {bake_type: get_bake_filename(current_material, bake_type) for bake_type in bake_types}
+        #skip the render if this material hasn't changed since the last bake
+        if manifest and all(manifest.can_reuse(filename) for filename in filenames.values()):
+            continue
+
+        #the light and dark colors need the toon shading normals turned off. bake_pass leaves them on for the normal pass
+        toon_shading = nodes['textures'].node_tree.nodes.get('shade') if 'light' in bake_types or 'dark' in bake_types else None
+        if toon_shading:
+            original_normal_state = toon_shading.inputs[1].default_value
+            toon_shading.inputs[1].default_value = 0
+        normal_aov = None
+        if 'normal' in bake_types and len(nodes['textures'].outputs):
+            normal_aov = nodes.new('ShaderNodeOutputAOV')
+            normal_aov.aov_name = 'kkbp normal'
+            current_material.node_tree.links.new(nodes['textures'].outputs[-1], normal_aov.inputs['Color'])
+
+        setup_material_render(object_to_bake, current_material, index, footprints)
+        for bake_type, slot in zip(bake_types, file_output.file_slots):
+            slot.path = filenames[bake_type]
+        
+        print('Rendering {} / {}'.format(index+1, len(object_to_bake.data.materials)))
+        #file times can be rounded down by the file system
+        render_time = time.time() - 2
+        bpy.ops.render.render()
+        for bake_type, filename in filenames.items():
+            written = find_file_output(folderpath, filename, render_time)
+            if not written:
+                c.kklog(f'The single render bake did not write the {bake_type} image for {current_material.name}. Baking it separately', type = 'error')
+                missing[bake_type].add(current_material.name)
+                continue
+            os.replace(written, os.path.join(folderpath, filename + '.png'))
+            if manifest:
+                manifest.mark_baked(filename, written_after = render_time)
+
+        if toon_shading:
+            toon_shading.inputs[1].default_value = original_normal_state
+        if normal_aov:
+            nodes.remove(normal_aov)
+        for material_index in range(len(original_material_order)):
+            object_to_bake.material_slots[material_index].material = bpy.data.materials[original_material_order[material_index]]
+
+    #put everything back the way it was
+    for node in compositor_nodes:
+        tree.nodes.remove(node)
+    scene.use_nodes = original_use_nodes
+    for view_layer_aov in view_layer_aovs:
+        view_layer.aovs.remove(view_layer_aov)
+    for node in combine_nodes:
+        combine.nodes.remove(node)
+    scene.render.use_border = scene.render.use_crop_to_border = False
+    return missing
+
 def cleanup():
     # Deselect all objects
     bpy.ops.object.select_all(action='DESELECT')
@@ -257,15 +684,162 @@ def cleanup():
             ob.animation_data.drivers.remove(ob.animation_data.drivers[0])
             ob.animation_data.drivers.remove(ob.animation_data.drivers[0])
             ob.scale = (1,1,1)
-    bpy.data.node_groups.remove(bpy.data.node_groups['.Geometry Nodes'])
+    if bpy.data.node_groups.get('.Geometry Nodes'):
+        bpy.data.node_groups.remove(bpy.data.node_groups['.Geometry Nodes'])
+
+def restore_render_state():
+    '''Turns transparency off and shows every object in renders again after baking'''
+    bpy.context.scene.render.film_transparent = False
+    bpy.context.scene.render.filter_size = 1.5
+    for obj in bpy.context.view_layer.objects:
+        obj.hide_render = False
+
+def bake_object_passes(folderpath: str, bake_object: bpy.types.Object, bake_types: list[str], material_names: set[str] = None, manifest: BakeManifest = None):
+    '''Sets up the camera and flattens the object, then runs every bake pass on it. If material_names is given, only those materials are baked'''
+    #make sure the collection for this object is enabled in the outliner if it is a clothing item
+    if bake_object != c.get_body():
+        original_collection_state = c.get_layer_collection_state(bake_object.users_collection[0].name)
+        c.show_layer_collection(bake_object.users_collection[0].name, False)
+
+    #hide all objects except this one
+    for obj in [o for o in bpy.context.view_layer.objects if o]:
+        obj.hide_render = True
+    #unhide the object to bake (but only if the old baking system is not used)
+    if not bpy.context.scene.kkbp.old_bake_bool:
+        bake_object.hide_render = False
+    #the camera, fillerplane and flattener are removed and the collection state is restored even if the bake is stopped partway
+    try:
+        camera = setup_camera()
+        c.switch(bake_object)
+        setup_geometry_nodes_and_fillerplane(camera)
+        if not bpy.app.background:
+            bpy.ops.wm.redraw_timer(type='DRAW_WIN_SWAP', iterations=1)
+
+        #perform the baking operation
+        if bpy.context.scene.kkbp.aov_bake:
+            missing = bake_pass_aov(folderpath, bake_types, material_names, manifest)
+            c.print_timer(f'AOV pass for {bake_object.name}')
+            c.memory_probe.sample(f'AOV pass for {bake_object.name}')
+            #blended materials are left out of the AOV render and passes without a file are baked again, so they get a render per pass like usual
+            blended = {m.name for m in bake_object.data.materials if m and m.get('bake') and is_blended(m) and (material_names is None or m.name in material_names)}
+            for bake_type in bake_types:
+                if blended | missing[bake_type]:
+                    bake_pass(folderpath, bake_type, blended | missing[bake_type], manifest)
+            if blended or any(missing.values()):
+                c.print_timer(f'separate passes for {bake_object.name}')
+        else:
+            for bake_type in bake_types:
+                bake_pass(folderpath, bake_type, material_names, manifest)
+                c.print_timer(f'{bake_type} pass for {bake_object.name}')
+                c.memory_probe.sample(f'{bake_type} pass for {bake_object.name}')
+    finally:
+        cleanup()
+
+        #restore the original collection state 
+        if bake_object != c.get_body():
+            c.show_layer_collection(bake_object.users_collection[0].name, original_collection_state)
+
+def run_bake_farm(folderpath: str, bake_types: list[str], worker_count: int, manifest: BakeManifest) -> list[str]:
+    '''Saves a copy of this file and splits the materials between background blender processes that bake them at the same time.
+    Returns the names of the objects that had every image baked by the workers. Anything a worker failed to bake is left for the main session'''
+    #each worker gets an even share of the (object, material) pairs. Every pass of a material is baked by the same worker.
+    # Every png is only baked by one worker, so a material shared by several objects is baked with the last of them.
+    # That's the same object whose bake is kept when baking in this session, because it overwrites the others
+    jobs = {}
+    object_files = {}
+    for bake_object in c.get_all_bakeable_objects():
+        materials = {slot.material.name: slot.material for slot in bake_object.material_slots if slot.material and slot.material.get('bake')}
+        for material_name in sorted(materials):
+            filenames = [get_bake_filename(materials[material_name], bake_type) for bake_type in bake_types]
+            #materials that haven't changed since the last bake don't need a worker
+            if all(manifest.can_reuse(filename) for filename in filenames):
+                continue
+            object_files.setdefault(bake_object.name, set()).update(filenames)
+            jobs[filenames[0]] = (bake_object.name, material_name)
+    #sorted so the same materials always go to the same workers
+    jobs = sorted(jobs.values())
+    if not jobs:
+        return []
+    worker_count = min(worker_count, len(jobs))
+    #some file systems only store modified times to the second, so allow for that when checking the worker output
+    launch_time = time.time() - 2
 
-def replace_all_baked_materials(folderpath: str, bake_object: bpy.types.Object):
-    #load all baked images into blender
-    fileList = pathlib.Path(folderpath).glob('*.png')
-    files = [file for file in fileList if file.is_file()]
-    for file in files:
+    #delete the images the workers are going to bake, so an image left over from an earlier finalize can't be mistaken for their output
+    for object_name, material_name in jobs:
+        for bake_type in bake_types:
+            image_path = folderpath + get_bake_filename(bpy.data.materials[material_name], bake_type) + '.png'
+            if os.path.isfile(image_path):
+                os.remove(image_path)
+
+    temp_folder = tempfile.mkdtemp(prefix = 'kkbp_bake_')
+    blend_path = os.path.join(temp_folder, 'bake.blend')
+    bpy.ops.wm.save_as_mainfile(filepath = blend_path, copy = True)
+    c.kklog(f'Baking {len(jobs)} materials with {worker_count} background workers...')
+
+    workers = []
+    for worker_index in range(worker_count):
+        objects = {}
+        worker_jobs = jobs[worker_index::worker_count]
+        for object_name, material_name in worker_jobs:
+            objects.setdefault(object_name, []).append(material_name)
+        job_path = os.path.join(temp_folder, f'worker {worker_index}.json')
+        with open(job_path, 'w') as job_file:
+            json.dump({'folderpath': folderpath, 'bake_types': bake_types, 'objects': objects}, job_file)
+        log_path = os.path.join(temp_folder, f'worker {worker_index}.log')
+        #blender exits with 0 even if the python expression raises unless --python-exit-code is set
+        command = [bpy.app.binary_path, '--background', blend_path, '--python-exit-code', '1', '--python-expr',
+            f'import importlib; importlib.import_module({__name__!r}).run_bake_jobs({job_path!r})']
+        with open(log_path, 'w') as log_file:
+            workers.append((subprocess.Popen(command, stdout = log_file, stderr = subprocess.STDOUT), log_path, worker_jobs))
+
+    #any object with a missing image gets baked again in this session
+    missing_files = set()
+    for worker, log_path, worker_jobs in workers:
+        worker.wait()
+        worker_missing = set()
+        for object_name, material_name in worker_jobs:
+            for bake_type in bake_types:
+                filename = get_bake_filename(bpy.data.materials[material_name], bake_type)
+                #the images of a worker that failed can't be trusted even if they exist, so only a successful worker's new images are stamped
+                if worker.returncode != 0 or not manifest.mark_baked(filename, written_after = launch_time):
+                    worker_missing.add(filename)
+        if worker.returncode != 0 or worker_missing:
+            with open(log_path) as log_file:
+                c.kklog(f'A bake worker failed with exit code {worker.returncode} and did not bake {len(worker_missing)} image(s). The end of its log was:\n' + ''.join(log_file.readlines()[-20:]), type = 'warn')
+        missing_files |= worker_missing
+    shutil.rmtree(temp_folder, ignore_errors = True)
+    missing = sorted(object_name for object_name, filenames in object_files.items() if filenames & missing_files)
+    if missing:
+        c.kklog('The bake workers did not finish these objects, so they will be baked in this session: {}'.format(', '.join(missing)), type = 'warn')
+    return [object_name for object_name in object_files if object_name not in missing]
+
+def run_bake_jobs(job_path: str):
+    '''Runs inside a background blender process started by run_bake_farm. Bakes the materials listed in the job file'''
+    with open(job_path) as job_file:
+        job = json.load(job_file)
+    bpy.context.scene.render.engine = 'BLENDER_EEVEE_NEXT' if bpy.app.version[0] > 3 else 'BLENDER_EEVEE'
+    bpy.context.scene.render.film_transparent = True
+    bpy.context.scene.render.filter_size = 0.50
+    for object_name, material_names in job['objects'].items():
+        bake_object_passes(job['folderpath'], bpy.data.objects[object_name], job['bake_types'], set(material_names))
+
+def load_baked_images(folderpath: str, bake_objects: list[bpy.types.Object]) -> dict[str, bpy.types.Image]:
+    '''Loads the finalized png of every material slot on these objects exactly once. Files that no material slot uses are not loaded.
+    Returns the loaded images by file name'''
+    start = time.perf_counter()
+    #build the list of files the material slots will look for
+    expected = set()
+    for bake_object in bake_objects:
+        for mat in bake_object.material_slots:
+            if mat.material:
+                for bake_type in ['light', 'dark', 'normal']:
+                    expected.add(mat.material.name.replace('-ORG', '') + f' {bake_type}.png')
+    files = set(file for file in os.listdir(folderpath) if file.endswith('.png')) if os.path.isdir(folderpath) else set()
+
+    images = {}
+    for file in sorted(expected & files):
         try:
-            image = bpy.data.images.load(filepath=str(file))
+            image = bpy.data.images.load(filepath=os.path.join(folderpath, file))
             image.pack()
             #if there was an older version of this image, get rid of it
             if image.name[-4:] == '.001':
@@ -273,19 +847,40 @@ def replace_all_baked_materials(folderpath: str, bake_object: bpy.types.Object):
                     bpy.data.images[image.name[:-4]].user_remap(image)
                     bpy.data.images.remove(bpy.data.images[image.name[:-4]])
                     image.name = image.name[:-4]
+            images[file] = image
         except:
             c.kklog(f'Could not load in file because the name exceeds 64 characters: {file}')
-    
+    c.kklog('Loaded {} finalized images in {} seconds. Skipped {} files in the folder that no material uses'.format(len(images), round(time.perf_counter() - start, 3), len(files - expected)))
+    return images
+
+def replace_all_baked_materials(bake_object: bpy.types.Object, images: dict[str, bpy.types.Image]):
+    '''Replaces every baked material on this object with a simplified material that uses the finalized images from load_baked_images'''
+    #images that were cropped to the material's UV footprint need to know where they go
+    footprints = get_uv_footprints(bake_object) if use_adaptive_bake() else {}
+
     #now all needed images are loaded into the file. Match each material to it's image textures
     for bake_type in ['light', 'dark', 'normal']:
-        for mat in bake_object.material_slots:
-            image = bpy.data.images.get(mat.material.name.replace('-ORG', '') + f' {bake_type}.png', '')
+        for index, mat in enumerate(bake_object.material_slots):
+            #fall back to an image from an earlier finalize if the file isn't in the folder anymore
+            image_name = mat.material.name.replace('-ORG', '') + f' {bake_type}.png'
+            image = images.get(image_name) or bpy.data.images.get(image_name)
             if image:
+                #the crop depends on the resolution of the original material, which was renamed to -ORG after the first bake
+                original = mat.material if mat.material.get('bake') else bpy.data.materials.get(mat.material.name + '-ORG')
+                crop = None
+                if footprints and original and original.node_tree.nodes.get('textures'):
+                    resolution = get_bake_resolution(original)
+                    crop = get_bake_crop(footprints.get(index), resolution)
+                    #make sure the image really is cropped in case it was baked before adaptive resolution was turned on
+                    if crop and abs(image.size[0] - round((crop[2] - crop[0]) * resolution[0])) > 2:
+                        crop = None
+
                 #the simplified material already exists and is loaded into the material slot, so just load in the image
                 if mat.material.get('simple'):
                     simple = mat.material
                     textures_group = simple.node_tree.nodes['textures'].node_tree
                     textures_group.nodes[bake_type].image = image
+                    set_bake_crop(textures_group, bake_type, image, crop)
 
                 #the simplified material already exists, but the user swapped it back to the -ORG version to rebake it, 
                 # so load the material back into the material slot and load in the image
@@ -295,6 +890,7 @@ def replace_all_baked_materials(folderpath: str, bake_object: bpy.types.Object):
                     textures_group = simple.node_tree.nodes['textures'].node_tree
                     print(mat.material.name)
                     textures_group.nodes[bake_type].image = image
+                    set_bake_crop(textures_group, bake_type, image, crop)
 
                 #check if a simplified version of this material exists yet. If it doesn't, create it
                 elif mat.material.get('bake'):
@@ -310,10 +906,12 @@ def replace_all_baked_materials(folderpath: str, bake_object: bpy.types.Object):
                     textures_group.name = simple.name
                     simple.node_tree.nodes['textures'].node_tree = textures_group
                     textures_group.nodes[bake_type].image = image
+                    set_bake_crop(textures_group, bake_type, image, crop)
                     # you have the ability to only bake the light textures, but it looks weird if there is no dark texture to go along with it, 
                     # put the light image into the dark slot. it will be overwritten if the dark texture exists on the next loop
                     if bake_type == 'light':
                         textures_group.nodes['dark'].image = image
+                        set_bake_crop(textures_group, 'dark', image, crop)
 
                     #and then replace the original material with this new simplified one
                     mat.material.use_fake_user = True
@@ -432,7 +1030,13 @@ def create_material_atlas(folderpath: str):
         bpy.ops.object.material_slot_remove_unused()
 
     #call the material combiner script
-    bpy.ops.kkbp.combiner()
+    try:
+        bpy.ops.kkbp.combiner()
+    except RuntimeError:
+        #the combiner cancels itself when it goes over the memory budget
+        if c.memory_probe.exceeded:
+            raise c.MemoryBudgetExceeded(c.memory_probe.exceeded)
+        raise
 
     #replace all images with the atlas in a new atlas material
     bake_types = []
@@ -463,24 +1067,30 @@ def create_material_atlas(folderpath: str):
         if not [mat_slot.material for mat_slot in obj.material_slots if mat_slot.material.get('simple')]:
             continue
 
+        #the combiner splits the materials across several atlas pages when they don't fit on one
+        atlas_pages = obj.get('kkbp_atlas_pages', {})
+        page_count = max(atlas_pages.values(), default = 0) + 1
         for bake_type in bake_types:
-            #check for atlas dupes
-            atlas_image_name = f'{sanitizeMaterialName(obj.name).replace("001","")}_{bake_type}.png'
-            if bpy.data.images.get(atlas_image_name):
-                bpy.data.images.remove(bpy.data.images.get(atlas_image_name))
-            #the atlas image is originally named after the index of the object. Rename it to the object name
-            original_image_path = os.path.join(context.scene.kkbp.import_dir, 'atlas_files', f'{index}_{bake_type}.png')
-            new_image_path = os.path.join(context.scene.kkbp.import_dir, 'atlas_files', atlas_image_name)
-            if os.path.exists(original_image_path):
-                try:
-                    os.rename(original_image_path, new_image_path)
-                except:
-                    #rename failed because the file already exists. Delete the old one and try again
-                    os.remove(new_image_path)
-                    os.rename(original_image_path, new_image_path)
-            #then load it into blender
-            atlas_image = bpy.data.images.load(new_image_path)
-            bpy.data.images.remove(bpy.data.images.get(f'{index}_{bake_type}.png'))
+            atlas_images = []
+            for page in range(page_count):
+                page_suffix = f'_{page}' if page else ''
+                #check for atlas dupes
+                atlas_image_name = f'{sanitizeMaterialName(obj.name).replace("001","")}{page_suffix}_{bake_type}.png'
+                if bpy.data.images.get(atlas_image_name):
+                    bpy.data.images.remove(bpy.data.images.get(atlas_image_name))
+                #the atlas image is originally named after the index of the object. Rename it to the object name
+                original_image_path = os.path.join(context.scene.kkbp.import_dir, 'atlas_files', f'{index}{page_suffix}_{bake_type}.png')
+                new_image_path = os.path.join(context.scene.kkbp.import_dir, 'atlas_files', atlas_image_name)
+                if os.path.exists(original_image_path):
+                    try:
+                        os.rename(original_image_path, new_image_path)
+                    except:
+                        #rename failed because the file already exists. Delete the old one and try again
+                        os.remove(new_image_path)
+                        os.rename(original_image_path, new_image_path)
+                #then load it into blender
+                atlas_images.append(bpy.data.images.load(new_image_path))
+                bpy.data.images.remove(bpy.data.images.get(f'{index}{page_suffix}_{bake_type}.png'))
             for material in [mat_slot.material for mat_slot in obj.material_slots if mat_slot.material.get('simple')]:
                 image = material.node_tree.nodes['textures'].node_tree.nodes[bake_type].image
                 if image:
@@ -505,6 +1115,7 @@ def create_material_atlas(folderpath: str):
                         atlas_material =  bpy.data.materials.get('{} Atlas'.format(material.name))
                         new_group = bpy.data.node_groups.get('{} Atlas'.format(material.name))
                     atlas_material.node_tree.nodes['textures'].node_tree = new_group
+                    atlas_image = atlas_images[atlas_pages.get(material.name, 0)]
                     new_group.nodes[bake_type].image = atlas_image
                     #load in the light image to the dark slot to make it look better when only the light colors are baked.
                     # This will be overwritten with the dark image in the next loop if the user baked it
@@ -550,6 +1161,7 @@ class bake_materials(bpy.types.Operator):
     bl_description = t('bake_mats_tt')
     bl_options = {'REGISTER', 'UNDO'}
         
+    @c.profile('bake_materials', 'operator')
     def execute(self, context):
         try:
             #just use the pmx folder for the baked files
@@ -559,6 +1171,12 @@ class bake_materials(bpy.types.Operator):
             last_step = time.time()
             c.toggle_console()
             c.reset_timer()
+            c.memory_probe.start()
+            c.memory_probe.sample('start of finalize')
+            if scene.adaptive_bake and not scene.use_atlas:
+                c.kklog('Adaptive resolution only works with an atlas, so the full images will be finalized', type = 'warn')
+            elif use_adaptive_bake():
+                c.kklog('Adaptive resolution is on. Export the atlas model, because the cropped images only line up with the atlas UVs', type = 'warn')
             c.kklog('Switching to EEVEE for material baking...')
             bpy.context.scene.render.engine = 'BLENDER_EEVEE_NEXT' if bpy.app.version[0] > 3 else 'BLENDER_EEVEE'
             c.switch(c.get_body(), 'OBJECT')
@@ -568,57 +1186,55 @@ class bake_materials(bpy.types.Operator):
             bpy.context.scene.render.film_transparent = True
             bpy.context.scene.render.filter_size = 0.50
 
+            bake_types = []
+            if scene.bake_light_bool:
+                bake_types.append('light')
+            if scene.bake_dark_bool:
+                bake_types.append('dark')
+            if scene.bake_norm_bool:
+                bake_types.append('normal')
+
+            #fingerprint every material before anything is changed for the bake
+            manifest = BakeManifest(folderpath)
+            for bake_object in c.get_all_bakeable_objects():
+                manifest.add_object(bake_object, bake_types)
+            c.print_timer('fingerprint materials')
+
+            #let background blender processes bake the objects if more than one worker is set
+            baked_by_workers = []
+            if scene.bake_workers > 1:
+                with c.profile('bake farm'):
+                    baked_by_workers = run_bake_farm(folderpath, bake_types, scene.bake_workers, manifest)
+                c.memory_probe.sample('bake farm')
+
             for bake_object in c.get_all_bakeable_objects():
                 #do a quick check to make sure this object has any materials that can be baked
                 worth_baking = [m for m in bake_object.material_slots if m.material.get('bake')]
                 if not worth_baking:
                     c.kklog(f'Not finalizing object because there were no materials worth baking: {bake_object.name}')
                     continue
+                if bake_object.name in baked_by_workers:
+                    continue
+                if manifest.is_object_current(bake_object.name):
+                    c.kklog(f'Reusing the finalized images for {bake_object.name} because nothing changed since the last finalize')
+                    continue
 
-                #make sure the collection for this object is enabled in the outliner if it is a clothing item
-                if bake_object != c.get_body():
-                    original_collection_state = c.get_layer_collection_state(bake_object.users_collection[0].name)
-                    c.show_layer_collection(bake_object.users_collection[0].name, False)
-
-                #hide all objects except this one
-                for obj in [o for o in bpy.context.view_layer.objects if o]:
-                    obj.hide_render = True
-                #unhide the object to bake (but only if the old baking system is not used)
-                if not bpy.context.scene.kkbp.old_bake_bool:
-                    bake_object.hide_render = False
-                camera = setup_camera()
-                c.switch(bake_object)
-                setup_geometry_nodes_and_fillerplane(camera)
-                bpy.ops.wm.redraw_timer(type='DRAW_WIN_SWAP', iterations=1)                
-
-                #perform the baking operation
-                bake_types = []
-                if scene.bake_light_bool:
-                    bake_types.append('light')
-                if scene.bake_dark_bool:
-                    bake_types.append('dark')
-                if scene.bake_norm_bool:
-                    bake_types.append('normal')
-                for bake_type in bake_types:
-                    bake_pass(folderpath, bake_type)
-                cleanup()
-
-                #restore the original collection state 
-                if bake_object != c.get_body():
-                    c.show_layer_collection(bake_object.users_collection[0].name, original_collection_state)
-            
-            #disable transparency
-            bpy.context.scene.render.film_transparent = False
-            bpy.context.scene.render.filter_size = 1.5
-            for bake_object in c.get_all_bakeable_objects():
-                replace_all_baked_materials(folderpath, bake_object)
+                with c.profile(f'bake {bake_object.name}'):
+                    bake_object_passes(folderpath, bake_object, bake_types, manifest = manifest)
+            manifest.save()
+            c.kklog(f'Reused {len(manifest.reused)} finalized images from the last finalize')
             
-            #show all objects again
-            for obj in bpy.context.view_layer.objects:
-                obj.hide_render = False
+            #disable transparency and show all objects again
+            restore_render_state()
+            with c.profile('replace_all_baked_materials'):
+                baked_images = load_baked_images(folderpath, c.get_all_bakeable_objects())
+                for bake_object in c.get_all_bakeable_objects():
+                    replace_all_baked_materials(bake_object, baked_images)
             
             if scene.use_atlas:
-                create_material_atlas(folderpath)
+                with c.profile('create_material_atlas'):
+                    create_material_atlas(folderpath)
+                c.memory_probe.sample('create_material_atlas')
             
             #setup the original collection for exporting
             # https://blender.stackexchange.com/questions/127403/change-active-collection
@@ -652,10 +1268,20 @@ class bake_materials(bpy.types.Operator):
                     bpy.data.collections[c.get_name()].exporters[0].export_properties.filepath = os.path.join(folderpath.replace('baked_files', 'atlas_files'), f'{sanitizeMaterialName(c.get_name())} exported model.fbx')
             c.toggle_console()
 
+            c.memory_probe.finish()
             c.kklog('Finished in ' + str(time.time() - last_step)[0:4] + 's')
             c.set_viewport_shading('SOLID')
             return {'FINISHED'}
+        except c.MemoryBudgetExceeded as error:
+            #the bake cleans up its camera and flattener itself, so only the render settings are left to undo
+            restore_render_state()
+            c.memory_probe.finish()
+            c.kklog(str(error), type = 'error')
+            c.set_viewport_shading('SOLID')
+            self.report({'ERROR'}, str(error))
+            return {"CANCELLED"}
         except:
+            c.memory_probe.finish()
             c.kklog('Unknown python error occurred', type = 'error')
             c.kklog(traceback.format_exc())
             c.set_viewport_shading('SOLID')
@@ -3,6 +3,7 @@
 import bpy, traceback, time
 from .. import common as c
 from ..interface.dictionary_en import t
+from ..extras.catsscripts.common import delete_zero_weight_batch
 
 def main(prep_type, simp_type, ue_apply_scale, ue_triangulate_mesh):
     try:
@@ -320,6 +321,11 @@ def main(prep_type, simp_type, ue_apply_scale, ue_triangulate_mesh):
         bpy.ops.object.mode_set(mode='EDIT')
         bpy.ops.kkbp.cats_merge_weights()
 
+    #Remove the bone vertex groups that have no weight on every character mesh at once. Groups that aren't named after a bone are kept
+    character_meshes = [child for child in bpy.data.objects[armature_name].children if child.type == 'MESH']
+    removed_bones, removed_groups = delete_zero_weight_batch(bpy.data.objects[armature_name], character_meshes, remove_bones = False)
+    c.kklog('Removed {} empty bone vertex groups from {} meshes'.format(removed_groups, len(character_meshes)))
+
     #If exporting for MMD...
     if prep_type == 'C':
         #Create the empty
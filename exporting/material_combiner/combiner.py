@@ -1,7 +1,8 @@
 import bpy
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from bpy.props import *
 from .combiner_ops import *
-from .packer import BinPacker
 from ... import common as c
 
 class Combiner(bpy.types.Operator):
@@ -10,6 +11,7 @@ class Combiner(bpy.types.Operator):
     bl_description = 'Combine materials'
     bl_options = {'UNDO', 'INTERNAL'}
 
+    @c.profile('combiner', 'operator')
     def execute(self, context: bpy.types.Context) -> Set[str]:
         #from invoke
         scn = context.scene
@@ -21,23 +23,19 @@ class Combiner(bpy.types.Operator):
             
             set_ob_mode(context.view_layer, scn.kkbp_ob_data)
             self.data = get_data(scn.kkbp_ob_data, object)
-            self.mats_uv = get_mats_uv(scn, self.data)
+            self.uv_buffer = UVBuffer()
+            self.mats_uv = get_mats_uv(scn, self.data, self.uv_buffer)
             clear_empty_mats(scn, self.data, self.mats_uv)
             get_duplicates(self.mats_uv)
             self.structure = get_structure(scn, self.data, self.mats_uv)
+            apply_uv_crops(self.structure, self.uv_buffer)
+            c.print_timer(f'gather materials for {object.name}')
             
             #from execute
             scn.kkbp_save_path = os.path.join(context.scene.kkbp.import_dir, 'atlas_files')
-            self.structure = BinPacker(get_size(scn, self.structure)).fit()
-
-            size = get_atlas_size(self.structure)
-            atlas_size = calculate_adjusted_size(scn, size)
-
-            if max(atlas_size, default=0) > 20000:
-                text = 'The output image size of {0}x{1}px is too large'.format(*atlas_size)
-                c.kklog(text)
-                self.report({'ERROR'}, text)
-                return {'FINISHED'}
+            pages = get_pages(scn, get_size(scn, self.structure, self.uv_buffer))
+            set_atlas_pages(object, pages)
+            c.print_timer(f'pack {len(pages)} atlas page(s) for {object.name}')
             
             bake_types = []
             if scn.kkbp.bake_light_bool:
@@ -46,8 +44,10 @@ class Combiner(bpy.types.Operator):
                 bake_types.append('dark')
             if scn.kkbp.bake_norm_bool:
                 bake_types.append('normal')
+            if not bake_types:
+                continue
 
-            for type in bake_types:
+            def set_pass_images(type: str) -> None:
                 #replace all images
                 for material in [mat_slot.material for mat_slot in object.material_slots if mat_slot.material.get('simple')]:
                     image = material.node_tree.nodes['textures'].node_tree.nodes[type].image
@@ -58,13 +58,45 @@ class Combiner(bpy.types.Operator):
                         continue
                     else:
                         material.node_tree.nodes['Image Texture'].image = image
-                
-                #then run the atlas creation
-                atlas = get_atlas(scn, self.structure, atlas_size)
-                comb_mats = get_comb_mats(scn, atlas, self.mats_uv, type, index)
-                c.print_timer(f'save atlas for {object.name} {type}')
 
-            align_uvs(scn, self.structure, atlas.size, size)
+            #every pass uses the same layout. Sources that show up more than once on a page are only decoded once
+            # and dropped after their last paste, and each atlas is encoded on its own thread while the next one is composed.
+            # A page is only started once the previous page has been written, so only one page is held in memory at a time
+            os.makedirs(scn.kkbp_save_path, exist_ok=True)
+            saves = []
+            pending = []
+            with ThreadPoolExecutor(max_workers=len(bake_types)) as executor:
+                for page_index, page in enumerate(pages):
+                    size = get_atlas_size(page)
+                    atlas_size = calculate_adjusted_size(scn, size)
+                    for save in pending:
+                        save.result()
+                    pending = []
+                    gfx_cache = {}
+                    gfx_uses = Counter()
+                    for type in bake_types:
+                        set_pass_images(type)
+                        count_gfx_uses(page, gfx_uses)
+                    for type in bake_types:
+                        set_pass_images(type)
+                        #then run the atlas creation
+                        atlas = get_atlas(scn, page, atlas_size, gfx_cache, gfx_uses)
+                        atlas_image_size = atlas.size
+                        pending.append(executor.submit(save_atlas, atlas, get_atlas_path(scn, index, type, page_index)))
+                        del atlas
+                        try:
+                            c.memory_probe.sample(f'{type} atlas page {page_index} for {object.name}')
+                        except c.MemoryBudgetExceeded as error:
+                            c.kklog(str(error), type = 'error')
+                            self.report({'ERROR'}, str(error))
+                            return {'CANCELLED'}
+                    saves.extend((type, save) for type, save in zip(bake_types, pending))
+                    align_uvs(scn, page, atlas_image_size, size, self.uv_buffer)
+            self.uv_buffer.write(scn)
+            c.print_timer(f'compose and save atlases for {object.name}')
+
+            for type, save in saves:
+                comb_mats = get_comb_mats(scn, save.result(), self.mats_uv, type, index)
             bpy.ops.kkbp.refresh_ob_data()
 
         return {'FINISHED'}
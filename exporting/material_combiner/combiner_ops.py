@@ -4,9 +4,11 @@ import math
 import os
 import random
 import re
+from collections import Counter
 from collections import OrderedDict
 from collections import defaultdict
 from itertools import chain
+from typing import Callable
 from typing import Dict
 from typing import List
 from typing import Sequence
@@ -34,9 +36,10 @@ from .materials import get_diffuse
 from .materials import get_shader_type
 from .materials import shader_image_nodes
 from .materials import sort_materials
-from .objects import align_uv
+from .objects import UVBuffer
+from .objects import get_poly_arrays
 from .objects import get_polys
-from .objects import get_uv
+from .packer import MaxRectsPacker
 
 try:
     from PIL import Image
@@ -84,16 +87,29 @@ def get_data(data: Sequence[bpy.types.PropertyGroup], object) -> SMCObData:
     return mats
 
 
-def get_mats_uv(scn: Scene, data: SMCObData) -> MatsUV:
-    mats_uv = defaultdict(lambda: defaultdict(list))
+def get_mats_uv(scn: Scene, data: SMCObData, uv_buffer: UVBuffer) -> MatsUV:
+    #returns the loop indices of each material. The UVs themselves stay in the uv_buffer
+    mats_uv = defaultdict(dict)
     for ob_n, item in data.items():
         ob = scn.objects[ob_n]
-        for idx, polys in get_polys(ob).items():
+        loop_starts, loop_totals, material_indices = get_poly_arrays(ob)
+        if not len(loop_starts):
+            continue
+        uvs = uv_buffer.read(ob)
+        in_item = np.array([mat in item for mat in ob.data.materials] + [False], dtype=bool)
+        face_mask = in_item[np.clip(material_indices, 0, len(in_item) - 1)]
+
+        #move every face of a combined material into the tile its lowest UV is in. NaN UVs are ignored
+        face_min = np.stack([np.fmin.reduceat(uvs[:, 0], loop_starts), np.fmin.reduceat(uvs[:, 1], loop_starts)], axis=1)
+        face_offset = np.floor(np.nan_to_num(face_min, nan=0.0, posinf=0.0, neginf=0.0))
+        face_offset[~face_mask] = 0
+        uvs -= np.repeat(face_offset, loop_totals, axis=0)
+
+        loop_materials = np.repeat(material_indices, loop_totals)
+        for idx in np.unique(material_indices[face_mask]):
             mat = ob.data.materials[idx]
-            if mat not in item:
-                continue
-            for poly in polys:
-                mats_uv[ob_n][mat].extend(align_uv(get_uv(ob, poly)))
+            indices = np.flatnonzero(loop_materials == idx)
+            mats_uv[ob_n][mat] = np.concatenate([mats_uv[ob_n][mat], indices]) if mat in mats_uv[ob_n] else indices
     return mats_uv
 
 
@@ -143,10 +159,35 @@ def get_structure(scn: Scene, data: SMCObData, mats_uv: MatsUV) -> Structure:
                 structure[kkbp_root_mat]['dup'].append(mat.name)
             if ob.name not in structure[kkbp_root_mat]['ob']:
                 structure[kkbp_root_mat]['ob'].append(ob.name)
-            structure[kkbp_root_mat]['uv'].extend(mats_uv[ob_n][mat])
+            if mat in mats_uv[ob_n]:
+                structure[kkbp_root_mat]['uv'].append((ob_n, mats_uv[ob_n][mat]))
     return structure
 
 
+def apply_uv_crops(data: Structure, uv_buffer: UVBuffer) -> None:
+    #bakes that were cropped to the material's UV footprint only cover part of the UV square,
+    # so move the UVs onto the smaller image before it is packed
+    for mat, item in data.items():
+        crop = _get_uv_crop(mat)
+        if not crop:
+            continue
+        min_u, min_v, max_u, max_v = crop
+        for ob_n, indices in item['uv']:
+            uvs = uv_buffer.uvs[ob_n]
+            uvs[indices] = (uvs[indices] - (min_u, min_v)) / (max_u - min_u, max_v - min_v)
+
+
+def _get_uv_crop(mat: bpy.types.Material) -> Union[List[float], None]:
+    textures = mat.node_tree.nodes.get('textures') if mat.node_tree else None
+    if not textures or not textures.node_tree:
+        return None
+    for node_name in ['light', 'dark', 'normal']:
+        node = textures.node_tree.nodes.get(node_name)
+        if node and node.image and node.image.get('kkbp_uv_crop'):
+            return list(node.image['kkbp_uv_crop'])
+    return None
+
+
 def clear_duplicates(scn: Scene, data: Structure) -> None:
     for item in data.values():
         for ob_n in item['ob']:
@@ -155,11 +196,11 @@ def clear_duplicates(scn: Scene, data: Structure) -> None:
                 _delete_material(ob, dup_name)
 
 
-def get_size(scn: Scene, data: Structure) -> Dict:
+def get_size(scn: Scene, data: Structure, uv_buffer: UVBuffer) -> Dict:
     for mat, item in data.items():
         img = _get_image(mat)
         packed_file = get_packed_file(img)
-        max_x, max_y = _get_max_uv_coordinates(item['uv'])
+        max_x, max_y = _get_max_uv_coordinates(item['uv'], uv_buffer)
         item['gfx']['uv_size'] = (np.clip(max_x, 1, 25), np.clip(max_y, 1, 25))
 
         if not scn.kkbp_crop:
@@ -205,15 +246,17 @@ def _get_image_size(mat: bpy.types.Material, img: bpy.types.Image) -> Tuple[int,
     )
 
 
-def _get_max_uv_coordinates(uv_loops: List[bpy.types.MeshUVLoop]) -> Tuple[float, float]:
+def _get_max_uv_coordinates(uv_loops: List[Tuple[str, np.ndarray]], uv_buffer: UVBuffer) -> Tuple[float, float]:
     max_x = 1
     max_y = 1
 
-    for uv in uv_loops:
-        if not math.isnan(uv.x):
-            max_x = max(max_x, uv.x)
-        if not math.isnan(uv.y):
-            max_y = max(max_y, uv.y)
+    for ob_n, indices in uv_loops:
+        if not len(indices):
+            continue
+        uvs = uv_buffer.uvs[ob_n][indices]
+        with np.errstate(invalid='ignore'):
+            max_x = max(max_x, float(np.nan_to_num(np.nanmax(uvs[:, 0]), nan=1)))
+            max_y = max(max_y, float(np.nan_to_num(np.nanmax(uvs[:, 1]), nan=1)))
 
     return max_x, max_y
 
@@ -241,7 +284,89 @@ def calculate_adjusted_size(scn: Scene, size: Tuple[int, int]) -> Tuple[int, int
     return size
 
 
-def get_atlas(scn: Scene, data: Structure, atlas_size: Tuple[int, int]) -> ImageType:
+def get_pages(scn: Scene, data: Structure) -> List[Structure]:
+    #split the materials across as many atlas pages as it takes to keep each page within the page size.
+    # Materials are taken largest first and every page gets as many of them as the packer can fit
+    page_size = scn.kkbp.atlas_page_size
+    _fit_to_page(scn, data, page_size)
+
+    adjust_size = lambda size: calculate_adjusted_size(scn, size)
+    items = list(data.items())
+    pages = []
+    while items:
+        count = _get_page_count(items, page_size, adjust_size)
+        pages.append(MaxRectsPacker(OrderedDict(items[:count]), adjust_size).fit())
+        items = items[count:]
+    return pages
+
+
+def _fit_to_page(scn: Scene, data: Structure, page_size: int) -> None:
+    gaps = scn.kkbp_gaps
+    for mat, item in data.items():
+        width, height = item['gfx']['size']
+        if max(width, height) <= page_size:
+            continue
+        scale = (page_size - gaps) / (max(width, height) - gaps)
+        item['gfx']['size'] = (int((width - gaps) * scale) + gaps, int((height - gaps) * scale) + gaps)
+        item['gfx']['scale'] = scale
+        c.kklog('{0} is larger than an atlas page and was scaled down to {1}x{2}px'.format(mat.name, *item['gfx']['size']), type = 'warn')
+
+
+def _get_page_count(items: List[Tuple[bpy.types.Material, StructureItem]], page_size: int,
+                    adjust_size: Callable[[Tuple[int, int]], Tuple[int, int]]) -> int:
+    packer = MaxRectsPacker({}, adjust_size)
+    sizes = [(math.ceil(item['gfx']['size'][0]), math.ceil(item['gfx']['size'][1])) for _, item in items]
+
+    def fits(count: int) -> bool:
+        positions = packer.pack(sizes[:count])
+        used = (max(x + w for (x, _), (w, _) in zip(positions, sizes)),
+                max(y + h for (_, y), (_, h) in zip(positions, sizes)))
+        return max(adjust_size(used)) <= page_size
+
+    if fits(len(sizes)):
+        return len(sizes)
+
+    #the images can't fit once they cover more than a whole page, so only search below that
+    high = len(sizes) - 1
+    area = 0
+    for count, (w, h) in enumerate(sizes):
+        area += w * h
+        if area > page_size * page_size:
+            high = min(high, max(1, count))
+            break
+
+    #a page always gets at least one image, even if rounding the atlas size pushes it over the page size
+    low = 1
+    while low < high:
+        middle = (low + high + 1) // 2
+        if fits(middle):
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+def set_atlas_pages(ob: bpy.types.Object, pages: List[Structure]) -> None:
+    #remember which atlas page every material ended up on so the atlas materials can use the right image
+    atlas_pages = {}
+    for page_index, page in enumerate(pages):
+        for mat, item in page.items():
+            for mat_name in [mat.name] + item['dup']:
+                atlas_pages[mat_name] = page_index
+    ob['kkbp_atlas_pages'] = atlas_pages
+
+
+def count_gfx_uses(data: Structure, gfx_uses: Counter) -> None:
+    #count every source image a pass pastes. Run once per pass with that pass's images set, before any atlas of the page is made
+    for mat, item in data.items():
+        _set_image_or_color(item, mat)
+        key = _get_gfx_key(mat, item)
+        if key:
+            gfx_uses[key] += 1
+
+
+def get_atlas(scn: Scene, data: Structure, atlas_size: Tuple[int, int], gfx_cache: Dict = None,
+              gfx_uses: Counter = None) -> ImageType:
     #create new atlas image
     kkbp_size = (scn.kkbp_size_width, scn.kkbp_size_height)
     img = Image.new('RGBA', atlas_size)
@@ -250,7 +375,7 @@ def get_atlas(scn: Scene, data: Structure, atlas_size: Tuple[int, int]) -> Image
     #for every material in data items, 
     for mat, item in data.items():
         _set_image_or_color(item, mat)
-        _paste_gfx(scn, item, mat, img, half_gaps)
+        _paste_gfx(scn, item, mat, img, half_gaps, gfx_cache, gfx_uses)
 
     if scn.kkbp_size in ['CUST', 'STRICTCUST']:
         img.thumbnail(kkbp_size, resampling)
@@ -272,14 +397,36 @@ def _set_image_or_color(item: StructureItem, mat: bpy.types.Material) -> None:
         item['gfx']['img_or_color'] = get_diffuse(mat)
 
 
-def _paste_gfx(scn: Scene, item: StructureItem, mat: bpy.types.Material, img: ImageType, half_gaps: int) -> None:
+def _get_gfx_key(mat: bpy.types.Material, item: StructureItem) -> Union[Tuple, None]:
+    #everything _get_gfx reads except the diffuse color, which is multiplied in after the cache
+    img_or_color = item['gfx']['img_or_color']
+    if not item['gfx']['fit'] or not isinstance(img_or_color, bpy.types.PackedFile):
+        return None
+    thumbnail = (mat.kkbp_size_width, mat.kkbp_size_height) if mat.kkbp_size else None
+    return img_or_color.id_data.name, tuple(item['gfx']['size']), thumbnail, item['gfx'].get('scale'), tuple(item['gfx']['uv_size'])
+
+
+def _paste_gfx(scn: Scene, item: StructureItem, mat: bpy.types.Material, img: ImageType, half_gaps: int,
+               gfx_cache: Dict = None, gfx_uses: Counter = None) -> None:
     if not item['gfx']['fit']:
         return
 
-    img.paste(
-        _get_gfx(scn, mat, item, item['gfx']['img_or_color']),
-        (int(item['gfx']['fit']['x'] + half_gaps), int(item['gfx']['fit']['y'] + half_gaps))
-    )
+    #the passes and materials can share a source image, so the decoded version is kept until the last paste that uses it
+    img_or_color = item['gfx']['img_or_color']
+    key = _get_gfx_key(mat, item) if gfx_cache is not None and gfx_uses is not None else None
+    gfx = gfx_cache.get(key) if key else None
+    if gfx is None:
+        gfx = _get_gfx(scn, mat, item, img_or_color)
+    if key:
+        gfx_uses[key] -= 1
+        if gfx_uses[key] > 0:
+            gfx_cache[key] = gfx
+        else:
+            gfx_cache.pop(key, None)
+    if isinstance(img_or_color, bpy.types.PackedFile) and mat.kkbp_diffuse:
+        gfx = ImageChops.multiply(gfx, Image.new(gfx.mode, gfx.size, get_diffuse(mat)))
+
+    img.paste(gfx, (int(item['gfx']['fit']['x'] + half_gaps), int(item['gfx']['fit']['y'] + half_gaps)))
 
 
 def _get_gfx(scn: Scene, mat: bpy.types.Material, item: StructureItem,
@@ -297,31 +444,29 @@ def _get_gfx(scn: Scene, mat: bpy.types.Material, item: StructureItem,
         img.resize(size, resampling)
     if mat.kkbp_size:
         img.thumbnail((mat.kkbp_size_width, mat.kkbp_size_height), resampling)
+    if item['gfx'].get('scale'):
+        #this image was too big for an atlas page
+        img = img.resize(tuple(max(1, round(x * item['gfx']['scale'])) for x in img.size), resampling)
     if max(item['gfx']['uv_size'], default=0) > 1:
         img = _get_uv_image(item, img, size)
-    if mat.kkbp_diffuse:
-        diffuse_img = Image.new(img.mode, size, get_diffuse(mat))
-        img = ImageChops.multiply(img, diffuse_img)
 
     return img
 
 
 def _get_uv_image(item: StructureItem, img: ImageType, size: Tuple[int, int]) -> ImageType:
-    uv_img = Image.new('RGBA', size)
-    size_height = size[1]
+    #repeat the image over the UV range the material uses, starting from the bottom left like the UVs do.
+    # every pixel of the result is looked up in the source by index, so the repeats are cropped to the exact
+    # (possibly fractional) UV size without building a larger tiled image first
+    size_width, size_height = size
     img_width, img_height = img.size
-    uv_width, uv_height = (math.ceil(x) for x in item['gfx']['uv_size'])
+    pixels = np.asarray(img.convert('RGBA'))
 
-    for h in range(uv_height):
-        y = size_height - img_height - h * img_height
-        for w in range(uv_width):
-            x = w * img_width
-            uv_img.paste(img, (x, y))
+    rows = img_height - 1 - (size_height - 1 - np.arange(size_height)) % img_height
+    columns = np.arange(size_width) % img_width
+    return Image.fromarray(np.ascontiguousarray(pixels[np.ix_(rows, columns)]), 'RGBA')
 
-    return uv_img
 
-
-def align_uvs(scn: Scene, data: Structure, atlas_size: Tuple[int, int], size: Tuple[int, int]) -> None:
+def align_uvs(scn: Scene, data: Structure, atlas_size: Tuple[int, int], size: Tuple[int, int], uv_buffer: UVBuffer) -> None:
     size_width, size_height = size
 
     scaled_width, scaled_height = _get_scale_factors(atlas_size, size)
@@ -340,15 +485,16 @@ def align_uvs(scn: Scene, data: Structure, atlas_size: Tuple[int, int], size: Tu
         x_offset = item['gfx']['fit']['x'] + border_margin
         y_offset = item['gfx']['fit']['y'] - border_margin
 
-        for uv in item['uv']:
-            reset_x = uv.x / uv_width * gfx_width_margin
-            reset_y = uv.y / uv_height * gfx_height_margin - gfx_height
+        for ob_n, indices in item['uv']:
+            uvs = uv_buffer.uvs[ob_n]
+            reset_x = uvs[indices, 0] / uv_width * gfx_width_margin
+            reset_y = uvs[indices, 1] / uv_height * gfx_height_margin - gfx_height
 
             uv_x = (reset_x + x_offset) / size_width
             uv_y = (reset_y - y_offset) / size_height
 
-            uv.x = uv_x * scaled_width
-            uv.y = uv_y * scaled_height + 1
+            uvs[indices, 0] = uv_x * scaled_width
+            uvs[indices, 1] = uv_y * scaled_height + 1
 
 
 def _get_scale_factors(atlas_size: Tuple[int, int], size: Tuple[int, int]) -> Tuple[float, float]:
@@ -364,9 +510,8 @@ def _get_scale_factors(atlas_size: Tuple[int, int], size: Tuple[int, int]) -> Tu
     return (1, 1 / aspect_ratio) if aspect_ratio > 1 else (aspect_ratio, 1)
 
 
-def get_comb_mats(scn: Scene, atlas: ImageType, mats_uv: MatsUV, type: str, atlas_index) -> CombMats:
+def get_comb_mats(scn: Scene, path: str, mats_uv: MatsUV, type: str, atlas_index) -> CombMats:
     layers = _get_layers(scn, mats_uv)
-    path = _save_atlas(scn, atlas, atlas_index, type)
     texture = _create_texture(path, atlas_index)
     return cast(CombMats, {idx: _create_material(texture, atlas_index, idx) for idx in layers})
 
@@ -411,14 +556,15 @@ def _add_ids_from_existing_files(scn: Scene, existed_ids: Set[int]) -> None:
             existed_ids.add(int(match.group(1)))
 
 
-def _save_atlas(scn: Scene, atlas: ImageType, atlas_index: str, type: str) -> str:
-    path = os.path.join(scn.kkbp_save_path, f'{atlas_index}_{type}.png')
-    try:
-        atlas.save(path)
-    except:
-        #atlas folder didn't exist
-        os.mkdir(scn.kkbp_save_path)
-        atlas.save(path)
+def get_atlas_path(scn: Scene, atlas_index: str, type: str, page: int = 0) -> str:
+    #the first page keeps the plain name, the rest get their page number
+    page_suffix = f'_{page}' if page else ''
+    return os.path.join(scn.kkbp_save_path, f'{atlas_index}{page_suffix}_{type}.png')
+
+
+def save_atlas(atlas: ImageType, path: str) -> str:
+    #doesn't touch any blender data so it can run on a worker thread. Pillow releases the GIL while encoding
+    atlas.save(path)
     return path
 
 
@@ -1,9 +1,8 @@
-import math
 from collections import defaultdict
-from typing import List, Dict
+from typing import Dict, Tuple
 
 import bpy
-from mathutils import Vector
+import numpy as np
 
 
 def get_polys(ob: bpy.types.Object) -> Dict[int, bpy.types.MeshPolygon]:
@@ -13,26 +12,31 @@ def get_polys(ob: bpy.types.Object) -> Dict[int, bpy.types.MeshPolygon]:
     return polys
 
 
-def get_uv(ob: bpy.types.Object, poly: bpy.types.MeshPolygon) -> List[Vector]:
-    data = ob.data.uv_layers.active.data
-    return [data[loop_idx].uv if loop_idx < len(data) else Vector((0, 0, 0)) for loop_idx in poly.loop_indices]
-
-
-def align_uv(face_uv: List[Vector]) -> List[Vector]:
-    min_x = float('inf')
-    min_y = float('inf')
-
-    for uv in face_uv:
-        if not math.isnan(uv.x):
-            min_x = min(min_x, uv.x)
-        if not math.isnan(uv.y):
-            min_y = min(min_y, uv.y)
-
-    min_x = math.floor(min_x)
-    min_y = math.floor(min_y)
-
-    if min_x != 0 or min_y != 0:
-        for uv in face_uv:
-            uv.x -= min_x
-            uv.y -= min_y
-    return face_uv
+def get_poly_arrays(ob: bpy.types.Object) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    polygons = ob.data.polygons
+    loop_starts = np.empty(len(polygons), dtype=np.int32)
+    loop_totals = np.empty(len(polygons), dtype=np.int32)
+    material_indices = np.empty(len(polygons), dtype=np.int32)
+    polygons.foreach_get('loop_start', loop_starts)
+    polygons.foreach_get('loop_total', loop_totals)
+    polygons.foreach_get('material_index', material_indices)
+    return loop_starts, loop_totals, material_indices
+
+
+class UVBuffer(object):
+    # Holds the active UV layer of each object as an (n, 2) array.
+    # It is read with one foreach_get per object and written back with one foreach_set per object
+    def __init__(self) -> None:
+        self.uvs = {}
+
+    def read(self, ob: bpy.types.Object) -> np.ndarray:
+        if ob.name not in self.uvs:
+            data = ob.data.uv_layers.active.data
+            uvs = np.empty(len(data) * 2, dtype=np.float32)
+            data.foreach_get('uv', uvs)
+            self.uvs[ob.name] = uvs.reshape(-1, 2).astype(np.float64)
+        return self.uvs[ob.name]
+
+    def write(self, scn) -> None:
+        for ob_n, uvs in self.uvs.items():
+            scn.objects[ob_n].data.uv_layers.active.data.foreach_set('uv', uvs.astype(np.float32).ravel())
@@ -18,8 +18,12 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
-from typing import Union
+import math
+from typing import Callable
 from typing import Dict
+from typing import List
+from typing import Tuple
+from typing import Union
 
 
 class BinPacker(object):
@@ -94,3 +98,169 @@ class BinPacker(object):
         }
         node = self.find_node(self.root, w, h)
         return self.split_node(node, w, h) if node else None
+
+
+class MaxRectsPacker(object):
+    # Packs the images into the smallest atlas it can find with the MaxRects algorithm and the best short side fit rule.
+    # Free space is kept as a flat list of (x, y, w, h) tuples instead of a tree, so nothing recurses.
+    # Images are never rotated so their UVs stay valid.
+    # Several atlas widths are tried and the smallest height that fits is searched for each of them.
+    # adjust_size can round the atlas size the same way the combiner will (power of two, square),
+    # so the layout with the smallest final atlas is kept.
+    def __init__(self, images: Dict, adjust_size: Callable[[Tuple[int, int]], Tuple[int, int]] = None) -> None:
+        self.bin = images
+        self.adjust_size = adjust_size or (lambda size: size)
+
+    def fit(self) -> Dict:
+        if not self.bin:
+            return self.bin
+
+        sizes = [(math.ceil(img['gfx']['size'][0]), math.ceil(img['gfx']['size'][1])) for img in self.bin.values()]
+        positions = self.pack(sizes)
+        for img, (x, y) in zip(self.bin.values(), positions):
+            img['gfx']['fit'] = {'x': x, 'y': y}
+        return self.bin
+
+    def pack(self, sizes: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+        best = None
+        best_score = None
+        for width in self._candidate_widths(sizes):
+            positions = self._pack_smallest_height(width, sizes)
+            if not positions:
+                continue
+            used = (max(x + w for (x, _), (w, _) in zip(positions, sizes)),
+                    max(y + h for (_, y), (_, h) in zip(positions, sizes)))
+            adjusted = self.adjust_size(used)
+            score = (adjusted[0] * adjusted[1], used[0] * used[1], max(used))
+            if best_score is None or score < best_score:
+                best, best_score = positions, score
+        return best
+
+    @staticmethod
+    def _candidate_widths(sizes: List[Tuple[int, int]]) -> List[int]:
+        max_width = max(w for w, _ in sizes)
+        side = math.sqrt(sum(w * h for w, h in sizes))
+        widths = {max(max_width, int(side * factor)) for factor in (0.7, 0.8, 0.9, 1.0, 1.1, 1.25, 1.5, 2.0)}
+        # power of two widths are often the best fit once the atlas is rounded up
+        width = 1 << (max_width - 1).bit_length()
+        while width < side * 2:
+            widths.add(width)
+            width <<= 1
+        return sorted(widths)
+
+    def _pack_smallest_height(self, width: int, sizes: List[Tuple[int, int]]) -> Union[List[Tuple[int, int]], None]:
+        low = max(max(h for _, h in sizes), math.ceil(sum(w * h for w, h in sizes) / width))
+        high = sum(h for _, h in sizes)
+        best = self._pack(width, high, sizes)
+        if not best:
+            return None
+        # binary search the height to within 1%, starting from the height the first packing actually used
+        high = max(y + h for (_, y), (_, h) in zip(best, sizes))
+        while high - low > max(1, low // 100):
+            middle = (low + high) // 2
+            positions = self._pack(width, middle, sizes)
+            if positions:
+                best = positions
+                high = max(y + h for (_, y), (_, h) in zip(best, sizes))
+            else:
+                low = middle + 1
+        return best
+
+    @staticmethod
+    def _pack(width: int, height: int, sizes: List[Tuple[int, int]]) -> Union[List[Tuple[int, int]], None]:
+        free = [(0, 0, width, height)]
+        positions = []
+        for w, h in sizes:
+            # best short side fit, then best long side fit, then the lowest position
+            best = None
+            best_score = None
+            for fx, fy, fw, fh in free:
+                if w <= fw and h <= fh:
+                    leftover_x = fw - w
+                    leftover_y = fh - h
+                    score = (min(leftover_x, leftover_y), max(leftover_x, leftover_y), fy, fx)
+                    if best_score is None or score < best_score:
+                        best, best_score = (fx, fy), score
+            if not best:
+                return None
+            x, y = best
+            positions.append(best)
+
+            # split every free rectangle that overlaps the placed image into the maximal rectangles around it
+            untouched = []
+            split = []
+            for rect in free:
+                fx, fy, fw, fh = rect
+                if x >= fx + fw or x + w <= fx or y >= fy + fh or y + h <= fy:
+                    untouched.append(rect)
+                    continue
+                if x > fx:
+                    split.append((fx, fy, x - fx, fh))
+                if x + w < fx + fw:
+                    split.append((x + w, fy, fx + fw - x - w, fh))
+                if y > fy:
+                    split.append((fx, fy, fw, y - fy))
+                if y + h < fy + fh:
+                    split.append((fx, y + h, fw, fy + fh - y - h))
+
+            # drop the new free rectangles that are inside another one.
+            # The untouched ones were already maximal, so they can't be inside a new one
+            split.sort(key=lambda rect: rect[2] * rect[3], reverse=True)
+            free = untouched
+            for rect in split:
+                rx, ry, rw, rh = rect
+                if not any(rx >= fx and ry >= fy and rx + rw <= fx + fw and ry + rh <= fy + fh for fx, fy, fw, fh in free):
+                    free.append(rect)
+        return positions
+
+
+def benchmark(size_files: List[str] = ()) -> None:
+    # Compares the old BinPacker and the MaxRectsPacker on atlas area, power of two area and runtime.
+    # Run this file directly to use the built in material sets, or pass json files that each hold a list of [width, height] sizes
+    import json
+    import random
+    import time
+
+    gaps = 16
+    body = [(2048, 2048), (2048, 2048), (1024, 1024), (1024, 1024), (512, 512), (512, 512), (256, 256), (64, 64), (64, 64)]
+    hair = [(2048, 2048), (1024, 1024), (1024, 1024), (1024, 512), (512, 512), (512, 512)]
+    outfit = [(2048, 2048), (1024, 1024), (1024, 1024), (1024, 1024), (1024, 512), (512, 512), (512, 512), (512, 256), (256, 256), (256, 256), (64, 64)]
+    randomizer = random.Random(4)
+    accessories = [(randomizer.choice([64, 128, 256, 512, 1024]), randomizer.choice([64, 128, 256, 512, 1024])) for _ in range(120)]
+    material_sets = {
+        'body': body,
+        'body + hair': body + hair,
+        'full outfit': body + hair + outfit,
+        'accessorized': body + hair + outfit + accessories,
+        'accessories x3': accessories * 3,
+    }
+    for size_file in size_files:
+        with open(size_file) as file:
+            material_sets[size_file] = [tuple(size) for size in json.load(file)]
+
+    def power_of_two(size: Tuple[int, int]) -> Tuple[int, int]:
+        return tuple(1 << int(x - 1).bit_length() for x in size)
+
+    def run(packer_class, sizes: List[Tuple[int, int]]) -> Tuple[int, int, float]:
+        images = {index: {'gfx': {'size': (w + gaps, h + gaps)}} for index, (w, h) in enumerate(sorted(sizes, key=lambda size: (max(size), size[0] * size[1], size[0]), reverse=True))}
+        start = time.perf_counter()
+        packer_class(images).fit()
+        elapsed = time.perf_counter() - start
+        atlas = (max(img['gfx']['fit']['x'] + img['gfx']['size'][0] for img in images.values()),
+                 max(img['gfx']['fit']['y'] + img['gfx']['size'][1] for img in images.values()))
+        return atlas[0] * atlas[1], power_of_two(atlas)[0] * power_of_two(atlas)[1], elapsed
+
+    print('{:<16} {:>6} {:>14} {:>14} {:>10} {:>14} {:>14} {:>10}'.format('set', 'images', 'BinPacker', 'PO2', 'seconds', 'MaxRects', 'PO2', 'seconds'))
+    for name, sizes in material_sets.items():
+        used = sum((w + gaps) * (h + gaps) for w, h in sizes)
+        old = run(BinPacker, sizes)
+        new = run(lambda images: MaxRectsPacker(images, power_of_two), sizes)
+        print('{:<16} {:>6} {:>8} {:>4.0%} {:>8} {:>4.0%} {:>10.4f} {:>8} {:>4.0%} {:>8} {:>4.0%} {:>10.4f}'.format(
+            name[:16], len(sizes),
+            old[0], used / old[0], old[1], used / old[1], old[2],
+            new[0], used / new[0], new[1], used / new[1], new[2]))
+
+
+if __name__ == '__main__':
+    import sys
+    benchmark(sys.argv[1:])
@@ -5,7 +5,7 @@ from typing import Tuple
 from typing import Union
 
 import bpy
-from mathutils import Vector
+import numpy as np
 
 from . import globs
 
@@ -20,7 +20,7 @@ Scene = bpy.types.ViewLayer if globs.is_blender_2_80_or_newer else bpy.types.Sce
 SMCObDataItem = Dict[bpy.types.Material, int]
 SMCObData = Dict[str, SMCObDataItem]
 
-MatsUV = Dict[str, DefaultDict[bpy.types.Material, List[Vector]]]
+MatsUV = Dict[str, DefaultDict[bpy.types.Material, np.ndarray]]
 
 StructureItem = Dict[str, Union[List, Dict[str, Union[Dict[str, int], Tuple, bpy.types.PackedFile, None]]]]
 Structure = Dict[bpy.types.Material, StructureItem]
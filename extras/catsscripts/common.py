@@ -38,10 +38,11 @@ from html.parser import HTMLParser
 from html.entities import name2codepoint
 
 from . import common as Common
+from ...common import WeightMatrix
 #from . import supporter as Supporter
 #from . import decimation as Decimation
 #from . import translate as Translate
-#from . import armature_bones as Bones
+from . import armature_bones as Bones
 #from . import settings as Settings
 #from .register import register_wrap
 #from .translations import t
@@ -1380,25 +1381,16 @@ def isEmptyGroup(group_name):
 
 
 def removeEmptyGroups(obj, thres=0):
-    z = []
-    for v in obj.data.vertices:
-        for g in v.groups:
-            if g.weight > thres:
-                if g not in z:
-                    z.append(obj.vertex_groups[g.group])
-    for r in obj.vertex_groups:
-        if r not in z:
-            obj.vertex_groups.remove(r)
+    used = WeightMatrix(obj).used_groups(thres)
+    for name, is_used in used.items():
+        if not is_used:
+            obj.vertex_groups.remove(obj.vertex_groups[name])
 
 
 def removeZeroVerts(obj, thres=0):
-    for v in obj.data.vertices:
-        z = []
-        for g in v.groups:
-            if not g.weight > thres:
-                z.append(g)
-        for r in z:
-            obj.vertex_groups[g.group].remove([v.index])
+    vertices, groups = WeightMatrix(obj).zero_weight_entries(thres)
+    for group_index in np.unique(groups):
+        obj.vertex_groups[int(group_index)].remove(vertices[groups == group_index].tolist())
 
 
 def delete_hierarchy(parent):
@@ -1454,45 +1446,52 @@ def delete_zero_weight(armature_name=None, ignore=''):
         armature_name = bpy.context.scene.armature
 
     armature = get_armature(armature_name=armature_name)
-    switch('EDIT')
 
-    bone_names_to_work_on = set([bone.name for bone in armature.data.edit_bones])
-
-    bone_name_to_edit_bone = dict()
-    for edit_bone in armature.data.edit_bones:
-        bone_name_to_edit_bone[edit_bone.name] = edit_bone
-
-    vertex_group_names_used = set()
-    vertex_group_name_to_objects_having_same_named_vertex_group = dict()
-    for objects in get_meshes_objects(armature_name=armature_name):
-        vertex_group_id_to_vertex_group_name = dict()
-        for vertex_group in objects.vertex_groups:
-            vertex_group_id_to_vertex_group_name[vertex_group.index] = vertex_group.name
-            if vertex_group.name not in vertex_group_name_to_objects_having_same_named_vertex_group:
-                vertex_group_name_to_objects_having_same_named_vertex_group[vertex_group.name] = set()
-            vertex_group_name_to_objects_having_same_named_vertex_group[vertex_group.name].add(objects)
-        for vertex in objects.data.vertices:
-            for group in vertex.groups:
-                if group.weight > 0:
-                    vertex_group_names_used.add(vertex_group_id_to_vertex_group_name.get(group.group))
-
-    not_used_bone_names = bone_names_to_work_on - vertex_group_names_used
-
-    count = 0
-    for bone_name in not_used_bone_names:
-        if not bpy.context.scene.keep_end_bones or not is_end_bone(bone_name, armature_name):
-            if bone_name not in Bones.dont_delete_these_bones and 'Root_' not in bone_name and bone_name != ignore:
-                armature.data.edit_bones.remove(bone_name_to_edit_bone[bone_name])  # delete bone
-                count += 1
-                if bone_name in vertex_group_name_to_objects_having_same_named_vertex_group:
-                    for objects in vertex_group_name_to_objects_having_same_named_vertex_group[bone_name]:  # delete vertex groups
-                        vertex_group = objects.vertex_groups.get(bone_name)
-                        if vertex_group is not None:
-                            objects.vertex_groups.remove(vertex_group)
+    def can_remove_bone(bone_name):
+        if getattr(bpy.context.scene, 'keep_end_bones', False) and is_end_bone(bone_name, armature_name):
+            return False
+        return bone_name not in Bones.dont_delete_these_bones and 'Root_' not in bone_name and bone_name != ignore
 
+    count, _ = delete_zero_weight_batch(armature, get_meshes_objects(armature_name=armature_name), can_remove_bone=can_remove_bone)
     return count
 
 
+def delete_zero_weight_batch(armature, meshes, remove_bones=True, can_remove_bone=None):
+    # Finds the used vertex groups of every mesh with one WeightMatrix per mesh,
+    # then removes the bones no mesh uses and their vertex groups in one go.
+    # Only vertex groups named after a removed bone are deleted, or after any unused bone if remove_bones is False,
+    # so helper groups for masks and modifiers are kept.
+    # can_remove_bone is an optional filter on bone names. Returns (removed bones, removed vertex groups)
+    used_names = set()
+    empty_groups = []
+    for mesh in meshes:
+        used = WeightMatrix(mesh).used_groups()
+        used_names.update(name for name, is_used in used.items() if is_used)
+        empty_groups.append((mesh, [name for name, is_used in used.items() if not is_used]))
+
+    if remove_bones:
+        set_active(armature)
+        switch('EDIT')
+        bone_names = [edit_bone.name for edit_bone in armature.data.edit_bones]
+    else:
+        bone_names = [bone.name for bone in armature.data.bones]
+    unused_bones = [name for name in bone_names if name not in used_names and (can_remove_bone is None or can_remove_bone(name))]
+
+    removed_bones = 0
+    if remove_bones:
+        for name in unused_bones:
+            armature.data.edit_bones.remove(armature.data.edit_bones[name])
+            removed_bones += 1
+
+    unused_bones = set(unused_bones)
+    removed_groups = 0
+    for mesh, names in empty_groups:
+        for name in [name for name in names if name in unused_bones]:
+            mesh.vertex_groups.remove(mesh.vertex_groups[name])
+            removed_groups += 1
+    return removed_bones, removed_groups
+
+
 def remove_unused_objects():
     default_scene_objects = []
     for obj in get_objects():
@@ -1647,26 +1646,27 @@ def remove_doubles(mesh, threshold, save_shapes=True):
     pre_tris = len(mesh.data.polygons)
 
     set_active(mesh)
-    switch('EDIT')
-    bpy.ops.mesh.select_mode(type="VERT")
-    bpy.ops.mesh.select_all(action='DESELECT')
+    switch('OBJECT')
 
+    # Vertices moved by any shape key are left alone, so build that mask with one read per key block
+    protected = np.zeros(len(mesh.data.vertices), dtype=bool)
     if save_shapes and has_shapekeys(mesh):
-        switch('OBJECT')
+        key_coords = {}
         for kb in mesh.data.shape_keys.key_blocks:
-            i = 0
-            for v0, v1 in zip(kb.relative_key.data, kb.data):
-                if v0.co != v1.co:
-                    mesh.data.vertices[i].select = True
-                i += 1
-        switch('EDIT')
-        bpy.ops.mesh.select_all(action='INVERT')
-    else:
-        bpy.ops.mesh.select_all(action='SELECT')
+            coords = np.empty(len(kb.data) * 3, dtype=np.float32)
+            kb.data.foreach_get('co', coords)
+            key_coords[kb.name] = coords.reshape(-1, 3)
+        for kb in mesh.data.shape_keys.key_blocks:
+            protected |= (key_coords[kb.name] != key_coords[kb.relative_key.name]).any(axis=1)
 
-    bpy.ops.mesh.remove_doubles(threshold=threshold)
-    bpy.ops.mesh.select_all(action='DESELECT')
-    switch('OBJECT')
+    bm = bmesh.new()
+    bm.from_mesh(mesh.data)
+    bm.verts.ensure_lookup_table()
+    weldable = [bm.verts[i] for i in np.flatnonzero(~protected).tolist()]
+    bmesh.ops.remove_doubles(bm, verts=weldable, dist=threshold)
+    bm.to_mesh(mesh.data)
+    bm.free()
+    mesh.data.update()
 
     return pre_tris - len(mesh.data.polygons)
 
@@ -1728,6 +1728,69 @@ def mix_weights(mesh, vg_from, vg_to, mix_strength=1.0, mix_mode='ADD', delete_o
     mesh.active_shape_key_index = 0  # This line fixes a visual bug in 2.90 which causes random weights to be stuck after being merged
 
 
+def merge_weights_bulk(mesh, parenting_list):
+    # Gives the same result as calling mix_weights(mesh, bone, parent) for every bone in parenting_list in order,
+    # but the weights are read once and written back with vertex_groups[...].add instead of applying a modifier per bone.
+    # Merges run in order on weight arrays, so chained merges (a -> b, then b -> c) clamp exactly like the modifier does
+    weight_matrix = WeightMatrix(mesh)
+    vertex_count = len(mesh.data.vertices)
+    existing = set(weight_matrix.group_names)
+    removed = set()
+    columns = {}
+    changed = {}
+
+    def column(name):
+        if name not in columns:
+            weights = np.zeros(vertex_count, dtype=np.float32)
+            members = np.zeros(vertex_count, dtype=bool)
+            index = weight_matrix.group_index.get(name)
+            if index is not None and name not in removed:
+                entries = weight_matrix.groups == index
+                weights[weight_matrix.vertices[entries]] = weight_matrix.weights[entries]
+                members[weight_matrix.vertices[entries]] = True
+            columns[name] = (weights, members)
+        return columns[name]
+
+    merged = []
+    for bone, parent in parenting_list.items():
+        if bone not in existing or bone == parent:
+            continue
+        existing.add(parent)
+        parent_weights, parent_members = column(parent)
+        bone_weights, bone_members = column(bone)
+        # VERTEX_WEIGHT_MIX with mix_mode ADD and mix_set B: every vertex in the bone group gets clamp(parent + bone) and joins the parent group
+        parent_weights[bone_members] = np.clip(parent_weights[bone_members] + bone_weights[bone_members], 0, 1)
+        parent_members |= bone_members
+        changed[parent] = changed.get(parent, np.zeros(vertex_count, dtype=bool)) | bone_members
+        # the bone group is deleted, so anything merged into the same name later starts from an empty group
+        existing.discard(bone)
+        removed.add(bone)
+        del columns[bone]
+        changed.pop(bone, None)
+        merged.append(bone)
+
+    for parent, changed_vertices in changed.items():
+        group = mesh.vertex_groups.get(parent) or mesh.vertex_groups.new(name=parent)
+        if parent in removed:
+            # the name was merged away and then reused as a parent, so the old weights have to go
+            group.remove(list(range(vertex_count)))
+        weights = columns[parent][0]
+        indexes = np.flatnonzero(changed_vertices)
+        # add() takes one weight per call, so write every distinct weight at once
+        unique_weights, inverse = np.unique(weights[indexes], return_inverse=True)
+        order = np.argsort(inverse, kind='stable')
+        splits = np.cumsum(np.bincount(inverse, minlength=len(unique_weights)))[:-1]
+        for weight, vertex_indexes in zip(unique_weights.tolist(), np.split(indexes[order], splits)):
+            group.add(vertex_indexes.tolist(), weight, 'REPLACE')
+
+    for bone in merged:
+        group = mesh.vertex_groups.get(bone)
+        if group is not None and bone not in existing:
+            mesh.vertex_groups.remove(group)
+    mesh.active_shape_key_index = 0
+    return len(merged)
+
+
 def get_user_preferences():
     return bpy.context.user_preferences if hasattr(bpy.context, 'user_preferences') else bpy.context.preferences
 
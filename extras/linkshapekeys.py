@@ -13,6 +13,7 @@ from .. import common as c
 def link_keys(shapekey_holder_object, objects_to_link):
 
     shapekey_list_string = str(shapekey_holder_object.data.shape_keys.key_blocks.keys()).lower()
+    driver_builder = c.DriverBuilder('linked shapekey drivers')
     for obj in objects_to_link:
         bpy.ops.object.select_all(action = 'DESELECT')
         bpy.context.view_layer.objects.active = obj
@@ -21,30 +22,13 @@ def link_keys(shapekey_holder_object, objects_to_link):
         for key in obj.data.shape_keys.key_blocks:
             if key.name.lower() in shapekey_list_string:
                 if not key.name == obj.data.shape_keys.key_blocks[0]:
-                    skey_driver = key.driver_add('value')
-                    skey_driver.driver.type = 'AVERAGE'
-                    #skey_driver.driver.show_debug_info = True
-                    if skey_driver.driver.variables:
-                        for v in skey_driver.driver.variables:
-                            skey_driver.driver.variables.remove(v)
-                    newVar = skey_driver.driver.variables.new()
-                    newVar.name = "value"
-                    newVar.type = 'SINGLE_PROP'
-                    newVar.targets[0].id_type = 'KEY'
-                    newVar.targets[0].id = shapekey_holder_object.data.shape_keys
-                    newVar.targets[0].data_path = 'key_blocks["' + key.name+ '"].value' 
-                    skey_driver = key.driver_add('mute')
-                    skey_driver.driver.type = 'AVERAGE'
-                    #skey_driver.driver.show_debug_info = True
-                    if skey_driver.driver.variables:
-                        for v in skey_driver.driver.variables:
-                            skey_driver.driver.variables.remove(v)
-                    newVar = skey_driver.driver.variables.new()
-                    newVar.name = "hide"
-                    newVar.type = 'SINGLE_PROP'
-                    newVar.targets[0].id_type = 'KEY'
-                    newVar.targets[0].id = shapekey_holder_object.data.shape_keys
-                    newVar.targets[0].data_path = 'key_blocks["' + key.name+ '"].mute'
+                    for property, variable_name in [('value', 'value'), ('mute', 'hide')]:
+                        driver_builder.add(key, property, None, 'AVERAGE', None, [{'name': variable_name, 'type': 'SINGLE_PROP', 'targets': [{
+                            'id_type': 'KEY',
+                            'id': shapekey_holder_object.data.shape_keys,
+                            'data_path': 'key_blocks["' + key.name + '"].' + property,
+                            }]}])
+    driver_builder.build()
 
 
 class link_shapekeys(bpy.types.Operator):
@@ -528,8 +528,7 @@ def duplicateShapeKey(objectName, shapeKeyName, shapeKeyCopyName):
 
 def isVertexGroupEmpty(vertexGroupName, objectName):
     object = bpy.data.objects[objectName]
-    vertexGroup = object.vertex_groups[vertexGroupName]
-    return not any(vertexGroup.index in [g.group for g in v.groups] for v in object.data.vertices)
+    return not c.get_weight_matrix(object).has_members(vertexGroupName)
                 
 class Extremities:
     vertices = None
@@ -554,18 +553,14 @@ def returnHigher(value1, value2):
 def findVertexGroupExtremities(vertexGroupName, objectName):
     extremities = Extremities()
     object = bpy.data.objects[objectName]
-    coordinates = [(object.matrix_world @ v.co) for v in object.data.vertices]
-    vertexGroupIndex = object.vertex_groups[vertexGroupName].index
-    vertices = [ v for v in object.data.vertices if vertexGroupIndex in [ vg.group for vg in v.groups ] ]
-    extremities.vertices = vertices
-    extremities.coordinates = coordinates
-    for vertex in vertices:
-        extremities.minX = returnLower(extremities.minX, coordinates[vertex.index][0])
-        extremities.minY = returnLower(extremities.minY, coordinates[vertex.index][1])
-        extremities.minZ = returnLower(extremities.minZ, coordinates[vertex.index][2])
-        extremities.maxX = returnHigher(extremities.maxX, coordinates[vertex.index][0])
-        extremities.maxY = returnHigher(extremities.maxY, coordinates[vertex.index][1])
-        extremities.maxZ = returnHigher(extremities.maxZ, coordinates[vertex.index][2])
+    weightMatrix = c.get_weight_matrix(object)
+    coordinates = weightMatrix.get_coordinates()
+    members = weightMatrix.group_vertices(vertexGroupName)
+    extremities.vertices = [object.data.vertices[index] for index in members.tolist()]
+    extremities.coordinates = coordinates.tolist()
+    if len(members):
+        extremities.minX, extremities.minY, extremities.minZ = coordinates[members].min(axis = 0).tolist()
+        extremities.maxX, extremities.maxY, extremities.maxZ = coordinates[members].max(axis = 0).tolist()
     return extremities
 
 copyTransformsConstraintBaseName = "Copy Transforms"
@@ -782,36 +777,46 @@ class DriverVariable(NamedTuple):
     targetTransformType: str
     targetRotationMode: str
     
+#drivers added while a batch is open are created together by finishDriverBatch()
+pendingDriverBuilder = None
+
+def startDriverBatch():
+    global pendingDriverBuilder
+    pendingDriverBuilder = c.DriverBuilder('rigify drivers')
+
+def finishDriverBatch():
+    global pendingDriverBuilder
+    driverBuilder = pendingDriverBuilder
+    pendingDriverBuilder = None
+    if driverBuilder:
+        return driverBuilder.build()
+
 def addDriver(object, objectProperty, objectPropertyCoordinateIndex, driverType, driverVariables, driverExpression):
-    if objectPropertyCoordinateIndex:
-        driver = object.driver_add(objectProperty, objectPropertyCoordinateIndex)
-    else:
-        driver = object.driver_add(objectProperty)
-    driver.driver.type = driverType
+    variables = []
     for driverVariable in driverVariables:
-        variable = driver.driver.variables.new()
-        variable.name = driverVariable.name
-        variable.type = driverVariable.type
-        variable.targets[0].id = driverVariable.targetObject1
+        targets = [{}, {}]
+        targets[0]['id'] = driverVariable.targetObject1
         if driverVariable.targetCustomPropertyDataPath:
-            variable.targets[0].data_path = driverVariable.targetCustomPropertyDataPath
+            targets[0]['data_path'] = driverVariable.targetCustomPropertyDataPath
         if driverVariable.targetBone1:
-            variable.targets[0].bone_target = driverVariable.targetBone1
+            targets[0]['bone_target'] = driverVariable.targetBone1
         if driverVariable.targetTransformSpace1:
-            variable.targets[0].transform_space = driverVariable.targetTransformSpace1
+            targets[0]['transform_space'] = driverVariable.targetTransformSpace1
         if driverVariable.targetTransformType:
-            variable.targets[0].transform_type = driverVariable.targetTransformType
+            targets[0]['transform_type'] = driverVariable.targetTransformType
         if driverVariable.targetRotationMode:
-            variable.targets[0].rotation_mode = driverVariable.targetRotationMode
+            targets[0]['rotation_mode'] = driverVariable.targetRotationMode
         if driverVariable.targetObject2:
-            variable.targets[1].id = driverVariable.targetObject2
+            targets[1]['id'] = driverVariable.targetObject2
         if driverVariable.targetBone2:
-            variable.targets[1].bone_target = driverVariable.targetBone2
-        if driverVariable.targetTransformSpace2   :
-            variable.targets[1].transform_space = driverVariable.targetTransformSpace2
-        if driverExpression:         
-            driver.driver.expression = driverExpression
-    return driver
+            targets[1]['bone_target'] = driverVariable.targetBone2
+        if driverVariable.targetTransformSpace2:
+            targets[1]['transform_space'] = driverVariable.targetTransformSpace2
+        variables.append({'name': driverVariable.name, 'type': driverVariable.type, 'targets': targets})
+    driverBuilder = pendingDriverBuilder or c.DriverBuilder('rigify drivers')
+    driverBuilder.add(object, objectProperty, objectPropertyCoordinateIndex if objectPropertyCoordinateIndex else None, driverType, driverExpression if driverVariables else None, variables)
+    if not pendingDriverBuilder:
+        return driverBuilder.build()[0]
 
 def removeAllConstraints(rig, boneName):
         boneToMute = rig.pose.bones[boneName]
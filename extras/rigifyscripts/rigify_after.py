@@ -149,6 +149,8 @@ def main():
     headTweakLimitRotationConstraint = koikatsuCommons.addLimitRotationConstraint(generatedRig, koikatsuCommons.headTweakBoneName, None, 'LOCAL', koikatsuCommons.limitRotationConstraintBaseName + koikatsuCommons.headConstraintSuffix, 
     True, math.radians(-180), math.radians(180), True, math.radians(-180), math.radians(180), True, math.radians(-180), math.radians(180))
     
+    #the new drivers are created after the loop so the driver list isn't changed while it is read
+    koikatsuCommons.startDriverBatch()
     for driver in generatedRig.animation_data.drivers:
         if driver.data_path.startswith("pose.bones"):
             driverOwnerName = driver.data_path.split('"')[1]
@@ -162,6 +164,7 @@ def main():
 																																																				  
                     koikatsuCommons.addDriver(headTweakLimitRotationConstraint, driverProperty, None, driver.driver.type, [newVariable], 
                     driver.driver.expression)
+    koikatsuCommons.finishDriverBatch()
         
     for bone in generatedRig.pose.bones:
         for constraint in bone.constraints:
@@ -8,7 +8,7 @@ This file performs the following operations
 .   Invokes the other import operations based on what options were chosen on the panel
 '''
 
-import bpy, os, datetime
+import bpy, os
 
 from ..interface.dictionary_en import t
 from .. import common as c
@@ -22,6 +22,7 @@ class kkbp_import(bpy.types.Operator):
     filepath : bpy.props.StringProperty(maxlen=1024, default='', options={'HIDDEN'})
     filter_glob : bpy.props.StringProperty(default='*.pmx', options={'HIDDEN'})
     
+    @c.profile('import', 'operator')
     def execute(self, context):
         #do this thing because cats does it
         if hasattr(bpy.context.scene, 'layers'):
@@ -108,7 +109,7 @@ class kkbp_import(bpy.types.Operator):
             function()
         c.toggle_console()
         bpy.context.scene.kkbp.plugin_state = 'imported'
-        c.kklog('KKBP import finished in {} minutes'.format(round(((datetime.datetime.now().minute * 60 + datetime.datetime.now().second + datetime.datetime.now().microsecond / 1e6) - bpy.context.scene.kkbp.total_timer) / 60, 2)))
+        c.kklog('KKBP import finished in {} minutes'.format(round(c.get_total_time() / 60, 2)))
         return {'FINISHED'}
         
     def invoke(self, context, event):
@@ -116,6 +117,7 @@ class kkbp_import(bpy.types.Operator):
         return {'RUNNING_MODAL'}
 
     def import_pmx_models(self):
+        c.initialize_timer()
         c.kklog('Importing pmx files with mmdtools...')
         
         for subdir, dirs, files in os.walk(c.get_import_path()):
@@ -159,5 +161,4 @@ class kkbp_import(bpy.types.Operator):
                     bpy.data.texts.remove(bpy.data.texts['Model_e'])
         #rename the collection to the character name
         bpy.data.collections['Collection'].name = c.get_name()
-        c.initialize_timer()
         c.print_timer('Import PMX')
@@ -41,28 +41,220 @@
 # Survey code was taken from MediaMoots here https://github.com/FlailingFog/KK-Blender-Shader-Pack/issues/29
 # Majority of the joint driver corrections were taken from a blend file by johnbbob_la_petite on the koikatsu discord
 
-import bpy, math
+import bpy, math, time
 from .. import common as c
 from mathutils import Vector
 
+class BoneLayerPlan:
+    '''Collects bone collection assignments so they can all be applied in one pass.
+    On Blender 4.x assigning a bone to a collection needs object mode, so applying each bone one at a time means switching modes for every bone'''
+    def __init__(self):
+        #{bone name: (layer or collection name, hidden)}. A later assignment for the same bone replaces the earlier one
+        self.assignments = {}
+
+    def assign(self, bone_name: str, show_layer, hidden = False):
+        self.assignments[bone_name] = (show_layer, hidden)
+
+    def apply(self, armature: bpy.types.Object):
+        '''Assigns every planned bone to its layer / collection, then clears the plan'''
+        if not self.assignments:
+            return
+        if bpy.app.version[0] == 3:
+            for bone_name, (show_layer, hidden) in self.assignments.items():
+                bone = armature.data.bones.get(bone_name)
+                if bone:
+                    bone.layers = (
+                        True, False, False, False, False, False, False, False,
+                        False, False, False, False, False, False, False, False, 
+                        False, False, False, False, False, False, False, False, 
+                        False, False, False, False, False, False, False, False
+                    )
+                    #have to show the bone on both layer 1 and chosen layer before setting it to just chosen layer
+                    bone.layers[show_layer] = True
+                    bone.layers[0] = False
+                    bone.hide = hidden
+        else:
+            original_mode = bpy.context.object.mode
+            bpy.ops.object.mode_set(mode = 'OBJECT')
+            bones = armature.data.bones
+            collections = armature.data.collections
+            planned = [(bones.get(bone_name), str(show_layer), hidden) for bone_name, (show_layer, hidden) in self.assignments.items()]
+            planned = [assignment for assignment in planned if assignment[0]]
+            #create the needed collections once, in the order they were planned so the collection list is the same every run
+            for collection_name in dict.fromkeys(collection_name for bone, collection_name, hidden in planned):
+                if not collections.get(collection_name):
+                    collections.new(collection_name)
+            for bone, collection_name, hidden in planned:
+                bone.collections.clear()
+                collections[collection_name].assign(bone)
+                bone.hide = hidden
+            bpy.ops.object.mode_set(mode = original_mode)
+        self.assignments.clear()
+
+class ArmatureRecipe:
+    '''A list of bone edits (roll, head / tail, parent, connect, rename, scale) grouped into named steps.
+    Every step is applied in a single edit mode session, with the bones looked up through a name -> EditBone index that is built once.
+    Edits are only evaluated when the recipe is applied, so an edit can read positions set by an earlier step'''
+    def __init__(self, steps: list = None):
+        #[(step name, [(operation, bone name, arguments, optional)])]
+        self.steps = steps or []
+        #only filled while the recipe is being applied
+        self.index = None
+        self.missing = set()
+
+    def step(self, step_name: str):
+        '''Starts a new step. Every edit added after this is timed as part of that step'''
+        self.steps.append((step_name, []))
+
+    def add(self, operation: str, bone_name: str, *arguments, optional = False):
+        '''Adds an edit to the current step. Optional edits are silently skipped if the bone doesn't exist'''
+        if not self.steps:
+            self.step('unnamed')
+        self.steps[-1][1].append((operation, bone_name, arguments, optional))
+
+    def roll(self, bone_name: str, roll: float, optional = False):
+        self.add('roll', bone_name, roll, optional = optional)
+
+    def parent(self, bone_name: str, parent_name: str):
+        '''Set parent_name to None to unparent the bone'''
+        self.add('parent', bone_name, parent_name)
+
+    def connect(self, bone_name: str, use_connect = True):
+        self.add('connect', bone_name, use_connect)
+
+    def rename(self, bone_name: str, new_name: str):
+        self.add('rename', bone_name, new_name)
+
+    def scale(self, bone_name: str, factor: float):
+        '''Scales the length of an upright bone along the z axis. Set bone_name to None to scale every bone'''
+        self.add('scale', bone_name, factor)
+
+    def set_tail(self, bone_name: str, offset: Vector, detach = False):
+        '''Moves the tail to head + offset. Detach temporarily unparents the bone while it is moved'''
+        self.add('set_tail', bone_name, tuple(offset), detach)
+
+    def rotate_tail(self, bone_name: str, angle: float, detach = False):
+        '''Rotates the tail around the head on the XY plane'''
+        self.add('rotate_tail', bone_name, angle, detach)
+
+    def copy(self, bone_name: str, point: str, axes: str, source_name: str, source_point: str):
+        '''Copies the chosen axes ('x', 'yz', 'xyz'...) of the source bone's head or tail to this bone's head or tail'''
+        self.add('copy', bone_name, point, axes, source_name, source_point)
+
+    def offset(self, bone_name: str, point: str, offset: Vector):
+        '''Moves this bone's head or tail by offset'''
+        self.add('offset', bone_name, point, tuple(offset))
+
+    def apply(self, armature: bpy.types.Object):
+        '''Applies every step in one edit mode session and logs how long each step took'''
+        c.switch(armature, 'edit')
+        self.index = {bone.name: bone for bone in armature.data.edit_bones}
+        self.missing = set()
+        #compile each operation to its function once, so nothing is looked up by name while the steps run
+        compiled = [(step_name, [(getattr(self, '_' + operation), bone_name, arguments, optional) for operation, bone_name, arguments, optional in operations])
+                    for step_name, operations in self.steps]
+        timings = []
+        for step_name, operations in compiled:
+            start = time.perf_counter()
+            for function, bone_name, arguments, optional in operations:
+                if bone_name is None:
+                    for bone in list(self.index.values()):
+                        function(bone, *arguments)
+                elif self.index.get(bone_name):
+                    function(self.index[bone_name], *arguments)
+                elif not optional:
+                    self.missing.add(bone_name)
+            timings.append((step_name, time.perf_counter() - start, len(operations)))
+        if self.missing:
+            c.kklog('Armature recipe skipped edits for missing bones: {}'.format(sorted(self.missing)), type = 'warn')
+        c.kklog('Armature recipe timings (edit mode):')
+        for step_name, seconds, count in timings:
+            c.kklog('    {:<36} {:>4} edits {:>8.4f} seconds'.format(step_name, count, seconds))
+        c.kklog('    {:<36} {:>4} edits {:>8.4f} seconds'.format('total', sum(t[2] for t in timings), sum(t[1] for t in timings)))
+        self.index = None
+
+    def _get(self, bone_name: str) -> bpy.types.EditBone:
+        bone = self.index.get(bone_name)
+        if not bone:
+            self.missing.add(bone_name)
+        return bone
+
+    def _roll(self, bone: bpy.types.EditBone, roll: float):
+        bone.roll = roll
+
+    def _parent(self, bone: bpy.types.EditBone, parent_name: str):
+        if not parent_name:
+            bone.parent = None
+        elif self._get(parent_name):
+            bone.parent = self.index[parent_name]
+
+    def _connect(self, bone: bpy.types.EditBone, use_connect: bool):
+        bone.use_connect = use_connect
+
+    def _rename(self, bone: bpy.types.EditBone, new_name: str):
+        del self.index[bone.name]
+        bone.name = new_name
+        self.index[bone.name] = bone
+
+    def _scale(self, bone: bpy.types.EditBone, factor: float):
+        bone.tail.z = bone.head.z + (bone.tail.z - bone.head.z) * factor
+
+    def _set_tail(self, bone: bpy.types.EditBone, offset: tuple, detach: bool):
+        parent = bone.parent
+        if detach:
+            bone.parent = None
+        bone.tail = bone.head + Vector(offset)
+        if detach:
+            bone.parent = parent
+
+    def _rotate_tail(self, bone: bpy.types.EditBone, angle: float, detach: bool):
+        parent = bone.parent
+        if detach:
+            bone.parent = None
+        sin = math.sin(angle)
+        cos = math.cos(angle)
+        # translate point to origin, rotate it, then translate it back
+        x = bone.tail.x - bone.head.x
+        y = bone.tail.y - bone.head.y
+        bone.tail.x = x * cos - y * sin + bone.head.x
+        bone.tail.y = x * sin + y * cos + bone.head.y
+        if detach:
+            bone.parent = parent
+
+    def _copy(self, bone: bpy.types.EditBone, point: str, axes: str, source_name: str, source_point: str):
+        source = self._get(source_name)
+        if source:
+            source_vector = getattr(source, source_point).copy()
+            target_vector = getattr(bone, point)
+            for axis in axes:
+                setattr(target_vector, axis, getattr(source_vector, axis))
+
+    def _offset(self, bone: bpy.types.EditBone, point: str, offset: tuple):
+        setattr(bone, point, getattr(bone, point) + Vector(offset))
+
 class modify_armature(bpy.types.Operator):
     bl_idname = "kkbp.modifyarmature"
     bl_label = bl_idname
     bl_description = bl_idname
     bl_options = {'REGISTER', 'UNDO'}
     
+    @c.profile('modify_armature', 'operator')
     def execute(self, context):
         try:
-            
+
             self.reparent_all_objects()
             self.remove_bone_locks_and_modifiers()
-            self.scale_armature_bones_down()
-            self.reparent_leg_and_body_bone()
             self.delete_non_height_bones()
 
-            self.modify_finger_bone_orientations()
-            self.set_bone_roll_data()
-            self.bend_bones_for_iks()
+            #the bone level edits are collected into one recipe and applied in a single edit mode session
+            recipe = ArmatureRecipe()
+            self.scale_armature_bones_down(recipe)
+            self.reparent_leg_and_body_bone(recipe)
+            self.modify_finger_bone_orientations(recipe)
+            self.set_bone_roll_data(recipe)
+            self.bend_bones_for_iks(recipe)
+            recipe.apply(c.get_armature())
+            c.print_timer('apply_armature_recipe')
 
             self.remove_empty_vertex_groups()
             self.reorganize_armature_layers()
@@ -151,12 +343,10 @@ class modify_armature(bpy.types.Operator):
             hb.parent = armature
         c.print_timer('reparent_all_objects')
     
-    def scale_armature_bones_down(self):
+    def scale_armature_bones_down(self, recipe: ArmatureRecipe):
         '''scale all bone sizes down by a factor of 12. (all armature bones must be sticking upwards)'''
-        c.switch(c.get_armature(), 'edit')
-        for bone in c.get_armature().data.edit_bones:
-            bone.tail.z = bone.head.z + (bone.tail.z - bone.head.z)/12
-        c.print_timer('scale_armature_bones_down')
+        recipe.step('scale_armature_bones_down')
+        recipe.scale(None, 1/12)
 
     def remove_bone_locks_and_modifiers(self):
         '''Removes mmd bone constraints and bone drivers, unlocks all bones'''
@@ -183,20 +373,20 @@ class modify_armature(bpy.types.Operator):
             bone.lock_location = [False, False, False]
         c.print_timer('remove_bone_locks_and_modifiers')
 
-    def reparent_leg_and_body_bone(self):
+    def reparent_leg_and_body_bone(self, recipe: ArmatureRecipe):
         '''Reparent the leg bone to match the koikatsu armature. Unparent the body_bone bone to match koikatsu armature'''
+        recipe.step('reparent_leg_and_body_bone')
         if bpy.context.scene.kkbp.armature_dropdown != 'D':
-            armature = c.get_armature()
             #reparent foot to leg03
-            armature.data.edit_bones['cf_j_foot_R'].parent = armature.data.edit_bones['cf_j_leg03_R']
-            armature.data.edit_bones['cf_j_foot_L'].parent = armature.data.edit_bones['cf_j_leg03_L']
+            recipe.parent('cf_j_foot_R', 'cf_j_leg03_R')
+            recipe.parent('cf_j_foot_L', 'cf_j_leg03_L')
             #unparent body bone to match KK
-            armature.data.edit_bones['p_cf_body_bone'].parent = None
-        c.print_timer('reparent_leg_and_body_bone')
+            recipe.parent('p_cf_body_bone', None)
 
     def delete_non_height_bones(self):
         '''delete bones not under the cf_n_height bone. Deletes bones not under the BodyTop bone if PMX armature was selected'''
         armature = c.get_armature()
+        c.switch(armature, 'edit')
         def select_children(parent):
             try:
                 parent.select = True
@@ -220,54 +410,15 @@ class modify_armature(bpy.types.Operator):
         bpy.ops.armature.delete()
         c.print_timer('delete_non_height_bones')
 
-    def modify_finger_bone_orientations(self):
+    def modify_finger_bone_orientations(self, recipe: ArmatureRecipe):
         '''Reorient the finger bones to match the in game koikatsu armature'''
-        armature = c.get_armature()
-        c.switch(armature, 'edit')
-        height_adjust = Vector((0,0,0.1))
-        
+        recipe.step('modify_finger_bone_orientations')
         #all finger bones need to be rotated a specific direction
-        def rotate_thumb(bone):
-            bpy.ops.armature.select_all(action='DESELECT')
-            armature.data.edit_bones[bone].select = True
-            armature.data.edit_bones[bone].select_head = True
-            armature.data.edit_bones[bone].select_tail = True
-            parent = armature.data.edit_bones[bone].parent
-            armature.data.edit_bones[bone].parent = None
-
-            #right thumbs face towards hand center
-            #left thumbs face away from hand center
-            angle = -math.pi/2
-            s = math.sin(angle)
-            c = math.cos(angle)
-
-            # translate point to origin:
-            armature.data.edit_bones[bone].tail.x -= armature.data.edit_bones[bone].head.x
-            armature.data.edit_bones[bone].tail.y -= armature.data.edit_bones[bone].head.y
-
-            # rotate point around origin
-            xnew = armature.data.edit_bones[bone].tail.x * c - armature.data.edit_bones[bone].tail.y * s
-            ynew = armature.data.edit_bones[bone].tail.x * s + armature.data.edit_bones[bone].tail.y * c
-
-            # translate point back to original position:
-            armature.data.edit_bones[bone].tail.x = xnew + armature.data.edit_bones[bone].head.x
-            armature.data.edit_bones[bone].tail.y = ynew + armature.data.edit_bones[bone].head.y
-            armature.data.edit_bones[bone].roll = 0
-            armature.data.edit_bones[bone].parent = parent
-            
-        rotate_thumb('cf_j_thumb03_L')
-        rotate_thumb('cf_j_thumb02_L')
-        rotate_thumb('cf_j_thumb01_L')
-        rotate_thumb('cf_j_thumb03_R')
-        rotate_thumb('cf_j_thumb02_R')
-        rotate_thumb('cf_j_thumb01_R')
-        
-        height_adjust = Vector((0,0,0.05))
-        def flip_finger(bone):
-            parent = armature.data.edit_bones[bone].parent
-            armature.data.edit_bones[bone].parent = None
-            armature.data.edit_bones[bone].tail = armature.data.edit_bones[bone].head - height_adjust
-            armature.data.edit_bones[bone].parent = parent
+        #right thumbs face towards hand center
+        #left thumbs face away from hand center
+        for bone in ['cf_j_thumb03_L', 'cf_j_thumb02_L', 'cf_j_thumb01_L', 'cf_j_thumb03_R', 'cf_j_thumb02_R', 'cf_j_thumb01_R']:
+            recipe.rotate_tail(bone, -math.pi/2, detach = True)
+            recipe.roll(bone, 0)
         
         finger_list = (
         'cf_j_index03_R', 'cf_j_index02_R', 'cf_j_index01_R',
@@ -275,16 +426,8 @@ class modify_armature(bpy.types.Operator):
         'cf_j_ring03_R', 'cf_j_ring02_R', 'cf_j_ring01_R',
         'cf_j_little03_R', 'cf_j_little02_R', 'cf_j_little01_R'
         )
-        
         for finger in finger_list:
-            flip_finger(finger)
-        
-            height_adjust = Vector((0,0,0.05))
-        def resize_finger(bone):
-            parent = armature.data.edit_bones[bone].parent
-            armature.data.edit_bones[bone].parent = None
-            armature.data.edit_bones[bone].tail = armature.data.edit_bones[bone].head + height_adjust
-            armature.data.edit_bones[bone].parent = parent
+            recipe.set_tail(finger, Vector((0,0,-0.05)), detach = True)
         
         finger_list = (
         'cf_j_index03_L', 'cf_j_index02_L', 'cf_j_index01_L',
@@ -292,15 +435,10 @@ class modify_armature(bpy.types.Operator):
         'cf_j_ring03_L', 'cf_j_ring02_L', 'cf_j_ring01_L',
         'cf_j_little03_L', 'cf_j_little02_L', 'cf_j_little01_L'
         )
-        
         for finger in finger_list:
-            resize_finger(finger)
+            recipe.set_tail(finger, Vector((0,0,0.05)), detach = True)
         
         #reset the orientation of certain bones
-        height_adjust = Vector((0,0,0.1))
-        def reorient(bone):
-            armature.data.edit_bones[bone].tail = armature.data.edit_bones[bone].head + height_adjust
-
         reorient_list = [
             'cf_j_thigh00_R', 'cf_j_thigh00_L',
             'cf_j_leg01_R', 'cf_j_leg01_L',
@@ -308,12 +446,10 @@ class modify_armature(bpy.types.Operator):
             'cf_j_foot_R', 'cf_j_foot_L',
             'cf_d_arm01_R', 'cf_d_arm01_L',
             'cf_d_shoulder02_R', 'cf_d_shoulder02_L',]
-
         for bone in reorient_list:
-            reorient(bone)
-        c.print_timer('modify_finger_bone_orientations')
+            recipe.set_tail(bone, Vector((0,0,0.1)))
 
-    def set_bone_roll_data(self):
+    def set_bone_roll_data(self, recipe: ArmatureRecipe):
         '''Use roll data from a reference armature dump to set the roll for each bone'''
         reroll_data = {
         'BodyTop':0.0,
@@ -644,43 +780,37 @@ class modify_armature(bpy.types.Operator):
         'cf_s_waist01':0.0,
         }
         
-        armature = c.get_armature()
-        c.switch(armature, 'edit')
+        recipe.step('set_bone_roll_data')
         for bone in reroll_data:
-            if armature.data.edit_bones.get(bone):
-                armature.data.edit_bones[bone].roll = reroll_data[bone]
-        c.print_timer('set_bone_roll_data')
+            recipe.roll(bone, reroll_data[bone], optional = True)
 
-    def bend_bones_for_iks(self):
+    def bend_bones_for_iks(self, recipe: ArmatureRecipe):
         '''slightly modify the armature to support IKs'''
         if not bpy.context.scene.kkbp.armature_dropdown in ['A', 'B']:
             return
         
-        armature = c.get_armature()
-        c.switch(armature, 'edit')
-        armature.data.edit_bones['cf_n_height'].parent = None
-        armature.data.edit_bones['cf_j_root'].parent = armature.data.edit_bones['cf_pv_root']
-        armature.data.edit_bones['p_cf_body_bone'].parent = armature.data.edit_bones['cf_pv_root']
+        recipe.step('bend_bones_for_iks')
+        recipe.parent('cf_n_height', None)
+        recipe.parent('cf_j_root', 'cf_pv_root')
+        recipe.parent('p_cf_body_bone', 'cf_pv_root')
         #relocate the tail of some bones to make IKs easier
         def relocate_tail(bone1, bone2, direction):
             if direction == 'leg':
-                armature.data.edit_bones[bone1].tail.z = armature.data.edit_bones[bone2].head.z
-                armature.data.edit_bones[bone1].roll = 0
+                recipe.copy(bone1, 'tail', 'z', bone2, 'head')
+                recipe.roll(bone1, 0)
                 #move the bone forward a bit or the ik bones might not bend correctly
-                armature.data.edit_bones[bone1].head.y += -0.01
+                recipe.offset(bone1, 'head', Vector((0, -0.01, 0)))
             elif direction == 'arm':
-                armature.data.edit_bones[bone1].tail.x = armature.data.edit_bones[bone2].head.x
-                armature.data.edit_bones[bone1].tail.z = armature.data.edit_bones[bone2].head.z
-                armature.data.edit_bones[bone1].roll = -math.pi/2
+                recipe.copy(bone1, 'tail', 'xz', bone2, 'head')
+                recipe.roll(bone1, -math.pi/2)
             elif direction == 'hand':
-                armature.data.edit_bones[bone1].tail = armature.data.edit_bones[bone2].tail
+                recipe.copy(bone1, 'tail', 'xyz', bone2, 'tail')
                 #make hand bone shorter so you can easily click the hand and the pv bone
-                armature.data.edit_bones[bone1].tail.z += .01 
-                armature.data.edit_bones[bone1].head = armature.data.edit_bones[bone2].head
+                recipe.offset(bone1, 'tail', Vector((0, 0, .01)))
+                recipe.copy(bone1, 'head', 'xyz', bone2, 'head')
             else:
-                armature.data.edit_bones[bone1].tail.y = armature.data.edit_bones[bone2].head.y
-                armature.data.edit_bones[bone1].tail.z = armature.data.edit_bones[bone2].head.z
-                armature.data.edit_bones[bone1].roll = 0
+                recipe.copy(bone1, 'tail', 'yz', bone2, 'head')
+                recipe.roll(bone1, 0)
         relocate_tail('cf_j_leg01_R', 'cf_j_foot_R', 'leg')
         relocate_tail('cf_j_leg01_L', 'cf_j_foot_L', 'leg')
         relocate_tail('cf_j_forearm01_R', 'cf_j_hand_R', 'arm')
@@ -689,7 +819,6 @@ class modify_armature(bpy.types.Operator):
         relocate_tail('cf_pv_hand_L', 'cf_j_hand_L', 'hand')
         relocate_tail('cf_j_foot_R', 'cf_j_toes_R', 'foot')
         relocate_tail('cf_j_foot_L', 'cf_j_toes_L', 'foot')
-        c.print_timer('bend_bones_for_iks')
 
     def remove_empty_vertex_groups(self):
         '''check body for groups with no vertexes. Delete if the group is not a bone on the armature'''
@@ -717,54 +846,57 @@ class modify_armature(bpy.types.Operator):
         mouth_list  = self.get_bone_list('mouth_list')
         skirt_list  = self.get_bone_list('skirt_list')
         tongue_list = self.get_bone_list('tongue_list')
+        layer_plan = BoneLayerPlan()
 
         #throw all bones to armature layer 11
         for bone in bpy.data.armatures[0].bones:
-            self.set_armature_layer(bone.name, show_layer = 10)
+            layer_plan.assign(bone.name, show_layer = 10)
         #reshow cf_hit_ bones on layer 12
         for bone in [bones for bones in bpy.data.armatures[0].bones if 'cf_hit_' in bones.name]:
-            self.set_armature_layer(bone.name, show_layer = 11)
+            layer_plan.assign(bone.name, show_layer = 11)
         #reshow k_f_ bones on layer 13
         for bone in [bones for bones in bpy.data.armatures[0].bones if 'k_f_' in bones.name]:
-            self.set_armature_layer(bone.name, show_layer = 12)
+            layer_plan.assign(bone.name, show_layer = 12)
         #reshow core bones on layer 1
         for bone in core_list:
-            self.set_armature_layer(bone, show_layer = 0)
+            layer_plan.assign(bone, show_layer = 0)
         #reshow non_ik bones on layer 2
         for bone in non_ik:
-            self.set_armature_layer(bone, show_layer = 1)
+            layer_plan.assign(bone, show_layer = 1)
         #Put the charamaker bones on layer 3
         for bone in [bones for bones in bpy.data.armatures[0].bones if 'cf_s_' in bones.name]:
-            self.set_armature_layer(bone.name, show_layer = 2)
+            layer_plan.assign(bone.name, show_layer = 2)
         #Put the deform bones on layer 4
         for bone in [bones for bones in bpy.data.armatures[0].bones if 'cf_d_' in bones.name]:
-            self.set_armature_layer(bone.name, show_layer = 3)
+            layer_plan.assign(bone.name, show_layer = 3)
         try:
             #Put the better penetration bones on layer 5
             for bone in bp_list:
-                self.set_armature_layer(bone, show_layer = 4)
                 #rename the bones so you can mirror them over the x axis in pose mode
                 if 'Vagina_L_' in bone or 'Vagina_R_' in bone:
                     bpy.data.armatures[0].bones[bone].name = 'Vagina' + bone[8:] + '_' + bone[7]
+                    bone = 'Vagina' + bone[8:] + '_' + bone[7]
+                layer_plan.assign(bone, show_layer = 4)
             #Put the toe bones on layer 5
             for bone in toe_list:
-                self.set_armature_layer(bone, show_layer = 4)
+                layer_plan.assign(bone, show_layer = 4)
         except:
             #this armature isn't a BP armature
             pass
         #Put the upper eye bones on layer 17
         for bone in eye_list:
-            self.set_armature_layer(bone, show_layer = 16)
+            layer_plan.assign(bone, show_layer = 16)
         #Put the lower mouth bones on layer 18
         for bone in mouth_list:
-            self.set_armature_layer(bone, show_layer = 17)
+            layer_plan.assign(bone, show_layer = 17)
         #Put the tongue rig bones on layer 19
         for bone in tongue_list:
-            self.set_armature_layer(bone, show_layer = 18)
+            layer_plan.assign(bone, show_layer = 18)
         #Put the skirt bones on layer 9
         for bone in skirt_list:
-            self.set_armature_layer(bone, show_layer = 8)
+            layer_plan.assign(bone, show_layer = 8)
         #put accessory bones on layer 10 during reshow_accessory_bones() later on        
+        layer_plan.apply(armature)
         #Make all bone layers visible for now
         all_layers = [
         True, True, True, True, True, False, False, False, #body
@@ -825,8 +957,10 @@ class modify_armature(bpy.types.Operator):
                         except:
                             bone['id'] = [outfit_or_hair['id']]
         #move accessory bones to armature layer 10
+        layer_plan = BoneLayerPlan()
         for bone in [bone for bone in armature.data.bones if bone.get('id')]:
-            self.set_armature_layer(bone.name, show_layer = 9)
+            layer_plan.assign(bone.name, show_layer = 9)
+        layer_plan.apply(armature)
         c.print_timer('move_accessory_bones_to_layer10')
 
     def rename_mmd_bones(self):
@@ -1105,6 +1239,8 @@ class modify_armature(bpy.types.Operator):
         '''give the leg a foot IK, the foot a heel controller, and the arm a hand IK'''
         if not bpy.context.scene.kkbp.armature_dropdown in ['A','B']:
             return
+        #bone layer changes are collected here and applied once all the IK bones exist
+        layer_plan = BoneLayerPlan()
         
         def legIK(legbone, IKtarget, IKpole, IKpoleangle, footIK, kneebone, toebone, footbone):
             bone = c.get_armature().pose.bones[legbone]
@@ -1270,14 +1406,10 @@ class modify_armature(bpy.types.Operator):
                 bpy.ops.pose.bone_layers(layers=layer2)
                 c.get_armature().data.bones[footIK].select = True
             else:
-                c.get_armature().data.bones['FootPin.' + footbone[-1]].collections.clear()
-                self.set_armature_layer('FootPin.' + footbone[-1], 2)
-                c.get_armature().data.bones['ToePin.' + footbone[-1]].collections.clear()
-                self.set_armature_layer('ToePin.' + footbone[-1], 2)
-                c.get_armature().data.bones[toebone].collections.clear()
-                self.set_armature_layer(toebone, 2)
-                c.get_armature().data.bones[footIK].collections.clear()
-                self.set_armature_layer(footIK, 2)
+                layer_plan.assign('FootPin.' + footbone[-1], 2)
+                layer_plan.assign('ToePin.' + footbone[-1], 2)
+                layer_plan.assign(toebone, 2)
+                layer_plan.assign(footIK, 2)
         
         heelController('cf_j_foot_L', 'cf_pv_foot_L', 'cf_j_toes_L')
         bpy.ops.wm.redraw_timer(type='DRAW_WIN_SWAP', iterations=1)
@@ -1335,15 +1467,14 @@ class modify_armature(bpy.types.Operator):
 
         #move newly created bones to correct armature layers
         bpy.ops.wm.redraw_timer(type='DRAW_WIN_SWAP', iterations=1)
-        self.set_armature_layer('MasterFootIK.L', 0)
-        self.set_armature_layer('MasterFootIK.R', 0)
-        bpy.ops.wm.redraw_timer(type='DRAW_WIN_SWAP', iterations=1)
-        self.set_armature_layer('HeelIK.L', 0)
-        self.set_armature_layer('HeelIK.R', 0)
-        bpy.ops.wm.redraw_timer(type='DRAW_WIN_SWAP', iterations=1)
-        self.set_armature_layer('ToeRotator.L', 0)
-        self.set_armature_layer('ToeRotator.R', 0)
-        self.set_armature_layer('cf_d_bust00', 0)
+        layer_plan.assign('MasterFootIK.L', 0)
+        layer_plan.assign('MasterFootIK.R', 0)
+        layer_plan.assign('HeelIK.L', 0)
+        layer_plan.assign('HeelIK.R', 0)
+        layer_plan.assign('ToeRotator.L', 0)
+        layer_plan.assign('ToeRotator.R', 0)
+        layer_plan.assign('cf_d_bust00', 0)
+        layer_plan.apply(c.get_armature())
         bpy.ops.wm.redraw_timer(type='DRAW_WIN_SWAP', iterations=1)
         c.get_armature().data.bones['cf_pv_root_upper'].hide = True
         bpy.ops.wm.redraw_timer(type='DRAW_WIN_SWAP', iterations=1)
@@ -1355,34 +1486,111 @@ class modify_armature(bpy.types.Operator):
             return
         armature = c.get_armature()
         c.switch(armature, 'pose')
-        #generic function to set a copy rotation modifier
+        joint_corrections = self.get_joint_corrections()
+        for copy_rotation in joint_corrections['copy_rotation']:
+            self.set_copy_rotation(armature, *copy_rotation)
+        driver_builder = c.DriverBuilder('joint correction drivers')
+        for driver in joint_corrections['drivers']:
+            self.set_joint_driver(armature, driver_builder, *driver)
+        driver_builder.build()
+        c.print_timer('create_joint_drivers')
+
+    @staticmethod
+    def set_copy_rotation(armature, bone, bonetarget, influence, axis = 'all', mix = 'replace', space = 'LOCAL'):
+        '''generic function to set a copy rotation modifier'''
+        constraint = armature.pose.bones[bone].constraints.new("COPY_ROTATION")
+        constraint.target = armature
+        constraint.subtarget = bonetarget
+        constraint.influence = influence
+        constraint.target_space = space
+        constraint.owner_space = space
+
+        if axis == 'X':
+            constraint.use_y = False
+            constraint.use_z = False
+        
+        elif axis == 'Y':
+            constraint.use_x = False
+            constraint.use_z = False
+        
+        elif axis == 'antiX':
+            constraint.use_y = False
+            constraint.use_z = False
+            constraint.invert_x = True
+        
+        elif axis == 'Z':
+            constraint.use_x = False
+            constraint.use_y = False
+
+        if mix == 'add':
+            constraint.mix_mode = 'ADD'
+
+    @staticmethod
+    def set_joint_driver(armature, driver_builder, bone, drivertype, drivertypeselect, drivertarget, drivertt, drivermult, expresstype = 'move'):
+        '''generic function for queueing a driver on the driver builder'''
+
+        #drivertype is the kind of driver you want to be applied to the bone and can be location/rotation
+        #drivertypeselect is the component of the bone you want the driver to be applied to
+        # for location it's (0 is x component, y is 1, z is 2)
+        # for rotation it's (0 is w, 1 is x, etc)
+        # for scale it's (0 is x, 1 is y, 2 is z)
+        #the driver variable targets the transforms of the target bone. this can be rotation or location
+        #the transform space can be world space too
+        variable = {'name': 'var', 'type': 'TRANSFORMS', 'targets': [{
+            'id': armature,
+            'bone_target': armature.pose.bones[drivertarget].name,
+            'transform_type': drivertt,
+            'transform_space': 'LOCAL_SPACE',
+            'rotation_mode': 'QUATERNION' if expresstype in ['scale', 'quat'] else 'AUTO',
+            }]}
+        var = variable['name']
+
+        #use the distance to the target bone's parent to make results consistent for different sized bones
+        targetbonelength = str(round((armature.pose.bones[drivertarget].head - armature.pose.bones[drivertarget].parent.head).length,3))
+        
+        #driver expression is the rotation value of the target bone multiplied by a percentage of the driver target bone's length
+        expression = None
+        if expresstype in ['move', 'quat']:
+            expression = var + '*' + targetbonelength + '*' + drivermult 
+        
+        #move but only during positive rotations
+        elif expresstype == 'movePos':
+            expression = var + '*' + targetbonelength + '*' + drivermult + ' if ' + var + ' > 0 else 0'
+        
+        #move but only during negative rotations
+        elif expresstype == 'moveNeg':
+            expression = var + '*' + targetbonelength + '*' + drivermult + ' if ' + var + ' < 0 else 0'
+        
+        #move but the ABS value
+        elif expresstype == 'moveABS':    
+            expression = 'abs(' + var + '*' + targetbonelength + '*' + drivermult +')'
+
+        #move but the negative ABS value
+        elif expresstype == 'moveABSNeg':
+            expression = '-abs(' + var + '*' + targetbonelength + '*' + drivermult +')'
+        
+        #move but exponentially
+        elif expresstype == 'moveexp':
+            expression = var + '*' + var + '*' + targetbonelength + '*' + drivermult
+        
+        elif expresstype == 'scale':
+            expression = '1 + ' + var + '*' + targetbonelength + '*' + drivermult
+        
+        elif expresstype == 'rotation':
+            expression = var + '*' + targetbonelength + '*' + drivermult
+
+        driver_builder.add(armature.pose.bones[bone], drivertype, drivertypeselect, 'SCRIPTED', expression, [variable])
+
+    @staticmethod
+    def get_joint_corrections() -> dict[str, list]:
+        '''Returns the arguments of every copy rotation constraint and driver used for the joint corrections.
+        The bone lengths are read when the drivers are created'''
+        joint_corrections = {'copy_rotation': [], 'drivers': []}
         def set_copy(bone, bonetarget, influence, axis = 'all', mix = 'replace', space = 'LOCAL'):
-            constraint = armature.pose.bones[bone].constraints.new("COPY_ROTATION")
-            constraint.target = armature
-            constraint.subtarget = bonetarget
-            constraint.influence = influence
-            constraint.target_space = space
-            constraint.owner_space = space
-
-            if axis == 'X':
-                constraint.use_y = False
-                constraint.use_z = False
-            
-            elif axis == 'Y':
-                constraint.use_x = False
-                constraint.use_z = False
-            
-            elif axis == 'antiX':
-                constraint.use_y = False
-                constraint.use_z = False
-                constraint.invert_x = True
-            
-            elif axis == 'Z':
-                constraint.use_x = False
-                constraint.use_y = False
+            joint_corrections['copy_rotation'].append([bone, bonetarget, influence, axis, mix, space])
 
-            if mix == 'add':
-                constraint.mix_mode = 'ADD'
+        def setDriver (bone, drivertype, drivertypeselect, drivertarget, drivertt, drivermult, expresstype = 'move'):
+            joint_corrections['drivers'].append([bone, drivertype, drivertypeselect, drivertarget, drivertt, drivermult, expresstype])
 
         #setup most of the drivers with this
         set_copy('cf_d_shoulder02_L', 'cf_j_arm00_L', 0.5)
@@ -1423,67 +1631,6 @@ class modify_armature(bpy.types.Operator):
         set_copy('cf_s_leg_L', 'cf_j_thigh00_L', .9, axis = 'Z', mix = 'add')
         set_copy('cf_s_leg_R', 'cf_j_thigh00_R', .9, axis = 'Z', mix = 'add')
 
-        #generic function for creating a driver
-        def setDriver (bone, drivertype, drivertypeselect, drivertarget, drivertt, drivermult, expresstype = 'move'):
-
-            #add driver to first component
-            #drivertype is the kind of driver you want to be applied to the bone and can be location/rotation
-            #drivertypeselect is the component of the bone you want the driver to be applied to
-            # for location it's (0 is x component, y is 1, z is 2)
-            # for rotation it's (0 is w, 1 is x, etc)
-            # for scale it's (0 is x, 1 is y, 2 is z)
-            driver = armature.pose.bones[bone].driver_add(drivertype, drivertypeselect)
-
-            #add driver variable
-            vari = driver.driver.variables.new()
-            vari.name = 'var'
-            vari.type = 'TRANSFORMS'
-
-            #set the target and subtarget
-            target = vari.targets[0]
-            target.id = armature
-            target.bone_target = armature.pose.bones[drivertarget].name
-
-            #set the transforms for the target. this can be rotation or location 
-            target.transform_type = drivertt
-
-            #set the transform space. can be world space too
-            target.transform_space = 'LOCAL_SPACE'
-            target.rotation_mode = 'QUATERNION' if expresstype in ['scale', 'quat'] else 'AUTO'
-
-            #use the distance to the target bone's parent to make results consistent for different sized bones
-            targetbonelength = str(round((armature.pose.bones[drivertarget].head - armature.pose.bones[drivertarget].parent.head).length,3))
-            
-            #driver expression is the rotation value of the target bone multiplied by a percentage of the driver target bone's length
-            if expresstype in ['move', 'quat']:
-                driver.driver.expression = vari.name + '*' + targetbonelength + '*' + drivermult 
-            
-            #move but only during positive rotations
-            elif expresstype == 'movePos':
-                driver.driver.expression = vari.name + '*' + targetbonelength + '*' + drivermult + ' if ' + vari.name + ' > 0 else 0'
-            
-            #move but only during negative rotations
-            elif expresstype == 'moveNeg':
-                driver.driver.expression = vari.name + '*' + targetbonelength + '*' + drivermult + ' if ' + vari.name + ' < 0 else 0'
-            
-            #move but the ABS value
-            elif expresstype == 'moveABS':    
-                driver.driver.expression = 'abs(' + vari.name + '*' + targetbonelength + '*' + drivermult +')'
-
-            #move but the negative ABS value
-            elif expresstype == 'moveABSNeg':
-                driver.driver.expression = '-abs(' + vari.name + '*' + targetbonelength + '*' + drivermult +')'
-            
-            #move but exponentially
-            elif expresstype == 'moveexp':
-                driver.driver.expression = vari.name + '*' + vari.name + '*' + targetbonelength + '*' + drivermult
-            
-            elif expresstype == 'scale':
-                driver.driver.expression = '1 + ' + vari.name + '*' + targetbonelength + '*' + drivermult
-            
-            elif expresstype == 'rotation':
-                driver.driver.expression = vari.name + '*' + targetbonelength + '*' + drivermult
-
         #Set the remaining joint correction drivers
         #set knee joint corrections. These go in toward the body and down toward the foot at an exponential rate
         setDriver('cf_s_kneeB_R', 'location', 1, 'cf_j_leg01_R', 'ROT_X',  '-0.2', expresstype = 'moveexp')
@@ -1555,6 +1702,7 @@ class modify_armature(bpy.types.Operator):
 
         #waist correction slightly moves out to chest when lower waist rotates
         setDriver('cf_s_waist02', 'location', 2, 'cf_j_waist02', 'ROT_X',  '0.2', expresstype='moveABS')
+        return joint_corrections
 
     def categorize_bones(self):
         '''Add some bones to bone groups to give them colors'''
@@ -1586,15 +1734,17 @@ class modify_armature(bpy.types.Operator):
                 bpy.ops.pose.group_assign(type=group_index+1)
                 group.color_set = 'THEME09'
             else:
+                layer_plan = BoneLayerPlan()
                 group_name = 'IK controllers'
                 for bone in ['cf_pv_hand_L', 'cf_pv_hand_R', 'MasterFootIK.L', 'MasterFootIK.R']:
-                    self.set_armature_layer(bone, group_name)
+                    layer_plan.assign(bone, group_name)
                     armature.data.bones[bone].color.palette = 'THEME01'
                 
                 group_name = 'IK poles'
                 for bone in ['cf_pv_elbo_R', 'cf_pv_elbo_L', 'cf_pv_knee_R', 'cf_pv_knee_L']:
-                    self.set_armature_layer(bone, group_name)
+                    layer_plan.assign(bone, group_name)
                     armature.data.bones[bone].color.palette = 'THEME09'
+                layer_plan.apply(armature)
 
     def rename_bones_for_clarity(self):
         '''rename core bones for easier identification. Also allows Unity to automatically detect each bone in a humanoid armature'''
@@ -1830,67 +1980,20 @@ class modify_armature(bpy.types.Operator):
     def survey(obj):
         '''Function to check for empty vertex groups of an object
         returns a dictionary in the form {vertex_group1: maxweight1, vertex_group2: maxweight2, etc}'''
-        maxWeight = {}
-        #prefill vertex group list with zeroes
-        for i in obj.vertex_groups:
-            maxWeight[i.name] = 0
-        #preserve the indexes
-        keylist = list(maxWeight)
-        #then fill in the real value using the indexes
-        for v in obj.data.vertices:
-            for g in v.groups:
-                gn = g.group
-                w = obj.vertex_groups[g.group].weight(v.index)
-                if (maxWeight.get(keylist[gn]) is None or w>maxWeight[keylist[gn]]):
-                    maxWeight[keylist[gn]] = w
-        return maxWeight
+        weight_matrix = c.WeightMatrix(obj)
+        max_weights = weight_matrix.max_weights()
+        return {name: float(max_weights[index]) for index, name in enumerate(weight_matrix.group_names)}
 
     @staticmethod
     def survey_vertexes(obj):
-        has_vertexes = {}
-        for i in obj.vertex_groups:
-            has_vertexes[i.name] = False
-        #preserve the indexes
-        keylist = list(has_vertexes)
-        #then fill in the real value using the indexes
-        for v in obj.data.vertices:
-            for g in v.groups:
-                gn = g.group
-                w = obj.vertex_groups[g.group].weight(v.index)
-                if (has_vertexes.get(keylist[gn]) is None or w>has_vertexes[keylist[gn]]):
-                    has_vertexes[keylist[gn]] = True
-        return has_vertexes
+        '''returns a dictionary in the form {vertex_group1: True, vertex_group2: False, etc} where True means the group has a weight above 0'''
+        return c.WeightMatrix(obj).used_groups()
 
     def set_armature_layer(self, bone_name, show_layer, hidden = False):
-        '''Assigns a bone to a bone collection.'''
-        armature = c.get_armature()
-        bone = armature.data.bones.get(bone_name)
-        if bone:
-            if bpy.app.version[0] == 3:
-                if armature.data.bones.get(bone_name):
-                    armature.data.bones[bone_name].layers = (
-                        True, False, False, False, False, False, False, False,
-                        False, False, False, False, False, False, False, False, 
-                        False, False, False, False, False, False, False, False, 
-                        False, False, False, False, False, False, False, False
-                    )
-                    #have to show the bone on both layer 1 and chosen layer before setting it to just chosen layer
-                    armature.data.bones[bone_name].layers[show_layer] = True 
-                    armature.data.bones[bone_name].layers[0] = False
-                    armature.data.bones[bone_name].hide = hidden
-            else:
-                original_mode = bpy.context.object.mode
-                bpy.ops.object.mode_set(mode = 'OBJECT')
-                show_layer = str(show_layer)
-                bone.collections.clear()
-                if armature.data.bones.get(bone_name):
-                    if armature.data.collections.get(show_layer):
-                        armature.data.collections[show_layer].assign(armature.data.bones.get(bone_name))
-                    else:
-                        armature.data.collections.new(show_layer)
-                        armature.data.collections[show_layer].assign(armature.data.bones.get(bone_name))
-                    armature.data.bones[bone_name].hide = hidden
-                bpy.ops.object.mode_set(mode = original_mode)
+        '''Assigns a bone to a bone collection. Use a BoneLayerPlan instead when moving more than a few bones'''
+        layer_plan = BoneLayerPlan()
+        layer_plan.assign(bone_name, show_layer, hidden)
+        layer_plan.apply(c.get_armature())
 
     @staticmethod
     def get_bone_list(kind):
@@ -30,6 +30,7 @@ class modify_material(bpy.types.Operator):
     bl_description = bl_idname
     bl_options = {'REGISTER', 'UNDO'}
     
+    @c.profile('modify_material', 'operator')
     def execute(self, context):
         try:
 
@@ -672,27 +673,17 @@ class modify_material(bpy.types.Operator):
                 'Cartoony Crying' 
             ]
             
+            #both drivers of every gag material read the same gag key variables
+            gag_variables = [{'name': key.replace(' ',''), 'type': 'SINGLE_PROP', 'targets': [{
+                'id_type': 'KEY',
+                'id': body.data.shape_keys,
+                'data_path': 'key_blocks["' + key + '"].value',
+                }]} for key in gag_keys]
+            driver_builder = c.DriverBuilder('gag eye material drivers')
             def create_driver(material, expression1, expression2):
-                skey_driver = bpy.data.materials[material].node_tree.nodes['Parser'].inputs[0].driver_add('default_value')
-                skey_driver.driver.type = 'SCRIPTED'
-                for key in gag_keys:
-                    newVar = skey_driver.driver.variables.new()
-                    newVar.name = key.replace(' ','')
-                    newVar.type = 'SINGLE_PROP'
-                    newVar.targets[0].id_type = 'KEY'
-                    newVar.targets[0].id = body.data.shape_keys
-                    newVar.targets[0].data_path = 'key_blocks["' + key + '"].value' 
-                skey_driver.driver.expression = expression1
-                skey_driver = bpy.data.materials[material].node_tree.nodes['hider'].inputs[0].driver_add('default_value')
-                skey_driver.driver.type = 'SCRIPTED'
-                for key in gag_keys:
-                    newVar = skey_driver.driver.variables.new()
-                    newVar.name = key.replace(' ','')
-                    newVar.type = 'SINGLE_PROP'
-                    newVar.targets[0].id_type = 'KEY'
-                    newVar.targets[0].id = body.data.shape_keys
-                    newVar.targets[0].data_path = 'key_blocks["' + key + '"].value'
-                skey_driver.driver.expression = expression2
+                nodes = bpy.data.materials[material].node_tree.nodes
+                driver_builder.add(nodes['Parser'].inputs[0], 'default_value', None, 'SCRIPTED', expression1, gag_variables)
+                driver_builder.add(nodes['hider'].inputs[0], 'default_value', None, 'SCRIPTED', expression2, gag_variables)
 
             create_driver (
                 'KK Gag00 ' + c.get_name(), 
@@ -711,6 +702,7 @@ class modify_material(bpy.types.Operator):
                 '0 if CartoonyCrying else 1 if CartoonyWink else 2', 
                 'CartoonyCrying or CartoonyWink or FieryEyes'
                 )
+            driver_builder.build()
         c.print_timer('setup_gag_eye_material_drivers')
 
     def add_outlines_to_body(self):
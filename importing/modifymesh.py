@@ -11,15 +11,122 @@ This file performs the following operations
 ·	Combines shapekeys based on face part prefix and emotion suffix
 ·	Creates tear shapekeys
 ·	Creates gag eye shapekeys and drivers for shapekeys
+·	Removes KK shapekeys that don't move any vertices
 
-.   Removes doubles on body object to prevent seams (if selected)
+.   Welds the body seams without changing the weights (if selected)
 
 ·	Mark certain body materials as freestyle faces for freestyle exclusion
 '''
 
-import bpy
+import bpy, bmesh, hashlib
+import numpy as np
+from mathutils import kdtree
 from .. import common as c
 from ..extras.linkshapekeys import link_keys
+from ..interface.translator import compile_translation
+
+shapekey_translation_dict = {
+    #Prefixes
+    "eye_face.f00":         "Eyes",
+    "kuti_face.f00":        "Lips",
+    "eye_siroL.sL00":       "EyeWhitesL",
+    "eye_siroR.sR00":       "EyeWhitesR",
+    "eye_line_u.elu00":     "Eyelashes1",
+    "eye_line_l.ell00":     "Eyelashes2",
+    "eye_naM.naM00":        "EyelashesPos",
+    "eye_nose.nl00":        "NoseTop",
+    "kuti_nose.nl00":       "NoseBot",
+    "kuti_ha.ha00":         "Teeth",
+    "kuti_yaeba.y00":       "Fangs",
+    "kuti_sita.t00":        "Tongue",
+    "mayuge.mayu00":        "KK Eyebrows",
+    "eye_naL.naL00":        "Tear_big",
+    "eye_naM.naM00":        "Tear_med",
+    "eye_naS.naS00":        "Tear_small",
+
+    #Prefixes (Yelan headmod exception)
+    "namida_l":             "Tear_big",
+    "namida_m":             "Tear_med",
+    "namida_s":             "Tear_small",
+    'tang.':                'Tongue',
+
+    #Emotions (eyes and mouth)
+    "_def_":                "_default_",
+    "_egao_":               "_smile_",
+    "_bisyou_":             "_smile_sharp_",
+    "_uresi_ss_":           "_happy_slight_",
+    "_uresi_s_":            "_happy_moderate_",
+    "_uresi_":              "_happy_broad_",
+    "_doki_ss_":            "_doki_slight_",
+    "_doki_s_":             "_doki_moderate_",
+    "_ikari_":              "_angry_",
+    "_ikari02_":            "_angry_2_",
+    "_sinken_":             "_serious_",
+    "_sinken02_":           "_serious_1_",
+    "_sinken03_":           "_serious_2_",
+    "_keno_":               "_hate_",
+    "_sabisi_":             "_lonely_",
+    "_aseri_":              "_impatient_",
+    "_huan_":               "_displeased_",
+    "_human_":              "_displeased_",
+    "_akire_":              "_amazed_",
+    "_odoro_":              "_shocked_",
+    "_odoro_s_":            "_shocked_moderate_",
+    "_doya_":               "_smug_",
+    "_pero_":               "_lick_",
+    "_name_":               "_eating_",
+    "_tabe_":               "_eating_2_",
+    "_kuwae_":              "_hold_in_mouth_",
+    "_kisu_":               "_kiss_",
+    "_name02_":             "_tongue_out_",
+    "_mogu_":               "_chewing_",
+    "_niko_":               "_cartoon_mouth_",
+    "_san_":                "_triangle_",
+
+    #Emotions (Eyes)
+    "_winkl_":              "_wink_left_",
+    "_winkr_":              "_wink_right_",
+    "_setunai_":            "_distress_",
+    "_tere_":               "_shy_",
+    "_tmara_":              "_bored_",
+    "_tumara_":             "_bored_",
+    "_kurusi_":             "_pain_",
+    "_sian_":               "_thinking_",
+    "_kanasi_":             "_sad_",
+    "_naki_":               "_crying_",
+    "_rakutan_":            "_dejected_",
+    "_komaru_":             "_worried_",
+    "_gag":                 "_gageye",
+    "_gyul_":               "_squeeze_left_",
+    "_gyur_":               "_squeeze_right_",
+    "_gyu_":                "_squeeze_",
+    "_gyul02_":             "_squeeze_left_2_",
+    "_gyur02_":             "_squeeze_right_2_",
+    "_gyu02_":              "_squeeze_2_",
+
+    #Emotions (Eyebrows)
+    "_koma_":               "_worried_",
+    "_gimoL_":              "_doubt_left_",
+    "_gimoR_":              "_doubt_right_",
+    "_sianL_":              "_thinking_left_",
+    "_sianR_":              "_thinking_right_",
+    "_oko_":                "_angry_",
+    "_oko2L_":              "_angry_left_",
+    "_oko2R_":              "_angry_right_",
+
+    #Emotions extra
+    "_s_":                  "_small_",
+    "_l_":                  "_big_",
+
+    #Emotions Yelan headmod exception
+    'T_Default':            '_default_op',
+}
+
+#distance used to find the duplicate vertices on the body seams
+SEAM_THRESHOLD = 0.00001
+
+#compile the translation table once, so each shapekey name is translated in a single pass
+translate_shapekey_name = compile_translation(shapekey_translation_dict)
 
 class modify_mesh(bpy.types.Operator):
     bl_idname = "kkbp.modifymesh"
@@ -27,6 +134,7 @@ class modify_mesh(bpy.types.Operator):
     bl_description = bl_idname
     bl_options = {'REGISTER', 'UNDO'}
     
+    @c.profile('modify_mesh', 'operator')
     def execute(self, context):
         try:
             self.rename_uv_maps()
@@ -42,6 +150,7 @@ class modify_mesh(bpy.types.Operator):
             self.combine_shapekeys()
             self.create_tear_shapekeys()
             self.create_gag_eye_shapekeys()
+            self.prune_shapekeys(clamp_deltas = bpy.context.scene.kkbp.clamp_shapekeys)
 
             self.remove_body_seams()
             self.mark_body_freestyle_faces()
@@ -223,104 +332,8 @@ class modify_mesh(bpy.types.Operator):
         '''Renames the face shapekeys to english'''
         if not bpy.context.scene.kkbp.shapekeys_dropdown in ['A', 'B']:
             return
-        translation_dict = {
-            #Prefixes
-            "eye_face.f00":         "Eyes",
-            "kuti_face.f00":        "Lips",
-            "eye_siroL.sL00":       "EyeWhitesL",
-            "eye_siroR.sR00":       "EyeWhitesR",
-            "eye_line_u.elu00":     "Eyelashes1",
-            "eye_line_l.ell00":     "Eyelashes2",
-            "eye_naM.naM00":        "EyelashesPos",
-            "eye_nose.nl00":        "NoseTop",
-            "kuti_nose.nl00":       "NoseBot",
-            "kuti_ha.ha00":         "Teeth",
-            "kuti_yaeba.y00":       "Fangs",
-            "kuti_sita.t00":        "Tongue",
-            "mayuge.mayu00":        "KK Eyebrows",
-            "eye_naL.naL00":        "Tear_big",
-            "eye_naM.naM00":        "Tear_med",
-            "eye_naS.naS00":        "Tear_small",
-
-            #Prefixes (Yelan headmod exception)
-            "namida_l":             "Tear_big",
-            "namida_m":             "Tear_med",
-            "namida_s":             "Tear_small",
-            'tang.':                'Tongue',
-
-            #Emotions (eyes and mouth)
-            "_def_":                "_default_",
-            "_egao_":               "_smile_",
-            "_bisyou_":             "_smile_sharp_",
-            "_uresi_ss_":           "_happy_slight_",
-            "_uresi_s_":            "_happy_moderate_",
-            "_uresi_":              "_happy_broad_",
-            "_doki_ss_":            "_doki_slight_",
-            "_doki_s_":             "_doki_moderate_",
-            "_ikari_":              "_angry_",
-            "_ikari02_":            "_angry_2_",
-            "_sinken_":             "_serious_",
-            "_sinken02_":           "_serious_1_",
-            "_sinken03_":           "_serious_2_",
-            "_keno_":               "_hate_",
-            "_sabisi_":             "_lonely_",
-            "_aseri_":              "_impatient_",
-            "_huan_":               "_displeased_",
-            "_human_":              "_displeased_",
-            "_akire_":              "_amazed_",
-            "_odoro_":              "_shocked_",
-            "_odoro_s_":            "_shocked_moderate_",
-            "_doya_":               "_smug_",
-            "_pero_":               "_lick_",
-            "_name_":               "_eating_",
-            "_tabe_":               "_eating_2_",
-            "_kuwae_":              "_hold_in_mouth_",
-            "_kisu_":               "_kiss_",
-            "_name02_":             "_tongue_out_",
-            "_mogu_":               "_chewing_",
-            "_niko_":               "_cartoon_mouth_",
-            "_san_":                "_triangle_",
-
-            #Emotions (Eyes)
-            "_winkl_":              "_wink_left_",
-            "_winkr_":              "_wink_right_",
-            "_setunai_":            "_distress_",
-            "_tere_":               "_shy_",
-            "_tmara_":              "_bored_",
-            "_tumara_":             "_bored_",
-            "_kurusi_":             "_pain_",
-            "_sian_":               "_thinking_",
-            "_kanasi_":             "_sad_",
-            "_naki_":               "_crying_",
-            "_rakutan_":            "_dejected_",
-            "_komaru_":             "_worried_",
-            "_gag":                 "_gageye",
-            "_gyul_":               "_squeeze_left_",
-            "_gyur_":               "_squeeze_right_",
-            "_gyu_":                "_squeeze_",
-            "_gyul02_":             "_squeeze_left_2_",
-            "_gyur02_":             "_squeeze_right_2_",
-            "_gyu02_":              "_squeeze_2_",
-        
-        #Emotions (Eyebrows)
-            "_koma_":               "_worried_",
-            "_gimoL_":              "_doubt_left_",
-            "_gimoR_":              "_doubt_right_",
-            "_sianL_":              "_thinking_left_",
-            "_sianR_":              "_thinking_right_",
-            "_oko_":                "_angry_",
-            "_oko2L_":              "_angry_left_",
-            "_oko2R_":              "_angry_right_",
-        
-        #Emotions extra
-            "_s_":                  "_small_",
-            "_l_":                  "_big_",
-
-            #Emotions Yelan headmod exception
-            'T_Default':            '_default_op',
-        }
-
-        c.get_body().active_shape_key_index = 0
+        body = c.get_body()
+        body.active_shape_key_index = 0
         
         originalExists = False
         for shapekey in bpy.data.shape_keys:
@@ -333,18 +346,17 @@ class modify_mesh(bpy.types.Operator):
         #rename original shapekeys
         for shapekey in bpy.data.shape_keys:
             for keyblock in shapekey.key_blocks:
-                for key in translation_dict:
-                    if 'gageye' not in keyblock.name:
-                        keyblock.name = keyblock.name.replace(key, translation_dict[key])
+                if 'gageye' not in keyblock.name:
+                    keyblock.name = translate_shapekey_name(keyblock.name)
+
+        #delete the KK shapekeys if the original shapekeys still exist
+        if originalExists and body.data.shape_keys:
+            remove_list = [keyblock for keyblock in body.data.shape_keys.key_blocks if 'KK ' in keyblock.name and 'KK Eyebrows' not in keyblock.name]
+            for keyblock in remove_list:
                 try:
-                    #delete the KK shapekeys if the original shapekeys still exist
-                    if originalExists and 'KK ' in keyblock.name and 'KK Eyebrows' not in keyblock.name:
-                        c.get_body().active_shape_key_index = c.get_body().data.shape_keys.key_blocks.keys().index(keyblock.name)
-                        bpy.ops.object.shape_key_remove() #only way to do this is with ops?
+                    body.shape_key_remove(keyblock)
                 except:
-                    #or not
                     c.kklog("Couldn't delete shapekey: " + keyblock.name, 'error')
-                    pass
         c.print_timer('translate_shapekeys')
 
     def combine_shapekeys(self):
@@ -377,83 +389,112 @@ class modify_mesh(bpy.types.Operator):
                 return 'Mouth'
             return 'None'
 
-        #setup two arrays to keep track of the shapekeys that have been used
+        #read every shapekey once. The partial shapekeys are combined by summing their
+        #offsets from the relative key in numpy instead of setting each shapekey value and calling shape_key_add(from_mix)
+        body = c.get_body()
+        shapekey_block = body.data.shape_keys.key_blocks
+        vertex_count = len(body.data.vertices)
+        names = shapekey_block.keys()
+        coords = np.empty((len(names), vertex_count * 3), dtype=np.float32)
+        for index, keyblock in enumerate(shapekey_block):
+            keyblock.data.foreach_get('co', coords[index])
+        key_coords = list(coords)
+        relative_keys = [names.index(keyblock.relative_key.name) for keyblock in shapekey_block]
+        muted = [keyblock.mute for keyblock in shapekey_block]
+        categories = [whatCat(name) for name in names]
+
+        #group the shapekeys by emotion and category once so the emotion search is not repeated for every shapekey
+        emotion_index = {}
+        def index_shapekey(key_index):
+            for (emotion, cat), members in emotion_index.items():
+                if emotion in names[key_index] and cat == categories[key_index]:
+                    members.append(key_index)
+        def get_members(emotion, cat):
+            if (emotion, cat) not in emotion_index:
+                emotion_index[(emotion, cat)] = [i for i, name in enumerate(names) if emotion in name and cat == categories[i]]
+            return emotion_index[(emotion, cat)]
+
+        #setup two sets to keep track of the shapekeys that have been used
         #and the shapekeys currently in use
-        used = []
-        inUse = []
+        used = set()
         #These mouth shapekeys require the default teeth and tongue shapekeys to be active
         correctionList = ['_u_small_op', '_u_big_op', '_e_big_op', '_o_small_op', '_o_big_op', '_neko_op', '_triangle_op']
-        shapekey_block = bpy.data.shape_keys[c.get_body().data.shape_keys.name].key_blocks
-        
-        ACTIVE = 0.9
-        def activate_shapekey(key_act):
-            if shapekey_block.get(key_act) != None:
-                shapekey_block[key_act].value = ACTIVE
+
+        ACTIVE = np.float32(0.9)
+        def activate_shapekey(values, key_act):
+            if key_act in names:
+                values[names.index(key_act)] = ACTIVE
+
+        def mix_shapekeys(values):
+            '''Returns the coordinates shape_key_add(from_mix = True) would create with these shapekey values'''
+            mix = key_coords[0].copy()
+            for key_index in sorted(values):
+                if values[key_index] and key_index and not muted[key_index]:
+                    mix += values[key_index] * (key_coords[key_index] - key_coords[relative_keys[key_index]])
+            return mix
+
         #go through the keyblock list twice
         #Do eye shapekeys first then mouth shapekeys
         for type in ['Eyes_', 'Lips_']:
-            counter = len(shapekey_block)
-            for current_keyblock in shapekey_block:
-                counter = counter - 1
-                if (counter == 0):
-                    break
+            #the last shapekey in the list is never checked
+            for current_index in range(len(names) - 1):
+                current_name = names[current_index]
                 #categorize the shapekey (eye or mouth)
-                cat = whatCat(current_keyblock.name)
+                cat = categories[current_index]
+                if (cat == 'None') or ('KK' in current_name) or (type not in current_name):
+                    continue
                 #get the emotion from the shapekey name
-                if (cat != 'None') and ('KK' not in current_keyblock.name) and (type in current_keyblock.name):
-                    emotion = current_keyblock.name[current_keyblock.name.find("_"):]
-                    #go through every shapekey to check if any match the current shapekey's emotion
-                    for supporting_shapekey in shapekey_block:
-                        #If the's emotion matches the current one and is the correct category...
-                        if emotion in supporting_shapekey.name and cat == whatCat(supporting_shapekey.name):
-                            #and this key has hasn't been used yet activate it, else skip to the next
-                            if (supporting_shapekey.name not in used):
-                                supporting_shapekey.value = ACTIVE
-                                inUse.append(supporting_shapekey.name)
-                    #The shapekeys for the current emotion are now all active
-                    #Some need manual corrections
-                    correction_needed = False
-                    for cor in correctionList:
-                        if cor in current_keyblock.name:
-                            correction_needed = True
-                    if correction_needed:
-                        activate_shapekey('Fangs_default_op')
-                        activate_shapekey('Teeth_default_op')
-                        activate_shapekey('Tongue_default_op')
-                    if ('_e_small_op' in current_keyblock.name):
-                        activate_shapekey('Fangs_default_op')
-                        activate_shapekey('Lips_e_small_op')
-                    if ('_cartoon_mouth_op' in current_keyblock.name):
-                        activate_shapekey('Tongue_default_op')
-                        activate_shapekey('Lips_cartoon_mouth_op')
-                    if ('_smile_sharp_op' in current_keyblock.name and cat == 'Mouth'):
-                        if shapekey_block.get('Teeth_smile_sharp_op1') != None:
-                            shapekey_block['Teeth_smile_sharp_op1'].value = 0
-                        activate_shapekey('Lips_smile_sharp_op')
-                    if ('_eating_2_op' in current_keyblock.name):
-                        activate_shapekey('Fangs_default_op')
-                        activate_shapekey('Teeth_tongue_out_op')
-                        activate_shapekey('Tongue_serious_2_op')
-                        activate_shapekey('Lips_eating_2_op')
-                    if ('_i_big_op' in current_keyblock.name):
-                        activate_shapekey('Teeth_i_big_cl')
-                        activate_shapekey('Fangs_default_op')
-                        activate_shapekey('Lips_i_big_op')
-                    if ('_i_small_op' in current_keyblock.name):
-                        activate_shapekey('Teeth_i_small_cl')
-                        activate_shapekey('Fangs_default_op')
-                        activate_shapekey('Lips_i_small_op')
-                    if (current_keyblock.name not in used):
-                        c.get_body().shape_key_add(name=('KK ' + cat + emotion))
-                    #make sure this shapekey set isn't used again
-                    used.extend(inUse)
-                    inUse =[]
-                    #reset all shapekey values
-                    for reset_keyblock in shapekey_block:
-                        reset_keyblock.value = 0
-                #lazy crash prevention
-                if counter % 20 == 0:
-                    bpy.ops.wm.redraw_timer(type='DRAW_WIN_SWAP', iterations=1)
+                emotion = current_name[current_name.find("_"):]
+                #activate every shapekey that matches the current shapekey's emotion and category if it hasn't been used yet
+                values = {}
+                inUse = []
+                for key_index in get_members(emotion, cat):
+                    if key_index not in used:
+                        values[key_index] = ACTIVE
+                        inUse.append(key_index)
+                #The shapekeys for the current emotion are now all active
+                #Some need manual corrections
+                if any(cor in current_name for cor in correctionList):
+                    activate_shapekey(values, 'Fangs_default_op')
+                    activate_shapekey(values, 'Teeth_default_op')
+                    activate_shapekey(values, 'Tongue_default_op')
+                if ('_e_small_op' in current_name):
+                    activate_shapekey(values, 'Fangs_default_op')
+                    activate_shapekey(values, 'Lips_e_small_op')
+                if ('_cartoon_mouth_op' in current_name):
+                    activate_shapekey(values, 'Tongue_default_op')
+                    activate_shapekey(values, 'Lips_cartoon_mouth_op')
+                if ('_smile_sharp_op' in current_name and cat == 'Mouth'):
+                    if 'Teeth_smile_sharp_op1' in names:
+                        values[names.index('Teeth_smile_sharp_op1')] = 0
+                    activate_shapekey(values, 'Lips_smile_sharp_op')
+                if ('_eating_2_op' in current_name):
+                    activate_shapekey(values, 'Fangs_default_op')
+                    activate_shapekey(values, 'Teeth_tongue_out_op')
+                    activate_shapekey(values, 'Tongue_serious_2_op')
+                    activate_shapekey(values, 'Lips_eating_2_op')
+                if ('_i_big_op' in current_name):
+                    activate_shapekey(values, 'Teeth_i_big_cl')
+                    activate_shapekey(values, 'Fangs_default_op')
+                    activate_shapekey(values, 'Lips_i_big_op')
+                if ('_i_small_op' in current_name):
+                    activate_shapekey(values, 'Teeth_i_small_cl')
+                    activate_shapekey(values, 'Fangs_default_op')
+                    activate_shapekey(values, 'Lips_i_small_op')
+                if (current_index not in used):
+                    mix = mix_shapekeys(values)
+                    new_keyblock = body.shape_key_add(name=('KK ' + cat + emotion), from_mix=False)
+                    new_keyblock.data.foreach_set('co', mix)
+                    #keep track of the new shapekey so later emotions can find it the same way they would in the keyblock list
+                    names.append(new_keyblock.name)
+                    key_coords.append(mix)
+                    relative_keys.append(names.index(new_keyblock.relative_key.name))
+                    muted.append(False)
+                    categories.append(whatCat(new_keyblock.name))
+                    index_shapekey(len(names) - 1)
+                #make sure this shapekey set isn't used again
+                used.update(inUse)
+        body.data.update()
         
         #Delete all shapekeys that don't have a "KK" in their name
         #Don't delete the Basis shapekey though
@@ -486,23 +527,21 @@ class modify_mesh(bpy.types.Operator):
         except:
             c.kklog('Tear material did not exist.', 'warn')
             return
-        #Create a reverse shapekey for each tear material
-        c.switch(c.get_body(), 'edit')
+        body = c.get_body()
+        c.switch(body, 'object')
+        shapekey_block = body.data.shape_keys.key_blocks
+        vertex_count = len(body.data.vertices)
+        basis = np.empty(vertex_count * 3, dtype=np.float32)
+        shapekey_block[0].data.foreach_get('co', basis)
+        basis = basis.reshape(-1, 3)
+
         #Move tears and gag backwards on the basis shapekey
         #use head mesh as reference location
-        face_material = c.get_material_names('cf_O_face')
-        if face_material:
-            bpy.context.object.active_material_index = c.get_body().data.materials.find(face_material[0])
-        bpy.ops.object.material_slot_select()
-        #refresh selection, then get head location
-        bpy.ops.object.mode_set(mode = 'OBJECT')
-        bpy.ops.object.mode_set(mode = 'EDIT')
-        selected_verts = [v.co.y for v in c.get_body().data.vertices if v.select]
-        loc = 0
-        for y in selected_verts:
-            loc+=y
-        middle_of_head = loc / len(selected_verts)
-        c.switch(c.get_body(), 'edit')
+        face_mask = self.get_material_vertex_mask(body, c.get_material_names('cf_O_face'))
+        if not face_mask.any():
+            c.kklog('Face material was not found when creating tear shapekeys', 'warn')
+            return
+        middle_of_head = basis[face_mask, 1].mean(dtype=np.float64)
         tear_mats = {
             'cf_O_namida_L'     :     "Tears big",
             'cf_O_namida_M'     :     "Tears med",
@@ -511,96 +550,87 @@ class modify_mesh(bpy.types.Operator):
             'cf_O_gag_eye_01'   :     "Gag eye 01",
             'cf_O_gag_eye_02'   :     "Gag eye 02",
         }
+        tear_keys = []
         for cat in tear_mats:
             mats = c.get_material_names(cat)
             if 'cf_O_namida_M' in cat or 'cf_O_namida_S' in cat:
                 mats = [m + ('.001' if 'cf_O_namida_M' in cat else '.002') for m in mats] #tears share a material name, so add a .001
-            for mat in mats:
-                bpy.context.object.active_material_index = c.get_body().data.materials.find(mat)
-                bpy.ops.object.material_slot_select()
-        #refresh selection, then move tears a random amount backwards
-        bpy.ops.object.mode_set(mode = 'OBJECT')
-        bpy.ops.object.mode_set(mode = 'EDIT')
-        selected_verts = [v for v in c.get_body().data.vertices if v.select]
-        amount_to_move_tears_back = 2 * (selected_verts[0].co.y - middle_of_head)
-        bpy.ops.transform.translate(value=(0, abs(amount_to_move_tears_back), 0))
-        
+            tear_keys.extend([(tear_mats[cat], mat, self.get_material_vertex_mask(body, [mat])) for mat in mats])
+        tear_mask = np.zeros(vertex_count, dtype=bool)
+        for name, mat, mask in tear_keys:
+            tear_mask |= mask
+        if not tear_mask.any():
+            c.kklog('Tear materials were not found when creating tear shapekeys', 'warn')
+            return
+        #move the tears backwards based on the distance between the first tear vertex and the middle of the head
+        amount_to_move_tears_back = abs(2 * (basis[np.flatnonzero(tear_mask)[0], 1] - middle_of_head))
+        #moving the basis moves every shapekey that is relative to it, the same way it would in edit mode
+        for keyblock in shapekey_block[1:]:
+            if keyblock.relative_key == shapekey_block[0]:
+                key_coords = np.empty(vertex_count * 3, dtype=np.float32)
+                keyblock.data.foreach_get('co', key_coords)
+                key_coords = key_coords.reshape(-1, 3)
+                key_coords[tear_mask, 1] += amount_to_move_tears_back
+                keyblock.data.foreach_set('co', key_coords.ravel())
+        basis[tear_mask, 1] += amount_to_move_tears_back
+        shapekey_block[0].data.foreach_set('co', basis.ravel())
+        body.data.vertices.foreach_set('co', basis.ravel())
+
         #move the tears forwards again the same amount in individual new shapekeys
-        for cat in tear_mats:
-            mats = c.get_material_names(cat)
-            if 'cf_O_namida_M' in cat or 'cf_O_namida_S' in cat:
-                mats = [m + ('.001' if 'cf_O_namida_M' in cat else '.002') for m in mats] #tears share a material name, so add a .001
-            for mat in mats:
-                c.switch(c.get_body(), 'object')
-                bpy.ops.object.shape_key_add(from_mix = False)
-                c.get_body().data.shape_keys.key_blocks[-1].name = tear_mats[cat]
-                last_shapekey = len(c.get_body().data.shape_keys.key_blocks)-1
-                bpy.context.object.active_shape_key_index = last_shapekey
-                c.switch(c.get_body(), 'edit')
-                bpy.context.object.active_material_index = c.get_body().data.materials.find(mat)
-                if c.get_body().data.materials.find(mat) == -1:
-                    bpy.context.object.active_material_index += 1
-                else:
-                    bpy.context.object.active_material_index = c.get_body().data.materials.find(mat)
-                bpy.ops.object.material_slot_select()
-                #find a random vertex location of the tear and move it forwards
-                c.switch(c.get_body(), 'object')
-                selected_verts = [v for v in c.get_body().data.vertices if v.select]
-                bpy.ops.object.mode_set(mode = 'EDIT')
-                bpy.ops.transform.translate(value=(0, -1 * abs(amount_to_move_tears_back), 0))
-                c.switch(c.get_body(), 'object')
-                bpy.ops.object.shape_key_move(type='TOP' if tear_material_name in mat else 'BOTTOM')
+        for name, mat, mask in tear_keys:
+            if not mask.any():
+                c.kklog('Material wasn\'t found when creating tear shapekeys: ' + mat, 'warn')
+            new_keyblock = body.shape_key_add(name = name, from_mix = False)
+            key_coords = basis.copy()
+            key_coords[mask, 1] -= amount_to_move_tears_back
+            new_keyblock.data.foreach_set('co', key_coords.ravel())
+            body.active_shape_key_index = len(shapekey_block) - 1
+            if tear_material_name in mat:
+                bpy.ops.object.shape_key_move(type='TOP')
 
         #Move the Eye, eyewhite and eyeline materials back on the KK gageye shapekey
-        bpy.context.object.active_shape_key_index = bpy.context.object.data.shape_keys.key_blocks.find('KK Eyes_gageye')
-        c.switch(c.get_body(), 'edit')
-        for cat in [
-            'cf_Ohitomi_L',
-            'cf_Ohitomi_R', 
-            'cf_Ohitomi_L02',
-            'cf_Ohitomi_R02',
-            'cf_O_eyeline',
-            'cf_O_eyeline_low']:
-            mats = c.get_material_names(cat)
+        gageye = shapekey_block.get('KK Eyes_gageye')
+        if gageye:
+            mats = []
+            for cat in [
+                'cf_Ohitomi_L',
+                'cf_Ohitomi_R', 
+                'cf_Ohitomi_L02',
+                'cf_Ohitomi_R02',
+                'cf_O_eyeline',
+                'cf_O_eyeline_low']:
+                mats.extend(c.get_material_names(cat))
             #also append the duplicated eyewhite material
             mats.append('cf_m_sirome_00.001')
-            for mat in mats:
-                bpy.context.object.active_material_index = c.get_body().data.materials.find(mat)
-                bpy.ops.object.material_slot_select()
-        #find a random vertex location of the eye and move it backwards
-        c.switch(c.get_body(), 'object')
-        selected_verts = [v for v in c.get_body().data.vertices if v.select]
-        bpy.ops.object.mode_set(mode = 'EDIT')
-        bpy.ops.transform.translate(value=(0, 2.5 * abs(amount_to_move_tears_back), 0))
-        c.switch(c.get_body(), 'object')
+            eye_mask = self.get_material_vertex_mask(body, mats)
+            key_coords = np.empty(vertex_count * 3, dtype=np.float32)
+            gageye.data.foreach_get('co', key_coords)
+            key_coords = key_coords.reshape(-1, 3)
+            key_coords[eye_mask, 1] += 2.5 * amount_to_move_tears_back
+            gageye.data.foreach_set('co', key_coords.ravel())
+        body.data.update()
 
         #Merge the tear materials
-        c.switch(c.get_body(), 'edit')
         tear_mats = c.get_material_names('cf_O_namida_L')
         tear_mats.extend([c.get_material_names('cf_O_namida_M')[0] + '.001']) #tears share a material name, so add a .001
         tear_mats.extend([c.get_material_names('cf_O_namida_S')[0] + '.002']) #tears share a material name, so add a .002
+        tear_index = body.data.materials.find(tear_material_name)
+        material_index = np.empty(len(body.data.polygons), dtype=np.int32)
+        body.data.polygons.foreach_get('material_index', material_index)
         for mat in tear_mats:
-            bpy.context.object.active_material_index = c.get_body().data.materials.find(mat)
-            bpy.ops.object.material_slot_select()
-            bpy.context.object.active_material_index = c.get_body().data.materials.find(tear_material_name)
-            bpy.ops.object.material_slot_assign()
-            bpy.ops.mesh.select_all(action='DESELECT')
+            if body.data.materials.find(mat) > -1:
+                material_index[material_index == body.data.materials.find(mat)] = tear_index
+        body.data.polygons.foreach_set('material_index', material_index)
+        body.data.update()
 
         #make a vertex group that does not contain the tears
-        bpy.ops.object.vertex_group_add()
-        bpy.ops.mesh.select_all(action='SELECT')
-        c.get_body().vertex_groups.active.name = "Body without Tears"
-        bpy.context.object.active_material_index = c.get_body().data.materials.find(tear_material_name)
-        bpy.ops.object.material_slot_deselect()
-        bpy.context.object.active_material_index = c.get_body().data.materials.find(tear_material_name + '.001')
-        bpy.ops.object.material_slot_deselect()
-        bpy.context.object.active_material_index = c.get_body().data.materials.find(tear_material_name + '.002')
-        bpy.ops.object.material_slot_deselect()
-        bpy.ops.object.vertex_group_assign()
+        tear_mask = self.get_material_vertex_mask(body, [tear_material_name, tear_material_name + '.001', tear_material_name + '.002'])
+        vertex_group = body.vertex_groups.new(name = "Body without Tears")
+        vertex_group.add(np.flatnonzero(~tear_mask).tolist(), 1.0, 'REPLACE')
 
         #Separate tears from body object
         #link shapekeys of tears to body
-        tears = self.separate_materials(c.get_body(), tear_mats, 'Tears ' + c.get_name())
+        tears = self.separate_materials(body, tear_mats, 'Tears ' + c.get_name())
         tears['tears'] = True
         bpy.ops.object.mode_set(mode = 'OBJECT')
         link_keys(c.get_body(), [tears])
@@ -623,26 +653,22 @@ class modify_mesh(bpy.types.Operator):
             'Horizontal Line',
             'Cartoony Crying' 
         ]
+        bpy.ops.object.mode_set(mode = 'OBJECT')
         for key in gag_keys:
-            bpy.ops.object.mode_set(mode = 'OBJECT')
-            bpy.ops.object.shape_key_add(from_mix=False)
-            last_shapekey = len(c.get_body().data.shape_keys.key_blocks)-1
-            c.get_body().data.shape_keys.key_blocks[-1].name = key
-            bpy.context.object.active_shape_key_index = last_shapekey
+            c.get_body().shape_key_add(name = key, from_mix=False)
+            bpy.context.object.active_shape_key_index = len(c.get_body().data.shape_keys.key_blocks)-1
             bpy.ops.object.shape_key_move(type='TOP')
         
+        #every gag eye driver reads the same gag key variables
+        gag_variables = [{'name': key.replace(' ',''), 'type': 'SINGLE_PROP', 'targets': [{
+            'id_type': 'KEY',
+            'id': c.get_body().data.shape_keys,
+            'data_path': 'key_blocks["' + key + '"].value',
+            }]} for key in gag_keys]
+        driver_builder = c.DriverBuilder('gag eye shapekey drivers')
         def create_gag_eye_driver(keyblock: str, condition: str):
-            '''creates a gag eye driver'''
-            skey_driver = bpy.data.shape_keys[0].key_blocks[keyblock].driver_add('value')
-            skey_driver.driver.type = 'SCRIPTED'
-            for key in gag_keys:
-                newVar = skey_driver.driver.variables.new()
-                newVar.name = key.replace(' ','')
-                newVar.type = 'SINGLE_PROP'
-                newVar.targets[0].id_type = 'KEY'
-                newVar.targets[0].id = c.get_body().data.shape_keys
-                newVar.targets[0].data_path = 'key_blocks["' + key + '"].value' 
-            skey_driver.driver.expression = condition
+            '''queues a gag eye driver'''
+            driver_builder.add(bpy.data.shape_keys[0].key_blocks[keyblock], 'value', None, 'SCRIPTED', condition, gag_variables)
 
         bpy.context.object.active_shape_key_index = 0
         #make most gag eye shapekeys activate the body's gag key if the KK gageeye shapekey was created
@@ -652,20 +678,15 @@ class modify_mesh(bpy.types.Operator):
             create_gag_eye_driver('Gag eye 00', '1 if CircleEyes1 or CircleEyes2 or VerticalLine or CartoonyClosed or HorizontalLine else 0' )
             create_gag_eye_driver('Gag eye 01', '1 if HeartEyes or SpiralEyes else 0' )
             create_gag_eye_driver('Gag eye 02', '1 if FieryEyes or CartoonyWink or CartoonyCrying else 0' )
+            driver_builder.build()
 
             #make a vertex group that does not contain the gag_eyes
-            bpy.ops.object.vertex_group_add()
-            c.switch(c.get_body(), 'edit')
-            bpy.ops.mesh.select_all(action='SELECT')
-            c.get_body().vertex_groups.active.name = "Body without Gag eyes"
-
             mats = c.get_material_names('cf_O_gag_eye_00')
             mats.extend(c.get_material_names('cf_O_gag_eye_01'))
             mats.extend(c.get_material_names('cf_O_gag_eye_02'))
-            for gag_mat in mats:
-                bpy.context.object.active_material_index = c.get_body().data.materials.find(gag_mat)
-                bpy.ops.object.material_slot_deselect()
-            bpy.ops.object.vertex_group_assign()
+            gag_mask = self.get_material_vertex_mask(c.get_body(), mats)
+            vertex_group = c.get_body().vertex_groups.new(name = "Body without Gag eyes")
+            vertex_group.add(np.flatnonzero(~gag_mask).tolist(), 1.0, 'REPLACE')
 
             #Separate gag from body object
             #link shapekeys of gag to body
@@ -676,26 +697,171 @@ class modify_mesh(bpy.types.Operator):
             link_keys(c.get_body(), [gag])
         c.print_timer('create_gag_eye_shapekeys')
 
+    def prune_shapekeys(self, threshold = 1e-5, clamp_deltas = False):
+        '''Removes KK shapekeys on the body that don't move any vertex more than the threshold.
+        If clamp_deltas is True, vertex offsets smaller than the threshold are set to exactly zero on the remaining KK shapekeys
+        so exporters can write sparse morph targets'''
+        if bpy.context.scene.kkbp.shapekeys_dropdown != 'A':
+            return
+        body = c.get_body()
+        if not body.data.shape_keys:
+            return
+        c.switch(body, 'object')
+        shapekey_block = body.data.shape_keys.key_blocks
+
+        #don't touch shapekeys that have a driver or are used by a driver (the tears, gag eyes and gag eye controls)
+        driven = set()
+        for shapekey in bpy.data.shape_keys:
+            if not shapekey.animation_data:
+                continue
+            for fcurve in shapekey.animation_data.drivers:
+                if shapekey == body.data.shape_keys:
+                    driven.add(fcurve.data_path)
+                for variable in fcurve.driver.variables:
+                    for target in variable.targets:
+                        if target.id == body.data.shape_keys:
+                            driven.add(target.data_path)
+        def is_driven(keyblock):
+            return any(keyblock.path_from_id() in data_path for data_path in driven)
+
+        vertex_count = len(body.data.vertices)
+        coords = {}
+        def get_coords(keyblock):
+            if keyblock.name not in coords:
+                coords[keyblock.name] = np.empty(vertex_count * 3, dtype=np.float32)
+                keyblock.data.foreach_get('co', coords[keyblock.name])
+            return coords[keyblock.name]
+
+        remove_list = []
+        clamped = 0
+        for keyblock in shapekey_block[1:]:
+            if 'KK ' not in keyblock.name or is_driven(keyblock):
+                continue
+            relative = get_coords(keyblock.relative_key)
+            delta = (get_coords(keyblock) - relative).reshape(-1, 3)
+            magnitude = np.linalg.norm(delta, axis = 1)
+            if magnitude.max(initial = 0) < threshold:
+                remove_list.append(keyblock)
+            elif clamp_deltas:
+                tiny = (magnitude > 0) & (magnitude < threshold)
+                if tiny.any():
+                    #only move the clamped vertices back onto the relative key. The rest are written back exactly as they were read
+                    co = get_coords(keyblock).reshape(-1, 3)
+                    co[tiny] = relative.reshape(-1, 3)[tiny]
+                    keyblock.data.foreach_set('co', co.ravel())
+                    clamped += int(tiny.sum())
+
+        for keyblock in remove_list:
+            body.shape_key_remove(keyblock)
+        body.active_shape_key_index = 0
+        c.kklog('Removed {} empty shapekeys and clamped {} tiny shapekey offsets'.format(len(remove_list), clamped))
+        c.print_timer('prune_shapekeys')
+
     def remove_body_seams(self):
-        '''merge certain materials for the body object to prevent odd shading issues later on'''
+        '''merge certain materials for the body object to prevent odd shading issues later on.
+        Coincident vertices are welded with bmesh into the lowest index vertex, which keeps its own vertex group weights like remove doubles did.
+        The normals of the welded vertices are averaged.
+        The body topology is consistent across imports according to https://github.com/FlailingFog/KK-Blender-Porter-Pack/issues/82
+        so the vertex pairs are cached by a signature of the body topology'''
         if not bpy.context.scene.kkbp.fix_seams:
             return
-        c.switch(c.get_body(), 'edit')
+        body = c.get_body()
+        c.switch(body, 'object')
+        mesh = body.data
         mats = c.get_material_names('cf_O_face')
         mats.extend(c.get_material_names('o_body_a'))
+        seam_mask = self.get_material_vertex_mask(body, mats)
+        if not seam_mask.any():
+            c.kklog('Body materials were not found when removing seams', 'warn')
+            return
 
-        bpy.context.tool_settings.mesh_select_mode = (True, False, False) #enable vertex select in edit mode
-        for mat in mats:
-            bpy.context.object.active_material_index = c.get_body().data.materials.find(mat)
-            bpy.ops.object.material_slot_select()
-        bpy.ops.mesh.remove_doubles(threshold=0.00001)
+        coords = np.empty(len(mesh.vertices) * 3, dtype=np.float32)
+        mesh.vertices.foreach_get('co', coords)
+        coords = coords.reshape(-1, 3)
+        loop_vertex = np.empty(len(mesh.loops), dtype=np.int32)
+        mesh.loops.foreach_get('vertex_index', loop_vertex)
+        #the version prefix keeps pairs cached before the seams were grouped by connected component from being reused
+        signature = hashlib.sha1(b'2' + np.int64(len(mesh.vertices)).tobytes() + loop_vertex.tobytes() + np.packbits(seam_mask).tobytes()).hexdigest()
+
+        #use the cached vertex pairs if they still line up, otherwise find them again with a kdtree
+        seam_cache = c.load_cache_file('seam_cache.json')
+        pairs = np.array(seam_cache.get(signature, []), dtype=np.int64).reshape(-1, 2)
+        #a chain of near vertices can put a removed vertex up to one threshold per link away from the one it's welded into
+        links = np.bincount(pairs[:, 0], minlength = len(mesh.vertices))[pairs[:, 0]] if len(pairs) else None
+        if not len(pairs) or pairs.max() >= len(mesh.vertices) or (np.linalg.norm(coords[pairs[:, 0]] - coords[pairs[:, 1]], axis = 1) > SEAM_THRESHOLD * links).any():
+            pairs = self.find_seam_pairs(coords, seam_mask)
+            seam_cache[signature] = pairs.tolist()
+            c.save_cache_file('seam_cache.json', seam_cache)
+        else:
+            c.kklog('Using cached body seam vertices')
+        if not len(pairs):
+            c.print_timer('remove_body_seams')
+            return
 
-        # This operation still messes with the weights.
-        # Maybe it's possible to save the 3D positions, weights, and UV positions for each duplicate vertex
-        # then delete and make new vertices with saved info 
-        # The vertices on the body object seem to be consistent across imports according to https://github.com/FlailingFog/KK-Blender-Porter-Pack/issues/82
+        #every vertex is welded into the lowest index in its group
+        target = np.arange(len(mesh.vertices))
+        target[pairs[:, 1]] = pairs[:, 0]
+
+        #average the loop normals around each welded vertex
+        normals = None
+        if mesh.has_custom_normals:
+            normals = np.empty(len(mesh.loops) * 3, dtype=np.float32)
+            if bpy.app.version < (4, 1, 0):
+                mesh.calc_normals_split()
+                mesh.loops.foreach_get('normal', normals)
+            else:
+                mesh.corner_normals.foreach_get('vector', normals)
+            normals = normals.reshape(-1, 3)
+            welded_loops = np.isin(target[loop_vertex], pairs[:, 0])
+            normal_sums = np.zeros((len(mesh.vertices), 3), dtype=np.float64)
+            np.add.at(normal_sums, target[loop_vertex[welded_loops]], normals[welded_loops])
+            averaged = normal_sums[target[loop_vertex[welded_loops]]]
+            normals[welded_loops] = averaged / np.maximum(np.linalg.norm(averaged, axis = 1), 1e-12)[:, None]
+
+        bm = bmesh.new()
+        bm.from_mesh(mesh)
+        bm.verts.ensure_lookup_table()
+        #the kept vertex keeps its own weights, so the deformation around the neck is the same as with remove doubles
+        bmesh.ops.weld_verts(bm, targetmap = {bm.verts[remove]: bm.verts[keep] for keep, remove in pairs.tolist()})
+        bm.to_mesh(mesh)
+        bm.free()
+
+        if normals is not None:
+            if len(mesh.loops) == len(normals):
+                mesh.normals_split_custom_set(normals.tolist())
+            else:
+                c.kklog('Body faces changed while removing seams, so the normals were not merged', 'warn')
+        mesh.update()
+        c.kklog('Welded {} body seam vertices'.format(len(pairs)))
         c.print_timer('remove_body_seams')
 
+    @staticmethod
+    def find_seam_pairs(coords: np.ndarray, seam_mask: np.ndarray) -> np.ndarray:
+        '''Returns an array of (keep, remove) vertex index pairs for all of the vertices in seam_mask that are at the same location.
+        Vertices within the threshold of each other are grouped by connected component, so a chain where a is near b and b is near c
+        is welded together even if a and c are further apart. Each vertex is paired with the lowest index vertex in its group'''
+        seam_vertices = np.flatnonzero(seam_mask)
+        kd = kdtree.KDTree(len(seam_vertices))
+        for index in seam_vertices.tolist():
+            kd.insert(coords[index].tolist(), index)
+        kd.balance()
+        #union find, with every group rooted at its lowest index
+        root = {}
+        def find(index):
+            root.setdefault(index, index)
+            while root[index] != index:
+                root[index] = root[root[index]]
+                index = root[index]
+            return index
+        for index in seam_vertices.tolist():
+            for co, other, distance in kd.find_range(coords[index].tolist(), SEAM_THRESHOLD):
+                if other != index:
+                    first, second = find(index), find(other)
+                    if first != second:
+                        root[max(first, second)] = min(first, second)
+        pairs = sorted((find(index), index) for index in root if find(index) != index)
+        return np.array(pairs, dtype=np.int64).reshape(-1, 2)
+
     def mark_body_freestyle_faces(self):
         c.switch(c.get_body(), 'edit')
         #mark certain materials as freestyle faces
@@ -758,6 +924,31 @@ class modify_mesh(bpy.types.Operator):
             bpy.ops.object.mode_set(mode = 'OBJECT')
             return None
 
+    @staticmethod
+    def get_material_vertex_mask(object: bpy.types.Object, mat_list: list[str]) -> np.ndarray:
+        '''Returns a boolean array that is True for every vertex used by a face with one of the materials in mat_list.
+        This is the same set of vertices bpy.ops.object.material_slot_select() would select'''
+        mesh = object.data
+        mask = np.zeros(len(mesh.vertices), dtype=bool)
+        material_indexes = [mesh.materials.find(mat) for mat in mat_list if mesh.materials.find(mat) > -1]
+        if not material_indexes:
+            return mask
+        material_index = np.empty(len(mesh.polygons), dtype=np.int32)
+        loop_start = np.empty(len(mesh.polygons), dtype=np.int32)
+        loop_total = np.empty(len(mesh.polygons), dtype=np.int32)
+        mesh.polygons.foreach_get('material_index', material_index)
+        mesh.polygons.foreach_get('loop_start', loop_start)
+        mesh.polygons.foreach_get('loop_total', loop_total)
+        loop_vertex = np.empty(len(mesh.loops), dtype=np.int32)
+        mesh.loops.foreach_get('vertex_index', loop_vertex)
+        #expand the selected faces into their loops, then mark the vertices of those loops
+        selected = np.isin(material_index, material_indexes)
+        starts = loop_start[selected]
+        totals = loop_total[selected]
+        offsets = np.arange(totals.sum()) - np.repeat(np.cumsum(totals) - totals, totals)
+        mask[loop_vertex[np.repeat(starts, totals) + offsets]] = True
+        return mask
+
     def delete_materials(self, object: bpy.types.Object, mat_list: bpy.types.Material):
         '''Deletes the materials in mat_list from object'''
         for mat in mat_list:
@@ -22,15 +22,22 @@ class post_operations(bpy.types.Operator):
     bl_description = bl_idname
     bl_options = {'REGISTER', 'UNDO'}
     
+    @c.profile('post_operations', 'operator')
     def execute(self, context):
         try:
             self.hide_unused_objects()
+            c.print_timer('hide_unused_objects')
 
             self.apply_cycles()
+            c.print_timer('apply_cycles')
             self.apply_eeveemod()
+            c.print_timer('apply_eeveemod')
             self.apply_rigify()
+            c.print_timer('apply_rigify')
             self.apply_sfw()
+            c.print_timer('apply_sfw')
             self.separate_meshes()
+            c.print_timer('separate_meshes')
             
             c.clean_orphaned_data()
             c.set_viewport_shading('SOLID')
@@ -6,6 +6,8 @@ translation_dictionary = {
 
     'seams'     : "Fix body seams",
     'seams_tt'  : 'This performs a "remove doubles" operation on the body materials. Removing doubles screws with the weights around certain areas. Disabling this will preserve the weights, but may cause seams to appear around the neck and down the chest when the outline modifier is on',
+    'clamp_shapekeys'    : "Clamp tiny shapekey offsets",
+    'clamp_shapekeys_tt' : "Set vertex offsets too small to see to exactly zero on the KK shapekeys so exporters can write sparse morph targets. This changes the vertex data of those shapekeys",
     
     'outline'     : 'Use single outline',
     'outline_tt'  : "Enable to use one generic outline material as opposed to using several unique ones. Checking this may cause outline transparency issues",
@@ -78,6 +80,14 @@ translation_dictionary = {
     'bake_norm_tt'  : "Finalize normal version of all textures",
     'bake_mult'     : 'Finalize multiplier',
     'bake_mult_tt'  : "Set this to 2 or 3 if the finalized texture is blurry",
+    'memory_budget' : 'Memory budget (MB)',
+    'memory_budget_tt' : 'Stop finalizing the materials if Blender uses more memory than this many megabytes. Set to 0 to disable the limit',
+    'bake_workers'  : 'Bake workers',
+    'bake_workers_tt' : 'Split the finalization between this many background Blender processes. Each one uses its own copy of the scene, so more workers need more memory',
+    'adaptive_bake' : 'Adaptive resolution',
+    'adaptive_bake_tt' : 'Only render the part of the UV map each material uses. This makes finalizing faster and the atlas smaller for materials that only cover a small area of their texture. Only used when Create atlas is enabled, because the cropped images only line up with the atlas UVs. Export the atlas model when this is on',
+    'aov_bake'      : 'Single render',
+    'aov_bake_tt'   : 'Render the light, dark and normal versions of each material at the same time using shader AOVs instead of rendering each material three times',
     'old_bake'      : 'Use V4 baker',
     'old_bake_tt'   : 'Enable to use the old finalization system. This system will not bake any extra UV maps like hair shine or eyeshadow, but it may help if you are encountering corruption in the finalized images',
 
@@ -134,6 +144,8 @@ translation_dictionary = {
     'use_atlas' : 'Create atlas',
     'use_atlas_tt': 'Enable this to create a material atlas when finalizing materials',
     'dont_use_atlas' : 'Don\'t create Atlas',
+    'atlas_page_size' : 'Atlas page size',
+    'atlas_page_size_tt' : 'The largest width and height of an atlas image in pixels. Materials that don\'t fit on one atlas are split across several atlas images. UE5 imports textures up to 16384 pixels',
 
     'mat_comb_tt' : 'KKBP uses parts of Shotariya\'s Material Combiner addon to automatically merge your materials into an atlas. Click this if you want to manually combine your materials instead of letting KKBP do it for you (requires you to download the Material Combiner addon. Also, make sure you have already clicked the Finalize Materials button in the KKBP panel or it will not work) ',
     'matcomb' : 'Setup materials for Material Combiner',
@@ -0,0 +1,33 @@
+'''
+Compiles a translation dictionary into a single regex so a name can be translated in one pass.
+Does not depend on bpy, so it can be reused by anything that needs to rename things with a dictionary.
+'''
+
+import re
+from typing import Callable
+
+def compile_translation(translation_dict: dict[str, str]) -> Callable[[str], str]:
+    '''Returns a function that replaces every key of translation_dict found in a string with its value.
+    The keys are matched longest first in a single pass over the string.
+    Keys that begin and end with an underscore (like "_egao_") share their trailing underscore
+    with the next key (like "_s_"), so "_egao_s_" becomes "_smile_small_" the same way chained str.replace() calls would'''
+    if not translation_dict:
+        return lambda text: text
+    replacements = {}
+    for key, value in translation_dict.items():
+        if len(key) > 1 and key.endswith('_') and value.endswith('_'):
+            #don't consume the trailing underscore so the next key can still match it
+            replacements[key[:-1]] = (value[:-1], True)
+        else:
+            replacements[key] = (value, False)
+    #longest keys first so "_uresi_ss" is matched before "_uresi"
+    keys = sorted(replacements, key = len, reverse = True)
+    patterns = [re.escape(key) + ('(?=_)' if replacements[key][1] else '') for key in keys]
+    regex = re.compile('|'.join(patterns))
+
+    def replace(match: re.Match) -> str:
+        return replacements[match.group(0)][0]
+
+    def translate(text: str) -> str:
+        return regex.sub(replace, text)
+    return translate
@@ -1,7 +1,7 @@
 #The preferences for the plugin 
 
 import bpy
-from bpy.props import BoolProperty, EnumProperty, StringProperty
+from bpy.props import BoolProperty, EnumProperty, StringProperty, IntProperty
 
 from .interface.dictionary_en import t
 
@@ -17,6 +17,10 @@ class KKBPPreferences(bpy.types.AddonPreferences):
     fix_seams : BoolProperty(
     description=t('seams_tt'),
     default = True)
+
+    clamp_shapekeys : BoolProperty(
+    description=t('clamp_shapekeys_tt'),
+    default = False)
     
     use_single_outline : BoolProperty(
     description= t('outline_tt'),
@@ -53,10 +57,33 @@ class KKBPPreferences(bpy.types.AddonPreferences):
     description=t('use_atlas'),
     default = False)
 
+    atlas_page_size : IntProperty(
+    description=t('atlas_page_size_tt'),
+    min = 1024, max = 16384,
+    default = 8192)
+
     delete_cache : BoolProperty(
     description=t('delete_cache'),
     default = False)
 
+    memory_budget : IntProperty(
+    description=t('memory_budget_tt'),
+    min = 0,
+    default = 0)
+
+    bake_workers : IntProperty(
+    description=t('bake_workers_tt'),
+    min = 1, max = 16,
+    default = 1)
+
+    adaptive_bake : BoolProperty(
+    description=t('adaptive_bake_tt'),
+    default = False)
+
+    aov_bake : BoolProperty(
+    description=t('aov_bake_tt'),
+    default = False)
+
     prep_dropdown : EnumProperty(
         items=(
             ("A", t('prep_drop_A'), t('prep_drop_A_tt')),
@@ -131,6 +158,10 @@ class KKBPPreferences(bpy.types.AddonPreferences):
         split = row.split(align = True, factor=splitfac)
         split.prop(self, "use_single_outline", toggle=True, text = t('outline'))
         split.prop(self, "sfw_mode", toggle=True, text = t('sfw_mode'))
+
+        row = col.row(align=True)
+        split = row.split(align = True, factor=splitfac)
+        split.prop(self, "clamp_shapekeys", toggle=True, text = t('clamp_shapekeys'))
         
         col = layout.column(align=True)
         row = col.row(align=True)
@@ -141,6 +172,15 @@ class KKBPPreferences(bpy.types.AddonPreferences):
         row = col.row(align=True)
         split = row.split(align=True, factor=splitfac)
         split.prop(self, 'old_bake_bool', toggle=True, text = t('old_bake'))
+        split.prop(self, "memory_budget", text = t('memory_budget'))
+        row = col.row(align=True)
+        split = row.split(align=True, factor=splitfac)
+        split.prop(self, "bake_workers", text = t('bake_workers'))
+        split.prop(self, "adaptive_bake", toggle=True, text = t('adaptive_bake'))
+        row = col.row(align=True)
+        split = row.split(align=True, factor=splitfac)
+        split.prop(self, "aov_bake", toggle=True, text = t('aov_bake'))
+        split.prop(self, "atlas_page_size", text = t('atlas_page_size'))
         row = col.row(align = True)
         split = row.split(align=True, factor=splitfac)
         split.prop(self, "use_atlas", toggle=True, text = t('use_atlas'))
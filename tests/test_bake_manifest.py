@@ -0,0 +1,86 @@
+'''
+Tests for the bake manifest fingerprints in exporting/bakematerials.py. The module needs Blender, so only the
+BakeManifest class is read out of the file and run against plain python stand-ins for the materials and node trees.
+'''
+
+import __future__
+import ast
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def load_bake_manifest():
+    path = os.path.join(ROOT, 'exporting', 'bakematerials.py')
+    with open(path, encoding = 'utf-8') as file:
+        tree = ast.parse(file.read())
+    class_node = next(node for node in tree.body if isinstance(node, ast.ClassDef) and node.name == 'BakeManifest')
+    #the annotations name bpy types, so they are left unevaluated
+    code = compile(ast.Module(body = [class_node], type_ignores = []), path, 'exec', flags = __future__.annotations.compiler_flag, dont_inherit = True)
+    namespace = {'os': os, 'json': json, 'hashlib': hashlib}
+    exec(code, namespace)
+    return namespace['BakeManifest']
+
+BakeManifest = load_bake_manifest()
+
+class Socket:
+    is_linked = False
+    def __init__(self, default_value):
+        self.default_value = default_value
+
+class Node:
+    type = 'VALUE'
+    bl_idname = 'ShaderNodeValue'
+    def __init__(self, name, value):
+        self.name = name
+        self.inputs = []
+        self.outputs = [Socket(value)]
+
+class NodeTree:
+    def __init__(self, value):
+        #every material's embedded tree has this name
+        self.name = 'Shader Nodetree'
+        self.nodes = [Node('Value', value)]
+        self.links = []
+    def as_pointer(self):
+        return id(self)
+
+class Material:
+    def __init__(self, name, value):
+        self.name = name
+        self.node_tree = NodeTree(value)
+
+class TestBakeManifest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors = True)
+
+    def fingerprints(self, materials):
+        manifest = BakeManifest(self.folder)
+        return [manifest.get_fingerprint(material, 'light', ['settings']) for material in materials]
+
+    def test_same_tree_name_different_values(self):
+        first, second = self.fingerprints([Material('body', 0.5), Material('hair', 0.25)])
+        self.assertNotEqual(first, second)
+
+    def test_every_edited_material_is_changed(self):
+        materials = [Material('body', 0.5), Material('hair', 0.5)]
+        before = self.fingerprints(materials)
+        for material in materials:
+            material.node_tree.nodes[0].outputs[0].default_value = 0.75
+            after = self.fingerprints(materials)
+            self.assertNotEqual(before[materials.index(material)], after[materials.index(material)])
+            material.node_tree.nodes[0].outputs[0].default_value = 0.5
+
+    def test_unchanged_material_is_reused(self):
+        materials = [Material('body', 0.5), Material('hair', 0.25)]
+        self.assertEqual(self.fingerprints(materials), self.fingerprints(list(reversed(materials)))[::-1])
+
+if __name__ == '__main__':
+    unittest.main()
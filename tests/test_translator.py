@@ -0,0 +1,83 @@
+'''
+Tests for interface/translator.py. These run without Blender, so the modules are loaded straight from their files
+and the shapekey table is read out of importing/modifymesh.py without importing bpy.
+Run with "python -m pytest" or "python -m unittest discover -s tests" from the repo root
+'''
+
+import ast
+import importlib.util
+import os
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def load_translator():
+    spec = importlib.util.spec_from_file_location('kkbp_translator', os.path.join(ROOT, 'interface', 'translator.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def load_shapekey_translation_dict() -> dict:
+    with open(os.path.join(ROOT, 'importing', 'modifymesh.py'), encoding = 'utf-8') as file:
+        tree = ast.parse(file.read())
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and any(getattr(target, 'id', None) == 'shapekey_translation_dict' for target in node.targets):
+            return ast.literal_eval(node.value)
+    raise LookupError('shapekey_translation_dict was not found in modifymesh.py')
+
+def sequential_replace(translation_dict: dict, text: str) -> str:
+    '''The chained str.replace loop modify_mesh used before the table was compiled'''
+    for key in translation_dict:
+        if 'gageye' not in text:
+            text = text.replace(key, translation_dict[key])
+    return text
+
+compile_translation = load_translator().compile_translation
+shapekey_translation_dict = load_shapekey_translation_dict()
+
+class TestCompileTranslation(unittest.TestCase):
+    def test_empty_dictionary(self):
+        self.assertEqual(compile_translation({})('eye_face.f00_def_op'), 'eye_face.f00_def_op')
+
+    def test_longest_key_first(self):
+        translate = compile_translation({'_uresi': '_happy', '_uresi_ss': '_happy_slight'})
+        self.assertEqual(translate('kuti_uresi_ss'), 'kuti_happy_slight')
+        self.assertEqual(translate('kuti_uresi'), 'kuti_happy')
+
+    def test_shared_trailing_underscore(self):
+        #the trailing underscore of "_egao_" is left for "_s_" to match
+        translate = compile_translation({'_egao_': '_smile_', '_s_': '_small_'})
+        self.assertEqual(translate('eye_face.f00_egao_s_op'), 'eye_face.f00_smile_small_op')
+        #a key that keeps its underscore only matches when the underscore is there
+        self.assertEqual(translate('eye_face.f00_egao'), 'eye_face.f00_egao')
+
+    def test_odoro_s_rename(self):
+        #pins the new name of the moderately shocked eye shapekey. It is listed in the changelog because it renames an exported morph target
+        translate = compile_translation(shapekey_translation_dict)
+        self.assertEqual(translate('eye_face.f00_odoro_s_op'), 'Eyes_shocked_moderate_op')
+        self.assertEqual(translate('eye_face.f00_odoro_op'), 'Eyes_shocked_op')
+        #the old loop replaced "_odoro_" first, so "_odoro_s_" was never reached
+        self.assertEqual(sequential_replace(shapekey_translation_dict, 'eye_face.f00_odoro_s_op'), 'Eyes_shocked_small_op')
+
+    def test_matches_sequential_replace(self):
+        translate = compile_translation(shapekey_translation_dict)
+        prefixes = ['eye_face.f00', 'kuti_face.f00', 'mayuge.mayu00', 'eye_nose.nl00', 'kuti_ha.ha00', 'namida_l', 'eye_naM.naM00']
+        #"_odoro_" is left out because of the _odoro_s_ fix above. "_s_" and "_l_" are size suffixes, so they only follow another emotion
+        suffixes = ['_s_', '_l_']
+        emotions = [key for key in shapekey_translation_dict if key.startswith('_') and key not in suffixes + ['_odoro_', '_odoro_s_']]
+        #modify_mesh skips names that already contain "gageye", so those never reach the translator
+        names = ['T_Default', 'tang.001', 'eye_face.f00_gag']
+        for prefix in prefixes:
+            names.append(prefix + '_op')
+            for emotion in emotions:
+                names.append(prefix + emotion + 'op')
+                names.append(prefix + emotion + 'cl')
+                for suffix in suffixes:
+                    if emotion.endswith('_'):
+                        names.append(prefix + emotion[:-1] + suffix + 'op')
+        for name in names:
+            with self.subTest(name = name):
+                self.assertEqual(translate(name), sequential_replace(shapekey_translation_dict, name))
+
+if __name__ == '__main__':
+    unittest.main()